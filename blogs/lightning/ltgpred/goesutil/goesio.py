@@ -14,25 +14,37 @@ from __future__ import division
 from __future__ import print_function
 from datetime import datetime
 from datetime import timedelta
+import hashlib
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import os.path
-import shutil
 import tempfile
 import threading
 from netCDF4 import Dataset
 import numpy as np
 import pyresample as pr
 from retrying import retry
+from scipy.spatial import cKDTree
 import google.cloud.storage as gcs
 
 GOES_PUBLIC_BUCKET = 'gcp-public-data-goes-16'
 RETRY_MIN_MSECS = 100
 RETRY_MAX_MSECS = 10000
+EARTH_RADIUS_METERS = 6370997.0  # same sphere as pyresample's kd_tree
+FETCH_THREADS = 16
+BLOB_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'goes_blob_cache')
+BLOB_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+_resample_cache = {}
+_resample_cache_lock = threading.Lock()
 
 _gcs_client = None
 _gcs_client_lock = threading.Lock()
 
+_blob_fetcher = None
+_blob_fetcher_lock = threading.Lock()
+
 
 def cached_gcs_client():
   global _gcs_client
@@ -117,6 +129,181 @@ def copy_fromgcs(blob_path, destdir):
   return dest
 
 
+@retry(
+    wait_exponential_multiplier=RETRY_MIN_MSECS,
+    wait_exponential_max=RETRY_MAX_MSECS,
+    retry_on_exception=reset_gcs_client_and_retry)
+def read_gcs_bytes(blob_path):
+  """read the contents of a GCS blob into memory.
+
+  Args:
+    blob_path (string): source file, Blob.path URL
+
+  Returns:
+    contents as bytes
+  """
+  bucket, object_id = parse_blobpath(blob_path)
+  bucket = cached_gcs_client().get_bucket(bucket)
+  logging.info('Downloading %s', os.path.basename(object_id))
+  return bucket.blob(object_id).download_as_string()
+
+
+class GcsBackend(object):
+  """Reads blobs from Google Cloud Storage."""
+
+  def read(self, blob_path):
+    return read_gcs_bytes(blob_path)
+
+
+class LocalDirBackend(object):
+  """Reads blobs from a local directory laid out as rootdir/bucket/object.
+
+  Useful to stand in for the public GOES bucket in tests or offline.
+
+  Args:
+    rootdir (string): local directory mirroring one or more buckets
+  """
+
+  def __init__(self, rootdir):
+    self.rootdir = rootdir
+
+  def local_path(self, blob_path):
+    bucket, object_id = parse_blobpath(blob_path)
+    return os.path.join(self.rootdir, bucket, *object_id.split('/'))
+
+  def read(self, blob_path):
+    with open(self.local_path(blob_path), 'rb') as ifp:
+      return ifp.read()
+
+
+class BlobCache(object):
+  """Bounded on-disk least-recently-used cache of blob contents.
+
+  Entries are keyed by blob path. A file's modification time records when
+  it was last used, so the cache survives process restarts.
+
+  Args:
+    cachedir (string): local directory, created if needed
+    max_bytes (int): evict least recently used entries beyond this size
+  """
+
+  def __init__(self, cachedir=BLOB_CACHE_DIR, max_bytes=BLOB_CACHE_MAX_BYTES):
+    self.cachedir = cachedir
+    self.max_bytes = max_bytes
+    self._lock = threading.Lock()
+    if not os.path.isdir(cachedir):
+      try:
+        os.makedirs(cachedir)
+      except OSError:
+        if not os.path.isdir(cachedir):
+          raise
+
+  def _filename(self, blob_path):
+    key = hashlib.sha1(blob_path.encode('utf-8')).hexdigest()
+    return os.path.join(self.cachedir, key)
+
+  def get(self, blob_path):
+    """Return the cached contents of blob_path, or None."""
+    filename = self._filename(blob_path)
+    try:
+      with open(filename, 'rb') as ifp:
+        contents = ifp.read()
+      os.utime(filename, None)  # mark as recently used
+      return contents
+    except (IOError, OSError):
+      return None
+
+  def put(self, blob_path, contents):
+    """Store contents of blob_path, evicting old entries if necessary."""
+    if len(contents) > self.max_bytes:
+      return
+    filename = self._filename(blob_path)
+    fd, tmpname = tempfile.mkstemp(dir=self.cachedir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as ofp:
+      ofp.write(contents)
+    os.rename(tmpname, filename)  # atomic, so readers never see partial files
+    self._evict()
+
+  def _evict(self):
+    with self._lock:
+      entries = []
+      for name in os.listdir(self.cachedir):
+        if name.endswith('.tmp'):
+          continue
+        try:
+          stat = os.stat(os.path.join(self.cachedir, name))
+        except OSError:
+          continue  # removed by another thread
+        entries.append((stat.st_mtime, stat.st_size, name))
+      total = sum(entry[1] for entry in entries)
+      for _, size, name in sorted(entries):
+        if total <= self.max_bytes:
+          break
+        try:
+          os.remove(os.path.join(self.cachedir, name))
+        except OSError:
+          pass
+        total -= size
+
+
+class BlobFetcher(object):
+  """Fetches blob contents in parallel through an optional on-disk cache.
+
+  Args:
+    backend: object with a read(blob_path) method returning bytes
+    cache (BlobCache): or None to always go to the backend
+    num_threads (int): number of concurrent downloads in fetch_many
+  """
+
+  def __init__(self, backend=None, cache=None, num_threads=FETCH_THREADS):
+    self.backend = backend if backend is not None else GcsBackend()
+    self.cache = cache
+    self.num_threads = num_threads
+
+  def fetch(self, blob_path):
+    """Return contents of blob_path as bytes."""
+    if self.cache is not None:
+      contents = self.cache.get(blob_path)
+      if contents is not None:
+        return contents
+    contents = self.backend.read(blob_path)
+    if self.cache is not None:
+      self.cache.put(blob_path, contents)
+    return contents
+
+  def fetch_many(self, blob_paths):
+    """Return contents of all blob_paths, in the same order."""
+    blob_paths = list(blob_paths)
+    if len(blob_paths) <= 1 or self.num_threads <= 1:
+      return [self.fetch(blob_path) for blob_path in blob_paths]
+    pool = ThreadPool(min(self.num_threads, len(blob_paths)))
+    try:
+      return pool.map(self.fetch, blob_paths)
+    finally:
+      pool.close()
+
+
+def cached_blob_fetcher():
+  """Return the fetcher shared by the read_* functions in this module."""
+  global _blob_fetcher
+  with _blob_fetcher_lock:
+    if not _blob_fetcher:
+      _blob_fetcher = BlobFetcher(GcsBackend(), BlobCache())
+    return _blob_fetcher
+
+
+def set_blob_fetcher(fetcher):
+  """Replace the shared fetcher, e.g. with one using a LocalDirBackend."""
+  global _blob_fetcher
+  with _blob_fetcher_lock:
+    _blob_fetcher = fetcher
+
+
+def open_netcdf(blob_path, contents):
+  """Open netcdf file contents in memory, without a temporary file."""
+  return Dataset(os.path.basename(blob_path), 'r', memory=contents)
+
+
 @retry(
     wait_exponential_multiplier=RETRY_MIN_MSECS,
     wait_exponential_max=RETRY_MAX_MSECS,
@@ -171,10 +358,98 @@ def create_data_grid(nc, data, griddef):
           'b': '6356584.0'
       }, nx, ny, extents)
 
-  # now do remapping
+  # now do remapping, reusing the neighbour info for this pair of grids
   logging.info('Remapping from %s', old_grid)
-  return pr.kd_tree.resample_nearest(
-      old_grid, data, griddef, radius_of_influence=50000)
+  valid_input_index, valid_output_index, index_array, _ = (
+      cached_neighbour_info(old_grid, griddef, radius_of_influence=50000))
+  return pr.kd_tree.get_sample_from_neighbour_info(
+      'nn', griddef.shape, data, valid_input_index, valid_output_index,
+      index_array)
+
+
+def cached_neighbour_info(source_def, target_def, radius_of_influence):
+  """Nearest neighbour info between two grids, computed once per grid pair.
+
+  The source geostationary grid only changes if the satellite's nominal
+  position does, so the kd-tree lookup can be reused across files.
+
+  Args:
+    source_def (pyresample.AreaDefinition): input grid definition
+    target_def (pyresample.GridDefinition): output grid definition
+    radius_of_influence (float): meters
+
+  Returns:
+    tuple from pyresample.kd_tree.get_neighbour_info
+  """
+  key = ('nn', str(source_def), id(target_def), radius_of_influence)
+  with _resample_cache_lock:
+    cached = _resample_cache.get(key)
+  if cached is None or cached[0] is not target_def:
+    info = pr.kd_tree.get_neighbour_info(
+        source_def, target_def, radius_of_influence, neighbours=1)
+    cached = (target_def, info)
+    with _resample_cache_lock:
+      _resample_cache[key] = cached
+  return cached[1]
+
+
+def lonlat_to_xyz(lons, lats):
+  """Convert degrees to cartesian coordinates on pyresample's earth sphere."""
+  lons = np.radians(np.asarray(lons, dtype=np.float64).ravel())
+  lats = np.radians(np.asarray(lats, dtype=np.float64).ravel())
+  cos_lats = np.cos(lats)
+  return EARTH_RADIUS_METERS * np.column_stack(
+      (cos_lats * np.cos(lons), cos_lats * np.sin(lons), np.sin(lats)))
+
+
+class LtgGridResampler(object):
+  """Marks the grid cells within a radius of any lightning event.
+
+  The kd-tree over the fixed output grid is built once, so each new window
+  of events only pays for looking up the cells near each event. This gives
+  the same result as resample_nearest of a swath of ones with fill_value 0.
+
+  Args:
+    griddef (pyresample.GridDefinition): output grid definition
+    event_influence_km (float): How far does a lightning flash influence?
+  """
+
+  def __init__(self, griddef, event_influence_km):
+    lons, lats = griddef.get_lonlats()
+    self.shape = lons.shape
+    self.radius = 1000.0 * event_influence_km
+    self._tree = cKDTree(lonlat_to_xyz(lons, lats))
+
+  def resample(self, event_lats, event_lons):
+    """Grid lightning events.
+
+    Args:
+      event_lats (ndarray): latitudes of events
+      event_lons (ndarray): longitudes of events
+
+    Returns:
+      ndarray of griddef shape, 1 near any event and 0 elsewhere
+    """
+    result = np.zeros(self.shape, dtype=np.float64)
+    if len(event_lats) == 0:
+      return result
+    neighbours = self._tree.query_ball_point(
+        lonlat_to_xyz(event_lons, event_lats), r=self.radius)
+    cells = [cell for cell_list in neighbours for cell in cell_list]
+    result.ravel()[np.asarray(cells, dtype=np.int64)] = 1
+    return result
+
+
+def cached_ltg_resampler(griddef, event_influence_km):
+  """Return the LtgGridResampler for this grid and radius, building it once."""
+  key = ('ltg', id(griddef), event_influence_km)
+  with _resample_cache_lock:
+    cached = _resample_cache.get(key)
+  if cached is None or cached[0] is not griddef:
+    cached = (griddef, LtgGridResampler(griddef, event_influence_km))
+    with _resample_cache_lock:
+      _resample_cache[key] = cached
+  return cached[1]
 
 
 def parse_cmdline_timestamp(timestamp):
@@ -196,29 +471,23 @@ def get_ir_blob_paths(year, day, hour, channel='C14'):
   return ir_blob_paths
 
 
-def read_ir_data(blob_path, griddef):
+def read_ir_data(blob_path, griddef, fetcher=None):
   """Read satellite infrared data from Blob and fit into grid.
 
   Args:
     blob_path (Blob URL): netcdf file
     griddef (pyresample.GridDefinition): output grid definition
+    fetcher (BlobFetcher): defaults to the shared cached fetcher
 
   Returns:
     ndarray of data in specified grid
   """
-  tmpdir = tempfile.mkdtemp()
-  try:
-    ir_file = copy_fromgcs(blob_path, tmpdir)
-    with Dataset(ir_file, 'r') as irnc:
-      rad = irnc.variables['Rad'][:]
-      ref = (rad * np.pi * 0.3) / 663.274497
-      ref = np.sqrt(np.minimum(np.maximum(ref, 0.0), 1.0))
-      return create_data_grid(irnc, ref, griddef)
-  finally:
-    try:
-      shutil.rmtree(tmpdir)
-    except IOError:
-      pass
+  fetcher = fetcher or cached_blob_fetcher()
+  with open_netcdf(blob_path, fetcher.fetch(blob_path)) as irnc:
+    rad = irnc.variables['Rad'][:]
+    ref = (rad * np.pi * 0.3) / 663.274497
+    ref = np.sqrt(np.minimum(np.maximum(ref, 0.0), 1.0))
+    return create_data_grid(irnc, ref, griddef)
 
 
 def get_ltg_blob_paths(dt, timespan_minutes):
@@ -255,60 +524,57 @@ def get_ltg_blob_paths(dt, timespan_minutes):
   return result
 
 
-def read_ltg_data(blob_path):
+def read_ltg_data(blob_path, contents=None):
   """Read lightning event data from GCS Blob.
 
   Args:
     blob_path (Blob URL): netcdf file
+    contents (bytes): already fetched file contents, else read via the
+      shared cached fetcher
 
   Returns:
     tuple of latitude and longitude arrays
   """
-  tmpdir = tempfile.mkdtemp()
-  try:
-    filename = copy_fromgcs(blob_path, tmpdir)
-    with Dataset(filename, 'r') as nc:
-      event_lat = nc.variables['event_lat'][:]
-      event_lon = nc.variables['event_lon'][:]
-      print('{} events'.format(len(event_lat)), end='; ')
-      return event_lat, event_lon
-  finally:
-    try:
-      shutil.rmtree(tmpdir)
-    except IOError:
-      pass
+  if contents is None:
+    contents = cached_blob_fetcher().fetch(blob_path)
+  with open_netcdf(blob_path, contents) as nc:
+    event_lat = nc.variables['event_lat'][:]
+    event_lon = nc.variables['event_lon'][:]
+    print('{} events'.format(len(event_lat)), end='; ')
+    return event_lat, event_lon
 
 
-def create_ltg_grid(ltg_blob_paths, griddef, event_influence_km):
+def create_ltg_grid(ltg_blob_paths, griddef, event_influence_km,
+                    fetcher=None):
   """Read lightning event data from Blobs and fit into grid.
 
   Args:
     ltg_blob_paths (list of Blob URLs): list of netcdf file
     griddef (pyresample.GridDefinition): output grid definition
     event_influence_km (float): How far does a lightning flash influence?
+    fetcher (BlobFetcher): defaults to the shared cached fetcher
 
   Returns:
     ndarray of data in specified grid
   """
-  # create swath with lightning points
-  ltg_lats, ltg_lons, data = np.array([0]), np.array([0]), np.array([0])
-  for blob_path in ltg_blob_paths:
-    event_lat, event_lon = read_ltg_data(blob_path)
-    ltg_lats = np.append(ltg_lats, event_lat)
-    ltg_lons = np.append(ltg_lons, event_lon)
-    data = np.append(data, np.ones_like(event_lat))
-  swath_def = pr.geometry.SwathDefinition(lats=ltg_lats, lons=ltg_lons)
+  # download all the files in parallel
+  fetcher = fetcher or cached_blob_fetcher()
+  ltg_blob_paths = list(ltg_blob_paths)
+  all_contents = fetcher.fetch_many(ltg_blob_paths)
+
+  # gather lightning points from all files, concatenating only once
+  ltg_lats, ltg_lons = [], []
+  for blob_path, contents in zip(ltg_blob_paths, all_contents):
+    event_lat, event_lon = read_ltg_data(blob_path, contents)
+    ltg_lats.append(np.ma.filled(event_lat, np.nan))
+    ltg_lons.append(np.ma.filled(event_lon, np.nan))
+  ltg_lats = np.concatenate(ltg_lats) if ltg_lats else np.array([])
+  ltg_lons = np.concatenate(ltg_lons) if ltg_lons else np.array([])
+  valid = np.isfinite(ltg_lats) & np.isfinite(ltg_lons)
 
   # resample these points to a grid
-  result = pr.kd_tree.resample_nearest(
-      swath_def,
-      data,
-      griddef,
-      radius_of_influence=1000 * event_influence_km,
-      epsilon=0.5,
-      fill_value=0)
-
-  return result
+  resampler = cached_ltg_resampler(griddef, event_influence_km)
+  return resampler.resample(ltg_lats[valid], ltg_lons[valid])
 
 
 if __name__ == '__main__':
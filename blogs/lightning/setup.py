@@ -108,7 +108,7 @@ class CustomCommands(setuptools.Command):
 # so this dependency will not trigger anything to be installed unless a version
 # restriction is specified.
 REQUIRED_PACKAGES = [
-    'pyresample netcdf4 google-cloud-storage '
+    'pyresample scipy netcdf4 google-cloud-storage '
     'retrying cloudml-hypertune'.split(),
 ]
 
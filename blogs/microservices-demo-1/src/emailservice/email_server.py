@@ -16,11 +16,14 @@
 
 from concurrent import futures
 import argparse
+import functools
 import os
+import signal
 import sys
-import time
+import threading
 import grpc
 from jinja2 import Environment, FileSystemLoader, select_autoescape, TemplateError
+from markupsafe import Markup
 from google.api_core.exceptions import GoogleAPICallError
 
 import demo_pb2
@@ -52,22 +55,37 @@ except:
 from logger import getJSONLogger
 logger = getJSONLogger('emailservice-server')
 
-# Loads confirmation email template from file
+from send_queue import QueueFull, SendQueue
+
+# Loads and compiles the confirmation email templates once, at startup
 env = Environment(
     loader=FileSystemLoader('templates'),
-    autoescape=select_autoescape(['html', 'xml'])
+    autoescape=select_autoescape(['html', 'xml']),
+    auto_reload=False
 )
 template = env.get_template('confirmation.html')
+line_item_template = env.get_template('line_item.html')
+
+@functools.lru_cache(maxsize=4096)
+def render_line_item(product_id, quantity, units, nanos, currency_code):
+  # orders mostly repeat the same products and quantities
+  return Markup(line_item_template.render(product_id=product_id, quantity=quantity,
+                                          units=units, nanos=nanos, currency_code=currency_code))
+
+def render_confirmation(order):
+  items = [render_line_item(item.item.product_id, item.item.quantity,
+                            item.cost.units, item.cost.nanos, item.cost.currency_code)
+           for item in order.items]
+  return template.render(order=order, items=items)
 
 class BaseEmailService(demo_pb2_grpc.EmailServiceServicer):
   def Check(self, request, context):
     return health_pb2.HealthCheckResponse(
       status=health_pb2.HealthCheckResponse.SERVING)
 
-class EmailService(BaseEmailService):
+class CloudMailSender():
   def __init__(self):
     raise Exception('cloud mail client not implemented')
-    super().__init__()
 
   @staticmethod
   def send_email(client, email_address, content):
@@ -89,23 +107,45 @@ class EmailService(BaseEmailService):
     )
     logger.info("Message sent: {}".format(response.rfc822_message_id))
 
+  def send_batch(self, messages):
+    errors = []
+    for email_address, content in messages:
+      try:
+        CloudMailSender.send_email(self.client, email_address, content)
+        errors.append(None)
+      except GoogleAPICallError as err:
+        errors.append(err)
+    return errors
+
+class EmailService(BaseEmailService):
+  def __init__(self, send_queue, enqueue_timeout=1.0):
+    super().__init__()
+    self.send_queue = send_queue
+    self.enqueue_timeout = enqueue_timeout
+
   def SendOrderConfirmation(self, request, context):
     email = request.email
     order = request.order
 
     try:
-      confirmation = template.render(order = order)
+      confirmation = render_confirmation(order)
     except TemplateError as err:
       context.set_details("An error occurred when preparing the confirmation mail.")
-      logger.error(err.message)
+      logger.error(str(err))
       context.set_code(grpc.StatusCode.INTERNAL)
       return demo_pb2.Empty()
 
+    # sent by the send queue, the order does not wait for the mail provider
     try:
-      EmailService.send_email(self.client, email, confirmation)
-    except GoogleAPICallError as err:
-      context.set_details("An error occurred when sending the email.")
-      print(err.message)
+      self.send_queue.put(email, confirmation, timeout=self.enqueue_timeout)
+    except QueueFull as err:
+      context.set_details("Too many emails waiting to be sent.")
+      logger.error(str(err))
+      context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+      return demo_pb2.Empty()
+    except OSError as err:
+      context.set_details("An error occurred when queueing the email.")
+      logger.error(str(err))
       context.set_code(grpc.StatusCode.INTERNAL)
       return demo_pb2.Empty()
 
@@ -116,34 +156,79 @@ class DummyEmailService(BaseEmailService):
     logger.info('A request to send order confirmation email to {} has been received.'.format(request.email))
     return demo_pb2.Empty()
 
+def create_send_queue():
+  mail_sink = os.environ.get('MAIL_SINK', "cloud")
+  if mail_sink == "fake":
+    from fake_mail_sink import FakeMailSink
+    sender = FakeMailSink(latency_ms=float(os.environ.get('FAKE_MAIL_LATENCY_MS', "0")),
+                          failure_rate=float(os.environ.get('FAKE_MAIL_FAILURE_RATE', "0")))
+  else:
+    sender = CloudMailSender()
+
+  # without EMAIL_SPOOL_DIR queued emails are only kept in memory, and those
+  # not sent within the shutdown grace period are lost when the process stops
+  return SendQueue(sender,
+                   max_size=int(os.environ.get('SEND_QUEUE_SIZE', "1000")),
+                   batch_size=int(os.environ.get('SEND_BATCH_SIZE', "20")),
+                   flush_interval=float(os.environ.get('SEND_FLUSH_INTERVAL_SECONDS', "0.2")),
+                   max_attempts=int(os.environ.get('SEND_MAX_ATTEMPTS', "5")),
+                   spool_dir=os.environ.get('EMAIL_SPOOL_DIR') or None)
+
+def create_service(dummy_mode):
+  if dummy_mode:
+    return DummyEmailService()
+  return EmailService(create_send_queue())
+
 class HealthCheck():
   def Check(self, request, context):
     return health_pb2.HealthCheckResponse(
       status=health_pb2.HealthCheckResponse.SERVING)
 
 def start(dummy_mode):
-  server = grpc.server(futures.ThreadPoolExecutor(max_workers=10),
-                       interceptors=(tracer_interceptor,))
-  service = None
-  if dummy_mode:
-    service = DummyEmailService()
-  else:
-    raise Exception('non-dummy mode not implemented yet')
+  port = os.environ.get('PORT', "8080")
+  # 0 for no limit besides the number of worker threads
+  max_concurrent_rpcs = int(os.environ.get('MAX_CONCURRENT_RPCS', "0")) or None
+
+  if os.environ.get('SERVER_MODE', "threads") == "aio":
+    # asyncio server, needs grpcio 1.32+. It imports this module by name,
+    # which must not load it a second time.
+    sys.modules['email_server'] = sys.modules[__name__]
+    import email_server_aio
+    email_server_aio.main(dummy_mode, port, max_concurrent_rpcs)
+    return
+
+  server = grpc.server(futures.ThreadPoolExecutor(max_workers=int(os.environ.get('MAX_WORKERS', "10"))),
+                       interceptors=(tracer_interceptor,),
+                       maximum_concurrent_rpcs=max_concurrent_rpcs)
+  service = create_service(dummy_mode)
 
   demo_pb2_grpc.add_EmailServiceServicer_to_server(service, server)
   health_pb2_grpc.add_HealthServicer_to_server(service, server)
 
-  port = os.environ.get('PORT', "8080")
   logger.info("listening on port: "+port)
   server.add_insecure_port('[::]:'+port)
   server.start()
-  try:
-    while True:
-      time.sleep(3600)
-  except KeyboardInterrupt:
-    server.stop(0)
+
+  stopping = threading.Event()
+  for signum in (signal.SIGTERM, signal.SIGINT):
+    signal.signal(signum, lambda signum, frame: stopping.set())
+  while not stopping.wait(3600):
+    pass
+
+  # new RPCs are rejected, in-flight ones get shutdown_grace seconds to finish,
+  # then the queued emails are sent
+  shutdown_grace = float(os.environ.get('SHUTDOWN_GRACE_SECONDS', "10"))
+  logger.info("shutting down")
+  server.stop(shutdown_grace).wait()
+  if not dummy_mode:
+    service.send_queue.stop(timeout=shutdown_grace)
 
 
 if __name__ == '__main__':
-  logger.info('starting the email service in dummy mode.')
-  start(dummy_mode = True)
+  # MAIL_SINK=fake to send to fake_mail_sink.FakeMailSink
+  if os.environ.get('MAIL_SINK', "dummy") == "dummy":
+    logger.info('starting the email service in dummy mode.')
+    start(dummy_mode = True)
+  else:
+    logger.info('starting the email service with a send queue.')
+    start(dummy_mode = False)
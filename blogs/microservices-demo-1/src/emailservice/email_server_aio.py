@@ -0,0 +1,96 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# asyncio mode of the email service, selected with SERVER_MODE=aio.
+# Needs grpcio 1.32+. Concurrency is bounded by MAX_CONCURRENT_RPCS rather
+# than by the size of a thread pool.
+
+import asyncio
+import os
+import signal
+
+import grpc
+
+import demo_pb2
+import demo_pb2_grpc
+from grpc_health.v1 import health_pb2
+from grpc_health.v1 import health_pb2_grpc
+
+from email_server import create_service, logger
+
+class AsyncDummyEmailService(demo_pb2_grpc.EmailServiceServicer):
+  async def SendOrderConfirmation(self, request, context):
+    logger.info('A request to send order confirmation email to {} has been received.'.format(request.email))
+    return demo_pb2.Empty()
+
+  async def Check(self, request, context):
+    return health_pb2.HealthCheckResponse(
+      status=health_pb2.HealthCheckResponse.SERVING)
+
+  # part of the health service of the grpcio versions with asyncio support
+  async def Watch(self, request, context):
+    await context.abort(grpc.StatusCode.UNIMPLEMENTED, 'health watch is not supported')
+
+class AsyncEmailService(demo_pb2_grpc.EmailServiceServicer):
+  """
+  Runs the RPCs of email_server.EmailService, which render the email and
+  write it to the spool of the send queue, on the default executor.
+  """
+
+  def __init__(self, service):
+    self.service = service
+
+  async def SendOrderConfirmation(self, request, context):
+    return await asyncio.get_event_loop().run_in_executor(
+      None, self.service.SendOrderConfirmation, request, context)
+
+  async def Check(self, request, context):
+    return health_pb2.HealthCheckResponse(
+      status=health_pb2.HealthCheckResponse.SERVING)
+
+  async def Watch(self, request, context):
+    await context.abort(grpc.StatusCode.UNIMPLEMENTED, 'health watch is not supported')
+
+async def serve(dummy_mode, port, max_concurrent_rpcs=None, shutdown_grace=10):
+  server = grpc.aio.server(maximum_concurrent_rpcs=max_concurrent_rpcs)
+  service = None
+  if dummy_mode:
+    service = AsyncDummyEmailService()
+  else:
+    service = AsyncEmailService(create_service(dummy_mode))
+
+  demo_pb2_grpc.add_EmailServiceServicer_to_server(service, server)
+  health_pb2_grpc.add_HealthServicer_to_server(service, server)
+
+  logger.info("listening on port: "+port+" (asyncio)")
+  server.add_insecure_port('[::]:'+port)
+  await server.start()
+
+  stopping = asyncio.Event()
+  loop = asyncio.get_event_loop()
+  for signum in (signal.SIGTERM, signal.SIGINT):
+    loop.add_signal_handler(signum, stopping.set)
+  await stopping.wait()
+
+  # new RPCs are rejected, in-flight ones get shutdown_grace seconds to finish
+  logger.info("shutting down")
+  await server.stop(shutdown_grace)
+  if not dummy_mode:
+    service.service.send_queue.stop(timeout=shutdown_grace)
+
+def main(dummy_mode, port, max_concurrent_rpcs=None):
+  shutdown_grace = float(os.environ.get('SHUTDOWN_GRACE_SECONDS', "10"))
+  asyncio.run(serve(dummy_mode, port, max_concurrent_rpcs, shutdown_grace))
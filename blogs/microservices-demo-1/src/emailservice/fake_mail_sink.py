@@ -0,0 +1,56 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Local stand-in for the mail provider, selected with MAIL_SINK=fake, to run
+# the email service and its send queue without a mail account:
+#
+#   MAIL_SINK=fake FAKE_MAIL_LATENCY_MS=200 FAKE_MAIL_FAILURE_RATE=0.1 python email_server.py
+
+import random
+import threading
+import time
+
+class FakeDeliveryError(Exception):
+  pass
+
+class FakeMailSink(object):
+  """
+  Keeps the emails it receives in memory. Each batch takes latency_ms plus
+  per_message_ms per email, and each email fails with probability
+  failure_rate, to exercise the batching and retries of the send queue.
+  """
+
+  def __init__(self, latency_ms=0.0, per_message_ms=0.0, failure_rate=0.0, seed=None):
+    self.latency = latency_ms / 1000.0
+    self.per_message = per_message_ms / 1000.0
+    self.failure_rate = failure_rate
+    self.messages = []
+    self.batch_sizes = []
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+
+  def send_batch(self, messages):
+    time.sleep(self.latency + self.per_message * len(messages))
+    errors = []
+    with self._lock:
+      self.batch_sizes.append(len(messages))
+      for email_address, content in messages:
+        if self._random.random() < self.failure_rate:
+          errors.append(FakeDeliveryError('could not deliver to {}'.format(email_address)))
+        else:
+          self.messages.append((email_address, content))
+          errors.append(None)
+    return errors
@@ -0,0 +1,241 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+from logger import getJSONLogger
+logger = getJSONLogger('emailservice-send-queue')
+
+class QueueFull(Exception):
+  pass
+
+class OutgoingEmail(object):
+  __slots__ = ('email_address', 'content', 'attempts', 'queued_at', 'spool_path')
+
+  def __init__(self, email_address, content, spool_path=None):
+    self.email_address = email_address
+    self.content = content
+    self.attempts = 0
+    self.queued_at = time.time()
+    self.spool_path = spool_path
+
+class SendQueue(object):
+  """
+  Bounded queue of emails, sent by a background thread in batches of up to
+  batch_size with sender.send_batch(messages). A batch is flushed once it is
+  full or flush_interval seconds after its oldest message was queued.
+  send_batch takes a list of (email_address, content) and returns one error
+  per message, None when it was sent.
+
+  Failed messages are retried after an exponential backoff, up to
+  max_attempts times. With a spool_dir, put() writes each message to disk
+  before returning and the file is removed once the message is sent, so
+  messages queued by a process that stopped are sent by the next one.
+  Without one the queue is not durable: messages still queued when the
+  process dies, or when stop() times out, are lost.
+  """
+
+  def __init__(self, sender, max_size=1000, batch_size=20, flush_interval=0.2, max_attempts=5,
+               initial_backoff=1.0, max_backoff=60.0, spool_dir=None, metrics_interval=60.0):
+    self._sender = sender
+    self._max_size = max_size
+    self._batch_size = batch_size
+    self._flush_interval = flush_interval
+    self._max_attempts = max_attempts
+    self._initial_backoff = initial_backoff
+    self._max_backoff = max_backoff
+    self._spool_dir = spool_dir
+    self._metrics_interval = metrics_interval
+    self._next_metrics = time.time() + metrics_interval
+
+    self._cond = threading.Condition()
+    self._ready = collections.deque()
+    # (due time, sequence number, message) of the messages waiting for a retry
+    self._retries = []
+    self._sequence = itertools.count()
+    # messages accepted and neither sent nor dropped, including those being sent
+    self._depth = 0
+    self._max_depth = 0
+    self._counters = collections.Counter()
+    self._stopping = False
+
+    if spool_dir is not None:
+      os.makedirs(spool_dir, exist_ok=True)
+      self._recover_spool()
+
+    self._thread = threading.Thread(target=self._run, name='email-send-queue')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def put(self, email_address, content, timeout=None):
+    """
+    Queues an email, waiting up to timeout seconds for room in the queue.
+    Raises QueueFull if there is none, or OSError if it could not be spooled.
+    """
+    with self._cond:
+      if not self._cond.wait_for(lambda: self._depth < self._max_size or self._stopping, timeout):
+        self._counters['rejected'] += 1
+        raise QueueFull('{} emails waiting to be sent'.format(self._depth))
+      if self._stopping:
+        raise QueueFull('the send queue is stopping')
+      # taken before spooling, so that concurrent puts cannot overfill the queue
+      self._depth += 1
+      self._max_depth = max(self._max_depth, self._depth)
+
+    try:
+      message = OutgoingEmail(email_address, content, self._spool(email_address, content))
+    except Exception:
+      with self._cond:
+        self._depth -= 1
+        self._cond.notify_all()
+      raise
+
+    with self._cond:
+      self._ready.append(message)
+      self._counters['queued'] += 1
+      self._cond.notify_all()
+
+  def metrics(self):
+    """Returns the queue depth and the counts of queued, sent, retried, dropped and rejected emails."""
+    with self._cond:
+      metrics = dict(self._counters)
+      metrics.update(depth=self._depth, max_depth=self._max_depth,
+                     ready=len(self._ready), retrying=len(self._retries))
+    return metrics
+
+  def stop(self, timeout=None):
+    """
+    Sends the queued emails and stops the background thread, waiting up to
+    timeout seconds. Emails waiting for a retry are not sent, but stay in
+    the spool.
+    """
+    with self._cond:
+      self._stopping = True
+      self._cond.notify_all()
+    self._thread.join(timeout)
+    logger.info('send queue stopped: {}'.format(json.dumps(self.metrics(), sort_keys=True)))
+
+  def _next_batch(self):
+    """Waits for a batch to send, returns None once stopping with nothing left to send."""
+    with self._cond:
+      while True:
+        now = time.time()
+        while self._retries and self._retries[0][0] <= now:
+          self._ready.append(heapq.heappop(self._retries)[2])
+        if self._ready and (len(self._ready) >= self._batch_size or self._stopping or
+                            now >= self._ready[0].queued_at + self._flush_interval):
+          return [self._ready.popleft() for _ in range(min(self._batch_size, len(self._ready)))]
+        if self._stopping:
+          return None
+        if now >= self._next_metrics:
+          logger.info('send queue: {}'.format(json.dumps(self.metrics(), sort_keys=True)))
+          self._next_metrics = now + self._metrics_interval
+
+        wake_at = self._next_metrics
+        if self._ready:
+          wake_at = min(wake_at, self._ready[0].queued_at + self._flush_interval)
+        if self._retries:
+          wake_at = min(wake_at, self._retries[0][0])
+        self._cond.wait(max(wake_at - now, 0))
+
+  def _run(self):
+    while True:
+      batch = self._next_batch()
+      if batch is None:
+        return
+      try:
+        errors = self._sender.send_batch([(m.email_address, m.content) for m in batch])
+      except Exception as err:
+        errors = [err] * len(batch)
+      self._done(batch, errors)
+
+  def _done(self, batch, errors):
+    sent = 0
+    for message, err in zip(batch, errors):
+      if err is None:
+        sent += 1
+        self._unspool(message.spool_path)
+        continue
+      message.attempts += 1
+      if message.attempts >= self._max_attempts:
+        logger.error('dropping email to {} after {} attempts: {}'.format(
+          message.email_address, message.attempts, err))
+        self._unspool(message.spool_path, failed=True)
+        with self._cond:
+          self._counters['dropped'] += 1
+          self._depth -= 1
+          self._cond.notify_all()
+        continue
+      # full jitter, so that messages of a failed batch are not retried together
+      backoff = min(self._max_backoff, self._initial_backoff * 2 ** (message.attempts - 1))
+      with self._cond:
+        self._counters['retried'] += 1
+        heapq.heappush(self._retries,
+                       (time.time() + random.uniform(0, backoff), next(self._sequence), message))
+
+    with self._cond:
+      self._counters['sent'] += sent
+      self._counters['batches'] += 1
+      self._depth -= sent
+      self._cond.notify_all()
+
+  def _spool(self, email_address, content):
+    if self._spool_dir is None:
+      return None
+    name = '{:016d}-{}.json'.format(int(time.time() * 1e6), uuid.uuid4().hex)
+    path = os.path.join(self._spool_dir, name)
+    with open(path + '.tmp', 'w') as f:
+      json.dump({'email_address': email_address, 'content': content}, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.rename(path + '.tmp', path)
+    return path
+
+  def _unspool(self, spool_path, failed=False):
+    if spool_path is None:
+      return
+    try:
+      if failed:
+        # kept for inspection, but not sent again
+        os.rename(spool_path, spool_path + '.failed')
+      else:
+        os.remove(spool_path)
+    except OSError as err:
+      logger.error('could not remove {} from the spool: {}'.format(spool_path, err))
+
+  def _recover_spool(self):
+    names = sorted(name for name in os.listdir(self._spool_dir) if name.endswith('.json'))
+    for name in names:
+      path = os.path.join(self._spool_dir, name)
+      try:
+        with open(path) as f:
+          spooled = json.load(f)
+      except (OSError, ValueError) as err:
+        logger.error('could not read {} from the spool: {}'.format(path, err))
+        continue
+      self._ready.append(OutgoingEmail(spooled['email_address'], spooled['content'], path))
+      self._depth += 1
+    self._max_depth = self._depth
+    if names:
+      logger.info('{} emails to send from the spool'.format(len(self._ready)))
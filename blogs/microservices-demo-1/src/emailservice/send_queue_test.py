@@ -0,0 +1,120 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python -m unittest send_queue_test
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from fake_mail_sink import FakeMailSink
+from send_queue import QueueFull, SendQueue
+
+def wait_for(predicate, timeout=5):
+  deadline = time.time() + timeout
+  while not predicate():
+    if time.time() > deadline:
+      raise AssertionError('timed out waiting for the send queue')
+    time.sleep(0.01)
+
+class SendQueueTest(unittest.TestCase):
+
+  def setUp(self):
+    self.spool_dir = tempfile.mkdtemp()
+    self.queues = []
+
+  def tearDown(self):
+    for queue in self.queues:
+      queue.stop(timeout=5)
+    shutil.rmtree(self.spool_dir)
+
+  def new_queue(self, sender, **kwargs):
+    queue = SendQueue(sender, **kwargs)
+    self.queues.append(queue)
+    return queue
+
+  def test_flushes_full_batch(self):
+    sink = FakeMailSink()
+    queue = self.new_queue(sink, batch_size=5, flush_interval=60)
+    for i in range(5):
+      queue.put('user{}@example.com'.format(i), 'hello')
+    wait_for(lambda: len(sink.messages) == 5)
+    self.assertEqual(sink.batch_sizes, [5])
+
+  def test_flushes_partial_batch_after_interval(self):
+    sink = FakeMailSink()
+    queue = self.new_queue(sink, batch_size=100, flush_interval=0.3)
+    start = time.time()
+    for i in range(3):
+      queue.put('user{}@example.com'.format(i), 'hello')
+    wait_for(lambda: len(sink.messages) == 3)
+    self.assertGreaterEqual(time.time() - start, 0.25)
+    self.assertEqual(sink.batch_sizes, [3])
+
+  def test_retries_then_drops(self):
+    sink = FakeMailSink(failure_rate=1.0)
+    queue = self.new_queue(sink, batch_size=1, flush_interval=0, max_attempts=3,
+                           initial_backoff=0.01, spool_dir=self.spool_dir)
+    queue.put('user@example.com', 'hello')
+    wait_for(lambda: queue.metrics().get('dropped') == 1)
+    self.assertEqual(len(sink.batch_sizes), 3)
+    metrics = queue.metrics()
+    self.assertEqual(metrics['retried'], 2)
+    self.assertEqual(metrics['depth'], 0)
+    # kept for inspection, but not sent again by the next process
+    self.assertEqual([name.endswith('.json.failed') for name in os.listdir(self.spool_dir)], [True])
+
+  def test_put_raises_queue_full(self):
+    sink = FakeMailSink()
+    queue = self.new_queue(sink, max_size=2, batch_size=100, flush_interval=60)
+    queue.put('user1@example.com', 'hello')
+    queue.put('user2@example.com', 'hello')
+    with self.assertRaises(QueueFull):
+      queue.put('user3@example.com', 'hello', timeout=0.05)
+    self.assertEqual(queue.metrics()['rejected'], 1)
+
+  def test_sends_spooled_emails_after_restart(self):
+    # the first process cannot send, and stops with the emails waiting for a retry
+    failing = FakeMailSink(failure_rate=1.0)
+    queue = SendQueue(failing, batch_size=100, flush_interval=0, initial_backoff=60,
+                      spool_dir=self.spool_dir)
+    queue.put('user1@example.com', 'hello 1')
+    queue.put('user2@example.com', 'hello 2')
+    wait_for(lambda: queue.metrics().get('retried') == 2)
+    queue.stop(timeout=5)
+    self.assertEqual(len(os.listdir(self.spool_dir)), 2)
+
+    sink = FakeMailSink()
+    self.new_queue(sink, flush_interval=0, spool_dir=self.spool_dir)
+    wait_for(lambda: len(sink.messages) == 2)
+    self.assertEqual(sorted(sink.messages),
+                     [('user1@example.com', 'hello 1'), ('user2@example.com', 'hello 2')])
+    wait_for(lambda: not os.listdir(self.spool_dir))
+
+  def test_stop_sends_ready_emails(self):
+    sink = FakeMailSink()
+    queue = SendQueue(sink, batch_size=2, flush_interval=60)
+    for i in range(5):
+      queue.put('user{}@example.com'.format(i), 'hello')
+    queue.stop(timeout=5)
+    self.assertEqual(len(sink.messages), 5)
+    with self.assertRaises(QueueFull):
+      queue.put('late@example.com', 'hello')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares the thread pool and asyncio (SERVER_MODE=aio) modes of the
+# recommendation and email services under the locust scenarios of
+# locustfile.py. Each service runs on its own, the recommendation service
+# against recommendationservice/stub_catalog_server.py, and the requests/s and
+# latency percentiles are read from the CSV files written by locust:
+#
+#   python benchmark_server_modes.py --clients 50,200 --requests 5000
+#
+# Run it with Python 3. The asyncio mode needs Python 3.7+ and grpcio 1.32+ for
+# the services.
+
+import argparse
+import csv
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECOMMENDATION_DIR = os.path.join(SRC_DIR, 'recommendationservice')
+EMAIL_DIR = os.path.join(SRC_DIR, 'emailservice')
+LOCUSTFILE = os.path.join(SRC_DIR, 'loadgenerator', 'locustfile.py')
+
+CATALOG_PORT = '13550'
+SERVICE_PORT = '18080'
+
+
+def start(args, cwd, env=None):
+    process_env = dict(os.environ, **(env or {}))
+    return subprocess.Popen(args, cwd=cwd, env=process_env,
+                            stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+
+
+def stop(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def read_total(csv_filename):
+    with open(csv_filename) as f:
+        for row in csv.DictReader(f):
+            if row['Name'] == 'Total':
+                return row
+    raise ValueError('no Total row in ' + csv_filename)
+
+
+def run_locust(user_class, env, clients, hatch_rate, num_requests, out_dir):
+    """
+    Runs locust headless, returns requests/s, failures and the 50%, 99% latencies in ms.
+    """
+    prefix = os.path.join(out_dir, '{}_{}'.format(user_class, clients))
+    subprocess.check_call(
+        ['locust', '-f', LOCUSTFILE, '--no-web', '-c', str(clients), '-r', str(hatch_rate),
+         '-n', str(num_requests), '--csv=' + prefix, user_class],
+        cwd=RECOMMENDATION_DIR, env=dict(os.environ, PYTHONPATH=RECOMMENDATION_DIR, **env),
+        stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    requests = read_total(prefix + '_requests.csv')
+    distribution = read_total(prefix + '_distribution.csv')
+    return (float(requests['Requests/s']), int(requests['# failures']),
+            float(distribution['50%']), float(distribution['99%']))
+
+
+def services(args):
+    """
+    Yields the name, command, working directory, environment and locust scenario of each service.
+    """
+    if 'recommendation' in args.services:
+        yield ('recommendation', [args.python, 'recommendation_server.py'], RECOMMENDATION_DIR,
+               {'PRODUCT_CATALOG_SERVICE_ADDR': 'localhost:' + CATALOG_PORT,
+                'CATALOG_TTL_SECONDS': str(args.catalog_ttl)},
+               'RecommendationUser', {'RECOMMENDATION_SERVICE_ADDR': 'localhost:' + SERVICE_PORT})
+    if 'email' in args.services:
+        yield ('email', [args.python, 'email_server.py'], EMAIL_DIR, {},
+               'EmailUser', {'EMAIL_SERVICE_ADDR': 'localhost:' + SERVICE_PORT})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Thread pool vs asyncio gRPC servers')
+    parser.add_argument('--services', default='recommendation,email')
+    parser.add_argument('--modes', default='threads,aio')
+    parser.add_argument('--clients', default='50,200', help='comma separated numbers of locust users')
+    parser.add_argument('--hatch_rate', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--catalog_latency_ms', type=float, default=20.0)
+    parser.add_argument('--catalog_ttl', type=float, default=0,
+                        help='CATALOG_TTL_SECONDS of the recommendation service, 0 to call the catalog on every request')
+    parser.add_argument('--max_workers', default='10', help='MAX_WORKERS of the thread pool mode')
+    parser.add_argument('--max_concurrent_rpcs', default='0', help='MAX_CONCURRENT_RPCS of both modes')
+    parser.add_argument('--python', default=sys.executable, help='interpreter to run the services with')
+    args = parser.parse_args()
+
+    out_dir = tempfile.mkdtemp()
+    catalog = start([args.python, 'stub_catalog_server.py', '--port', CATALOG_PORT,
+                     '--latency_ms', str(args.catalog_latency_ms)], RECOMMENDATION_DIR)
+    try:
+        print("{:>15} {:>8} {:>8} {:>10} {:>9} {:>8} {:>8}".format(
+            'service', 'mode', 'clients', 'requests/s', 'failures', 'p50_ms', 'p99_ms'))
+        for name, command, cwd, env, user_class, locust_env in services(args):
+            for mode in args.modes.split(','):
+                server = start(command, cwd, dict(env, PORT=SERVICE_PORT, SERVER_MODE=mode,
+                                                  MAX_WORKERS=args.max_workers,
+                                                  MAX_CONCURRENT_RPCS=args.max_concurrent_rpcs))
+                time.sleep(3)
+                try:
+                    for clients in [int(x) for x in args.clients.split(',')]:
+                        requests_per_second, failures, p50, p99 = run_locust(
+                            user_class, locust_env, clients, args.hatch_rate, args.requests, out_dir)
+                        print("{:>15} {:>8} {:>8} {:>10.1f} {:>9} {:>8.0f} {:>8.0f}".format(
+                            name, mode, clients, requests_per_second, failures, p50, p99))
+                finally:
+                    stop(server)
+    finally:
+        stop(catalog)
+        shutil.rmtree(out_dir)
@@ -14,8 +14,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import random
-from locust import HttpLocust, TaskSet
+import time
+from locust import HttpLocust, Locust, TaskSet, events
 
 products = [
     '0PUK6V6EV0',
@@ -80,3 +82,78 @@ class WebsiteUser(HttpLocust):
     task_set = UserBehavior
     min_wait = 1000
     max_wait = 10000
+
+# Call the recommendation and email services directly over gRPC, to measure
+# their latency on their own, e.g. against
+# recommendationservice/stub_catalog_server.py. RecommendationUser is only
+# defined when RECOMMENDATION_SERVICE_ADDR is set and EmailUser when
+# EMAIL_SERVICE_ADDR is set, which needs grpcio and the generated demo_pb2
+# modules of the recommendationservice on the PYTHONPATH.
+RECOMMENDATION_SERVICE_ADDR = os.environ.get('RECOMMENDATION_SERVICE_ADDR', '')
+EMAIL_SERVICE_ADDR = os.environ.get('EMAIL_SERVICE_ADDR', '')
+
+if RECOMMENDATION_SERVICE_ADDR or EMAIL_SERVICE_ADDR:
+    import grpc
+    import demo_pb2
+    import demo_pb2_grpc
+
+    class GrpcClient(object):
+        """Reports gRPC calls to locust like HTTP requests."""
+
+        def __init__(self, addr, stub_class):
+            self.stub = stub_class(grpc.insecure_channel(addr))
+
+        def call(self, name, method, request):
+            start = time.time()
+            try:
+                response = method(request)
+            except grpc.RpcError as e:
+                events.request_failure.fire(request_type='grpc', name=name,
+                    response_time=int((time.time() - start) * 1000), exception=e)
+            else:
+                events.request_success.fire(request_type='grpc', name=name,
+                    response_time=int((time.time() - start) * 1000),
+                    response_length=response.ByteSize())
+
+if RECOMMENDATION_SERVICE_ADDR:
+    def listRecommendations(l):
+        # like the frontend, which leaves out the product being viewed or the cart
+        l.client.call('ListRecommendations', l.client.stub.ListRecommendations,
+            demo_pb2.ListRecommendationsRequest(user_id='loadgenerator',
+                product_ids=random.sample(products, random.choice([0, 1, 1, 3]))))
+
+    class RecommendationBehavior(TaskSet):
+        tasks = {listRecommendations: 1}
+
+    class RecommendationUser(Locust):
+        task_set = RecommendationBehavior
+        min_wait = 0
+        max_wait = 100
+
+        def __init__(self):
+            super(RecommendationUser, self).__init__()
+            self.client = GrpcClient(RECOMMENDATION_SERVICE_ADDR, demo_pb2_grpc.RecommendationServiceStub)
+
+if EMAIL_SERVICE_ADDR:
+    def sendOrderConfirmation(l):
+        order = demo_pb2.OrderResult(
+            order_id='loadgenerator-{}'.format(random.randint(0, 1 << 30)),
+            shipping_tracking_id='loadgenerator',
+            shipping_cost=demo_pb2.Money(currency_code='USD', units=8, nanos=990000000))
+        for product_id in random.sample(products, random.choice([1, 2, 3])):
+            order.items.add(item=demo_pb2.CartItem(product_id=product_id, quantity=random.choice([1, 2, 3])),
+                            cost=demo_pb2.Money(currency_code='USD', units=19, nanos=990000000))
+        l.client.call('SendOrderConfirmation', l.client.stub.SendOrderConfirmation,
+            demo_pb2.SendOrderConfirmationRequest(email='someone@example.com', order=order))
+
+    class EmailBehavior(TaskSet):
+        tasks = {sendOrderConfirmation: 1}
+
+    class EmailUser(Locust):
+        task_set = EmailBehavior
+        min_wait = 0
+        max_wait = 100
+
+        def __init__(self):
+            super(EmailUser, self).__init__()
+            self.client = GrpcClient(EMAIL_SERVICE_ADDR, demo_pb2_grpc.EmailServiceStub)
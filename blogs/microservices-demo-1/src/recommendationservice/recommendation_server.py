@@ -16,6 +16,8 @@
 
 import os
 import random
+import sys
+import threading
 import time
 import traceback
 from concurrent import futures
@@ -35,28 +37,138 @@ from grpc_health.v1 import health_pb2_grpc
 from logger import getJSONLogger
 logger = getJSONLogger('recommendationservice-server')
 
+try:
+    xrange
+except NameError:  # Python 3, for the asyncio server mode
+    xrange = range
+
+
+def simulated_work():
+    for x in xrange(5000000):
+        # if prod_list != null {break}
+        pass
+
+
+class CatalogSnapshot(object):
+    """Product ids of the catalog at one point in time, never modified."""
+
+    def __init__(self, product_ids, fetched_at):
+        # unique ids, in catalog order, and the set of them for filtering
+        unique_ids = []
+        seen = set()
+        for product_id in product_ids:
+            if product_id not in seen:
+                seen.add(product_id)
+                unique_ids.append(product_id)
+        self.product_ids = tuple(unique_ids)
+        self.index = frozenset(unique_ids)
+        self.fetched_at = fetched_at
+
+    def sample(self, count, exclude_ids=()):
+        """Returns up to count random product ids, none of them in exclude_ids."""
+        product_ids = self.product_ids
+        excluded = self.index.intersection(exclude_ids)
+        count = min(count, len(product_ids) - len(excluded))
+        if count <= 0:
+            return []
+        if not excluded:
+            return random.sample(product_ids, count)
+        if 2 * (len(excluded) + count) > len(product_ids):
+            return random.sample([p for p in product_ids if p not in excluded], count)
+        # few ids excluded: draw indices until enough allowed ones were found
+        picked = set()
+        sample = []
+        while len(sample) < count:
+            i = random.randrange(len(product_ids))
+            if i not in picked:
+                picked.add(i)
+                if product_ids[i] not in excluded:
+                    sample.append(product_ids[i])
+        return sample
+
+
+class ProductCatalogCache(object):
+    """
+    In-process snapshot of the product catalog, served stale-while-revalidate.
+
+    Once the snapshot is older than ttl seconds, requests keep getting it while
+    a single background thread fetches a new one. Requests only wait for the
+    product catalog service when there is no snapshot yet, or when it is older
+    than max_stale seconds, e.g. because refreshes keep failing. With a ttl of
+    0 the catalog is fetched on every request.
+    """
+
+    def __init__(self, stub, ttl=60, max_stale=600, timeout=10):
+        self._stub = stub
+        self._ttl = ttl
+        self._max_stale = max(max_stale, ttl)
+        self._timeout = timeout
+        self._snapshot = None
+        self._fetch_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self):
+        """Returns the current CatalogSnapshot."""
+        snapshot = self._snapshot
+        if self._ttl <= 0:
+            return self._fetch()
+        age = time.time() - snapshot.fetched_at if snapshot is not None else None
+        if age is None or age >= self._max_stale:
+            return self._fetch_if_stale()
+        if age >= self._ttl:
+            self._start_refresh()
+        return snapshot
+
+    def _fetch(self):
+        response = self._stub.ListProducts(demo_pb2.Empty(), timeout=self._timeout)
+        snapshot = CatalogSnapshot([x.id for x in response.products], time.time())
+        self._snapshot = snapshot
+        return snapshot
+
+    def _fetch_if_stale(self):
+        # one fetch for all the requests waiting on it
+        with self._fetch_lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.time() - snapshot.fetched_at < self._max_stale:
+                return snapshot
+            return self._fetch()
+
+    def _start_refresh(self):
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        refresher = threading.Thread(target=self._refresh, name='catalog-refresh')
+        refresher.daemon = True
+        refresher.start()
+
+    def _refresh(self):
+        try:
+            self._fetch()
+            logger.info("refreshed product catalog: {} products".format(len(self._snapshot.product_ids)))
+        except Exception:
+            logger.error("could not refresh product catalog, serving the cached one")
+            logger.error(traceback.format_exc())
+        finally:
+            with self._refresh_lock:
+                self._refreshing = False
+
 
 class RecommendationService(demo_pb2_grpc.RecommendationServiceServicer):
+    def __init__(self, catalog):
+        self.catalog = catalog
+
     def ListRecommendations(self, request, context):
         max_responses = 5
-        # fetch list of products from product catalog stub
-        cat_response = product_catalog_stub.ListProducts(demo_pb2.Empty())
-        product_ids = [x.id for x in cat_response.products]
-        filtered_products = list(set(product_ids)-set(request.product_ids))
-        num_products = len(filtered_products)
-        num_return = min(max_responses, num_products)
-        # sample list of indicies to return
-        indices = random.sample(range(num_products), num_return)
-        # fetch product ids from indices
-        prod_list = [filtered_products[i] for i in indices]
+        # sample products from the cached product catalog, leaving out the requested ones
+        prod_list = self.catalog.get().sample(max_responses, request.product_ids)
         logger.info("[Recv ListRecommendations] product_ids={}".format(prod_list))
         # build and return response
         response = demo_pb2.ListRecommendationsResponse()
         response.product_ids.extend(prod_list)
         
-        for x in xrange(5000000):
-            # if prod_list != null {break}
-            pass
+        simulated_work()
         return response
 
     def Check(self, request, context):
@@ -79,7 +191,7 @@ if __name__ == "__main__":
             module='recommendationserver',
             version='1.0.0'
         )
-    except Exception, err:
+    except Exception as err:
         logger.error("could not enable debugger")
         logger.error(traceback.print_exc())
         pass
@@ -89,14 +201,34 @@ if __name__ == "__main__":
     if catalog_addr == "":
         raise Exception('PRODUCT_CATALOG_SERVICE_ADDR environment variable not set')
     logger.info("product catalog address: " + catalog_addr)
+    catalog_ttl = float(os.environ.get('CATALOG_TTL_SECONDS', "60"))
+    catalog_max_stale = float(os.environ.get('CATALOG_MAX_STALE_SECONDS', "600"))
+    # 0 for no limit besides the number of worker threads
+    max_concurrent_rpcs = int(os.environ.get('MAX_CONCURRENT_RPCS', "0")) or None
+
+    if os.environ.get('SERVER_MODE', "threads") == "aio":
+        # asyncio server, needs Python 3.7+ and grpcio 1.32+. It imports this
+        # module by name, which must not load it a second time.
+        sys.modules['recommendation_server'] = sys.modules[__name__]
+        import recommendation_server_aio
+        recommendation_server_aio.main(port, catalog_addr, max_concurrent_rpcs,
+                                       catalog_ttl, catalog_max_stale)
+        sys.exit(0)
+
     channel = grpc.insecure_channel(catalog_addr)
     product_catalog_stub = demo_pb2_grpc.ProductCatalogServiceStub(channel)
+    catalog = ProductCatalogCache(product_catalog_stub, ttl=catalog_ttl, max_stale=catalog_max_stale)
+    try:
+        catalog.get()
+    except Exception:
+        logger.error("could not fetch product catalog, will retry on the first request")
 
     # create gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10)) # ,interceptors=(tracer_interceptor,))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=int(os.environ.get('MAX_WORKERS', "10"))),
+                         maximum_concurrent_rpcs=max_concurrent_rpcs) # ,interceptors=(tracer_interceptor,))
 
     # add class to gRPC server
-    service = RecommendationService()
+    service = RecommendationService(catalog)
     demo_pb2_grpc.add_RecommendationServiceServicer_to_server(service, server)
     health_pb2_grpc.add_HealthServicer_to_server(service, server)
 
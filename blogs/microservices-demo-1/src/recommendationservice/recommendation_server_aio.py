@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# asyncio mode of the recommendation service, selected with SERVER_MODE=aio.
+# Needs Python 3.7+ and grpcio 1.32+. RPCs wait on the product catalog
+# without holding a thread, so concurrency is bounded by MAX_CONCURRENT_RPCS
+# rather than by the size of a thread pool.
+
+import asyncio
+import os
+import signal
+import time
+
+import grpc
+
+import demo_pb2
+import demo_pb2_grpc
+from grpc_health.v1 import health_pb2
+from grpc_health.v1 import health_pb2_grpc
+
+from recommendation_server import CatalogSnapshot, logger, simulated_work
+
+
+class AsyncProductCatalogCache(object):
+    """
+    ProductCatalogCache for asyncio servers, with the same ttl and max_stale
+    semantics. At most one ListProducts call is in flight, shared by the
+    requests that wait for it and by background refreshes.
+    """
+
+    def __init__(self, stub, ttl=60, max_stale=600, timeout=10):
+        self._stub = stub
+        self._ttl = ttl
+        self._max_stale = max(max_stale, ttl)
+        self._timeout = timeout
+        self._snapshot = None
+        self._fetching = None
+
+    async def get(self):
+        """Returns the current CatalogSnapshot."""
+        snapshot = self._snapshot
+        if self._ttl <= 0:
+            return await self._fetch()
+        age = time.time() - snapshot.fetched_at if snapshot is not None else None
+        if age is None or age >= self._max_stale:
+            # shielded, so that a cancelled RPC does not cancel the fetch of the others
+            return await asyncio.shield(self._start_fetch())
+        if age >= self._ttl:
+            self._start_fetch()
+        return snapshot
+
+    async def _fetch(self):
+        response = await self._stub.ListProducts(demo_pb2.Empty(), timeout=self._timeout)
+        self._snapshot = CatalogSnapshot([x.id for x in response.products], time.time())
+        return self._snapshot
+
+    def _start_fetch(self):
+        if self._fetching is None:
+            self._fetching = asyncio.ensure_future(self._fetch())
+            self._fetching.add_done_callback(self._fetch_done)
+        return self._fetching
+
+    def _fetch_done(self, task):
+        self._fetching = None
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.error("could not fetch product catalog: {}".format(task.exception()))
+        else:
+            logger.info("refreshed product catalog: {} products".format(len(task.result().product_ids)))
+
+
+class AsyncRecommendationService(demo_pb2_grpc.RecommendationServiceServicer):
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    async def ListRecommendations(self, request, context):
+        max_responses = 5
+        # sample products from the cached product catalog, leaving out the requested ones
+        snapshot = await self.catalog.get()
+        prod_list = snapshot.sample(max_responses, request.product_ids)
+        logger.info("[Recv ListRecommendations] product_ids={}".format(prod_list))
+        # build and return response
+        response = demo_pb2.ListRecommendationsResponse()
+        response.product_ids.extend(prod_list)
+
+        # blocking work runs on the default executor, not on the event loop
+        await asyncio.get_event_loop().run_in_executor(None, simulated_work)
+        return response
+
+    async def Check(self, request, context):
+        return health_pb2.HealthCheckResponse(
+            status=health_pb2.HealthCheckResponse.SERVING)
+
+    # part of the health service of the grpcio versions with asyncio support
+    async def Watch(self, request, context):
+        await context.abort(grpc.StatusCode.UNIMPLEMENTED, 'health watch is not supported')
+
+
+async def serve(port, catalog_addr, max_concurrent_rpcs=None, catalog_ttl=60, catalog_max_stale=600,
+                shutdown_grace=10):
+    channel = grpc.aio.insecure_channel(catalog_addr)
+    catalog = AsyncProductCatalogCache(demo_pb2_grpc.ProductCatalogServiceStub(channel),
+                                       ttl=catalog_ttl, max_stale=catalog_max_stale)
+    try:
+        await catalog.get()
+    except Exception:
+        logger.error("could not fetch product catalog, will retry on the first request")
+
+    server = grpc.aio.server(maximum_concurrent_rpcs=max_concurrent_rpcs)
+    service = AsyncRecommendationService(catalog)
+    demo_pb2_grpc.add_RecommendationServiceServicer_to_server(service, server)
+    health_pb2_grpc.add_HealthServicer_to_server(service, server)
+
+    logger.info("listening on port: " + port + " (asyncio)")
+    server.add_insecure_port('[::]:' + port)
+    await server.start()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    await stopping.wait()
+
+    # new RPCs are rejected, in-flight ones get shutdown_grace seconds to finish
+    logger.info("shutting down")
+    await server.stop(shutdown_grace)
+    await channel.close()
+
+
+def main(port, catalog_addr, max_concurrent_rpcs=None, catalog_ttl=60, catalog_max_stale=600):
+    shutdown_grace = float(os.environ.get('SHUTDOWN_GRACE_SECONDS', "10"))
+    asyncio.run(serve(port, catalog_addr, max_concurrent_rpcs, catalog_ttl, catalog_max_stale,
+                      shutdown_grace))
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+#
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Stub product catalog service to load test the recommendation service on its
+# own. Start it, the recommendation service and the RecommendationUser locust
+# scenario of loadgenerator/locustfile.py:
+#
+#   python stub_catalog_server.py --port 3550 --latency_ms 20 &
+#   PRODUCT_CATALOG_SERVICE_ADDR=localhost:3550 PORT=8080 python recommendation_server.py &
+#   RECOMMENDATION_SERVICE_ADDR=localhost:8080 PYTHONPATH=. \
+#       locust -f ../loadgenerator/locustfile.py --no-web -c 50 -r 10 -n 5000 RecommendationUser
+#
+# Run the recommendation service with CATALOG_TTL_SECONDS=0 to compare with
+# fetching the catalog on every request.
+
+import argparse
+import time
+from concurrent import futures
+
+import grpc
+
+import demo_pb2
+import demo_pb2_grpc
+
+from logger import getJSONLogger
+logger = getJSONLogger('stub-catalog-server')
+
+# the ids of the demo catalog, also used by the load generator
+DEMO_PRODUCT_IDS = [
+    '0PUK6V6EV0',
+    '1YMWWN1N4O',
+    '2ZYFJ3GM2N',
+    '66VCHSJNUP',
+    '6E92ZMYYFZ',
+    '9SIQT8TOJO',
+    'L9ECAV7KIM',
+    'LS4PSXUNUM',
+    'OLJCESPC7Z']
+
+
+class StubProductCatalogService(demo_pb2_grpc.ProductCatalogServiceServicer):
+    def __init__(self, num_products, latency_ms):
+        product_ids = DEMO_PRODUCT_IDS + \
+            ['STUB{:06d}'.format(i) for i in range(max(num_products - len(DEMO_PRODUCT_IDS), 0))]
+        self.response = demo_pb2.ListProductsResponse(
+            products=[demo_pb2.Product(id=product_id, name=product_id) for product_id in product_ids])
+        self.latency = latency_ms / 1000.0
+        self.num_calls = 0
+
+    def ListProducts(self, request, context):
+        self.num_calls += 1
+        time.sleep(self.latency)
+        return self.response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Stub product catalog service')
+    parser.add_argument('--port', default="3550")
+    parser.add_argument('--num_products', type=int, default=len(DEMO_PRODUCT_IDS))
+    parser.add_argument('--latency_ms', type=float, default=20.0,
+                        help='time spent in each ListProducts call')
+    args = parser.parse_args()
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    service = StubProductCatalogService(args.num_products, args.latency_ms)
+    demo_pb2_grpc.add_ProductCatalogServiceServicer_to_server(service, server)
+    logger.info("listening on port: " + args.port)
+    server.add_insecure_port('[::]:' + args.port)
+    server.start()
+
+    try:
+        while True:
+            time.sleep(10)
+            logger.info("ListProducts calls: {}".format(service.num_calls))
+    except KeyboardInterrupt:
+        server.stop(0)
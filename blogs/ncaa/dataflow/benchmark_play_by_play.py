@@ -0,0 +1,104 @@
+import argparse
+import json
+import random
+import time
+
+import apache_beam as beam
+from apache_beam.options.pipeline_options import PipelineOptions
+
+from play_by_play import Format
+
+ACTIONS = [
+    ('2pt', ['layup', 'drivinglayup', 'dunk', 'tipin', 'jumpshot', 'hookshot',
+             'alleyoop', 'other'])
+    , ('3pt', ['jumpshot'])
+    , ('freethrow', ['1of2', '2of2'])
+    , ('rebound', ['offensive', 'defensive', 'offensivedeadball'])
+    , ('block', [''])
+    , ('assist', [''])
+    , ('steal', [''])
+    , ('turnover', ['badpass'])
+    , ('foul', ['personal', 'technical'])
+    , ('substitution', ['in', 'out'])
+    , ('timeout', ['full', 'short', 'media'])
+    , ('jumpball', ['startperiod'])
+]
+
+
+def synthetic_game(game_num, plays_per_game, rng):
+    """One line of play-by-play JSON, in the same layout as the NCAA files."""
+    home, away = 1000 + game_num % 350, 2000 + game_num % 350
+    game_id = '{}-{}-2018-{}-{}'.format(
+        home, away, 1 + game_num % 12, 1 + game_num % 28)
+    score1, score2 = 0, 0
+    plays = []
+    for n in range(plays_per_game):
+        action_type, sub_types = rng.choice(ACTIONS)
+        success = rng.randint(0, 1)
+        if action_type in ('2pt', '3pt', 'freethrow') and success:
+            if rng.randint(0, 1):
+                score1 += 1
+            else:
+                score2 += 1
+        period = 1 + (n * 2) // plays_per_game
+        plays.append({
+            'game_id': game_id
+            , 'season': 2018
+            , 'neutral_site': 'false'
+            , 'actionType': action_type
+            , 'subType': rng.choice(sub_types)
+            , 'success': success
+            , 'score1': score1
+            , 'score2': score2
+            , 'teamExternalId': 'TM{}'.format(rng.choice([home, away]))
+            , 'personExternalId': rng.randint(1, 5000)
+            , 'firstName': 'first'
+            , 'familyName': 'family'
+            , 'clock': '{:02d}:{:02d}:00'.format(rng.randint(0, 19),
+                                                  rng.randint(0, 59))
+            , 'periodType': 'REGULAR'
+            , 'period': period
+        })
+    return json.dumps(plays)
+
+
+def run(num_games, plays_per_game):
+    rng = random.Random(0)
+    games = [synthetic_game(g, plays_per_game, rng) for g in range(num_games)]
+
+    # the DoFn alone, without any runner overhead
+    fn = Format()
+    start = time.time()
+    num_plays = sum(1 for game in games for _ in fn.process(game))
+    dofn_secs = time.time() - start
+
+    # the same transform on the local DirectRunner
+    start = time.time()
+    with beam.Pipeline(options=PipelineOptions(['--runner=DirectRunner'])) as p:
+        (p
+         | beam.Create(games)
+         | 'Format' >> beam.ParDo(Format())
+         | beam.combiners.Count.Globally())
+    pipeline_secs = time.time() - start
+
+    print('{} games, {} plays'.format(num_games, num_plays))
+    print('DoFn only:    {:.0f} elements/sec'.format(num_plays / dofn_secs))
+    print('DirectRunner: {:.0f} elements/sec'.format(num_plays / pipeline_secs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--num_games',
+        help='Number of synthetic games, a season is about 5500',
+        type=int,
+        default=5500
+    )
+    parser.add_argument(
+        '--plays_per_game',
+        help='Number of plays in each synthetic game',
+        type=int,
+        default=400
+    )
+    args = parser.parse_args()
+    run(args.num_games, args.plays_per_game)
@@ -1,3 +1,6 @@
+import argparse
+import random
+import time
 
 PARAMS = None
 
@@ -56,6 +59,23 @@ def initialise_hyper_params(args_parser):
         default='local_dir/outputs',
     )
 
+    args_parser.add_argument(
+        '--max-batch-size',
+        help="""
+        Largest batch of instances sent to the model in one call, in batch and stream pipelines\
+        """,
+        default=100,
+        type=int
+    )
+
+    args_parser.add_argument(
+        '--benchmark-batch-sizes',
+        help="""
+        Comma separated batch sizes compared by the local benchmark of this module\
+        """,
+        default='1,10,100,500',
+    )
+
     ###########################################
     # steaming parameters
 
@@ -105,12 +125,82 @@ def initialise_hyper_params(args_parser):
     PARAMS = args_parser.parse_args()
 
 
-
-
-
-
-
-
-
-
-
+def generate_bq_rows(sample_size, seed=0):
+    """
+    Generates rows like the ones read from the natality table by the batch pipeline
+
+    Args:
+        sample_size: number of rows
+        seed: random seed
+    Returns:
+        list of dictionaries
+    """
+
+    rng = random.Random(seed)
+    races = [1, 2, 3, 4, 5, 6, 7, 18, 28, 39, 48, 9]
+    return [
+        {
+            'weight_pounds': round(rng.uniform(4.0, 10.0), 2),
+            'is_male': rng.choice([True, False]),
+            'mother_age': rng.randint(15, 45),
+            'mother_race': rng.choice(races),
+            'plurality': rng.choice([1, 1, 1, 2]),
+            'gestation_weeks': rng.randint(30, 42),
+            'mother_married': rng.choice([True, False]),
+            'cigarette_use': rng.choice([True, False, None]),
+            'alcohol_use': rng.choice([True, False, None])
+        }
+        for _ in range(sample_size)
+    ]
+
+
+def run_local_benchmark(sample_size, batch_sizes):
+    """
+    Runs the local model inference of the batch pipeline on generated rows with
+    the DirectRunner, once per batch size
+
+    Args:
+        sample_size: number of rows
+        batch_sizes: list of batch sizes, each run sends batches of exactly that size
+    Returns:
+        list of (batch size, rows per second)
+    """
+
+    import apache_beam as beam
+    from model import inference
+    from pipelines import batch_process
+    from pipelines.batch_inference import EstimateTargets
+
+    bq_rows = generate_bq_rows(sample_size)
+
+    # loaded once, as on a worker, so that the first run is not slower
+    inference.init_predictor()
+
+    results = []
+    for batch_size in batch_sizes:
+        pipeline = beam.Pipeline('DirectRunner')
+        (
+                pipeline
+                | 'Create Rows' >> beam.Create(bq_rows)
+                | 'Process BQ Row' >> beam.Map(batch_process.process_row)
+                | 'Estimate Targets - local' >> EstimateTargets('local', min_batch_size=batch_size,
+                                                                max_batch_size=batch_size)
+                | 'Convert to CSV' >> beam.Map(batch_process.to_csv)
+        )
+
+        time_start = time.time()
+        pipeline.run().wait_until_finish()
+        results.append((batch_size, sample_size / (time.time() - time_start)))
+    return results
+
+
+if __name__ == '__main__':
+
+    args_parser = argparse.ArgumentParser()
+    initialise_hyper_params(args_parser)
+
+    batch_sizes = [int(batch_size) for batch_size in PARAMS.benchmark_batch_sizes.split(',')]
+    print("Local inference benchmark: {} rows".format(PARAMS.batch_sample_size))
+    print(".......................................")
+    for batch_size, rows_per_second in run_local_benchmark(PARAMS.batch_sample_size, batch_sizes):
+        print("Batch size {:>5}: {:>10.1f} rows/sec".format(batch_size, rows_per_second))
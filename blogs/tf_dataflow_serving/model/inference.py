@@ -11,6 +11,10 @@ PROJECT = '<PROJECT_ID>'
 CMLE_MODEL_NAME = 'babyweight_estimator'
 CMLE_MODEL_VERSION = 'v1'
 
+# input features of the babyweight estimator
+FEATURES = ['is_male', 'mother_age', 'mother_race', 'plurality',
+            'gestation_weeks', 'mother_married', 'cigarette_use', 'alcohol_use']
+
 
 #[START inference_local]
 predictor_fn = None
@@ -50,16 +54,23 @@ def estimate_local(instances):
         int - estimated baby weight
     """
 
-    init_predictor()
+    inputs = dict((k, [instance[k] for instance in instances]) for k in instances[0])
+    return estimate_local_columns(inputs)
 
-    inputs = dict((k, [v]) for k, v in instances[0].items())
-    for i in range(1,len(instances)):
-        instance = instances[i]
 
-        for k, v in instance.items():
-            inputs[k] += [v]
+def estimate_local_columns(columns):
+    """
+    Calls the local babyweight estimator to get predictions for a columnar batch
+
+    Args:
+       columns: dictionary of feature name to list of values, one per instance
+    Returns:
+        list of int - estimated baby weights
+    """
+
+    init_predictor()
 
-    values = predictor_fn(inputs)['predictions']
+    values = predictor_fn(columns)['predictions']
     return [value.item() for value in values.reshape(-1)]
 #[END inference_local]
 
@@ -0,0 +1,77 @@
+import apache_beam as beam
+from apache_beam.transforms.util import BatchElements
+from model import inference
+
+
+#[START batch_inference]
+class EstimateBatchFn(beam.DoFn):
+    """
+    Estimates the baby weights of a batch of instances with one call to the
+    model, which is loaded once per worker
+
+    Args:
+        inference_type: can be 'local' or 'cmle'
+    """
+
+    def __init__(self, inference_type):
+        super(EstimateBatchFn, self).__init__()
+        self.inference_type = inference_type
+
+    def setup(self):
+        if self.inference_type == 'local':
+            inference.init_predictor()
+        elif self.inference_type == 'cmle':
+            inference.init_api()
+
+    def start_bundle(self):
+        # Beam releases before 2.14 do not call setup(), loading is a no-op once done
+        self.setup()
+
+    def process(self, instances):
+        """
+        Args:
+            instances: list of dictionaries of the input features, other values are passed through
+        Returns:
+            the instances, with their estimated_weight
+        """
+
+        if self.inference_type == 'local':
+            columns = dict((k, [instance[k] for instance in instances]) for k in inference.FEATURES)
+            estimated_weights = inference.estimate_local_columns(columns)
+        elif self.inference_type == 'cmle':
+            estimated_weights = inference.estimate_cmle(
+                [dict((k, instance[k]) for k in inference.FEATURES) for instance in instances])
+        else:
+            estimated_weights = ['NA'] * len(instances)
+
+        for instance, estimated_weight in zip(instances, estimated_weights):
+            output = dict(instance)
+            output['estimated_weight'] = estimated_weight
+            yield output
+
+
+class EstimateTargets(beam.PTransform):
+    """
+    Batches the instances, with BatchElements, and estimates their baby weights
+
+    Args:
+        inference_type: can be 'local' or 'cmle'
+        min_batch_size: smallest batch sent to the model
+        max_batch_size: largest batch sent to the model, BatchElements picks
+            sizes in between based on the time taken by each batch
+    """
+
+    def __init__(self, inference_type, min_batch_size=1, max_batch_size=100):
+        super(EstimateTargets, self).__init__()
+        self.inference_type = inference_type
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+
+    def expand(self, instances):
+        return (
+                instances
+                | 'Batch Instances' >> BatchElements(min_batch_size=self.min_batch_size,
+                                                     max_batch_size=self.max_batch_size)
+                | 'Estimate Batches' >> beam.ParDo(EstimateBatchFn(self.inference_type))
+        )
+#[END batch_inference]
@@ -1,5 +1,5 @@
 import apache_beam as beam
-from model import inference
+from pipelines.batch_inference import EstimateTargets
 import json
 
 
@@ -28,6 +28,12 @@ SOURCE_QUERY = """
             AND month > 0
 """
 
+# opaque numeric race codes to human-readable data
+RACES = dict(zip([1, 2, 3, 4, 5, 6, 7, 18, 28, 39, 48],
+                 ['White', 'Black', 'American Indian', 'Chinese',
+                  'Japanese', 'Hawaiian', 'Filipino',
+                  'Asian bq_row', 'Korean', 'Samaon', 'Vietnamese']))
+
 
 def get_source_query(sample_size):
     query = """
@@ -61,18 +67,13 @@ def process_row(bq_row):
 
     """
 
-    # modify opaque numeric race code into human-readable data
-    races = dict(zip([1, 2, 3, 4, 5, 6, 7, 18, 28, 39, 48],
-                     ['White', 'Black', 'American Indian', 'Chinese',
-                      'Japanese', 'Hawaiian', 'Filipino',
-                      'Asian bq_row', 'Korean', 'Samaon', 'Vietnamese']))
     instance = dict()
 
     instance['is_male'] = str(bq_row['is_male'])
     instance['mother_age'] = bq_row['mother_age']
 
-    if 'mother_race' in bq_row and bq_row['mother_race'] in races:
-        instance['mother_race'] = races[bq_row['mother_race']]
+    if 'mother_race' in bq_row and bq_row['mother_race'] in RACES:
+        instance['mother_race'] = RACES[bq_row['mother_race']]
     else:
         instance['mother_race'] = 'Unknown'
 
@@ -98,18 +99,13 @@ def to_json_line(bq_row):
 
     """
 
-    # modify opaque numeric race code into human-readable data
-    races = dict(zip([1, 2, 3, 4, 5, 6, 7, 18, 28, 39, 48],
-                     ['White', 'Black', 'American Indian', 'Chinese',
-                      'Japanese', 'Hawaiian', 'Filipino',
-                      'Asian bq_row', 'Korean', 'Samaon', 'Vietnamese']))
     instance = dict()
 
     instance['is_male'] = str(bq_row['is_male'])
     instance['mother_age'] = bq_row['mother_age']
 
-    if 'mother_race' in bq_row and bq_row['mother_race'] in races:
-        instance['mother_race'] = races[bq_row['mother_race']]
+    if 'mother_race' in bq_row and bq_row['mother_race'] in RACES:
+        instance['mother_race'] = RACES[bq_row['mother_race']]
     else:
         instance['mother_race'] = 'Unknown'
 
@@ -122,35 +118,6 @@ def to_json_line(bq_row):
     return json.dumps(instance)
 
 
-def estimate(instance, inference_type):
-    """
-    Estimate the baby weight given an instance
-    If inference type is 'cmle', the model API deployed on Coud ML Engine is called,
-    otherwise, the local model is called
-
-    Agrs:
-        instance: dictionary of values representing the input features of the instance
-        inference_type: cane be 'local or 'cmle'
-    Returns:
-         int - baby weight estimate from the model
-    """
-
-    # pop the actual weight if exists
-    weight_pounds = instance.pop('weight_pounds', 'NA')
-
-    if inference_type == 'local':
-        estimated_weights = inference.estimate_local([instance])
-    elif inference_type == 'cmle':
-        estimated_weights = inference.estimate_cmle([instance])
-    else:
-        estimated_weights = 'NA'
-
-    instance['estimated_weight'] = estimated_weights[0]
-    instance['weight_pounds'] = weight_pounds[0]
-
-    return instance
-
-
 def to_csv(instance):
     """
     Convert the instance, including the estimated baby weight, to csv string
@@ -166,7 +133,7 @@ def to_csv(instance):
     return csv_row
 
 
-def run_pipeline(inference_type, sample_size, sink_location, runner, args=None):
+def run_pipeline(inference_type, sample_size, sink_location, runner, max_batch_size=100, args=None):
 
     source_query = get_source_query(sample_size)
 
@@ -182,7 +149,7 @@ def run_pipeline(inference_type, sample_size, sink_location, runner, args=None):
             pipeline
             | 'Read from BigQuery {}'.format(sample_size_desc) >> beam.io.Read(beam.io.BigQuerySource(query=source_query, use_standard_sql=True))
             | 'Process BQ Row' >> beam.Map(process_row)
-            | 'Estimate Targets - {}'.format(inference_type) >> beam.Map(lambda instance: estimate(instance, inference_type))
+            | 'Estimate Targets - {}'.format(inference_type) >> EstimateTargets(inference_type, max_batch_size=max_batch_size)
             | 'Convert to CSV' >> beam.Map(to_csv)
             | 'Write to Sink ' >> beam.io.Write(beam.io.WriteToText(sink_location, file_name_suffix='.csv'))
     )
@@ -1,8 +1,7 @@
 import apache_beam as beam
-import logging
 from apache_beam.transforms.window import FixedWindows
 
-from model import inference
+from pipelines.batch_inference import EstimateTargets
 from datetime import datetime
 import json
 
@@ -74,47 +73,14 @@ def prepare_steaming_sink(project_id, bq_dataset, bq_table):
     print("")
 
 
-def estimate(messages, inference_type):
+def add_predict_timestamp(instance):
 
-    if not isinstance(messages, list):
-        messages = [messages]
-
-    instances = list(
-        map(lambda message: json.loads(message),
-            messages)
-    )
-
-    source_ids = list(
-        map(lambda instance: instance.pop('source_id'),
-            instances)
-
-    )
-
-    source_timestamps = list(
-        map(lambda instance: instance.pop('source_timestamp'),
-            instances)
-    )
-
-    if inference_type == 'local':
-        estimated_weights = inference.estimate_local(instances)
-    elif inference_type == 'cmle':
-        estimated_weights = inference.estimate_cmle(instances)
-    else:
-        estimated_weights = 'NA'
-
-    for i in range(len(instances)):
-        instance = instances[i]
-        instance['estimated_weight'] = estimated_weights[i]
-        instance['source_id'] = source_ids[i]
-        instance['source_timestamp'] = source_timestamps[i]
-        instance['predict_timestamp'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-
-    logging.info(instances)
-
-    return instances
+    instance['predict_timestamp'] = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    return instance
 
 
-def run_pipeline(inference_type, project, pubsub_topic, pubsub_subscription, bq_dataset, bq_table, runner, args=None):
+def run_pipeline(inference_type, project, pubsub_topic, pubsub_subscription, bq_dataset, bq_table, runner,
+                 max_batch_size=100, args=None):
 
     prepare_steaming_source(project, pubsub_topic, pubsub_subscription)
 
@@ -130,7 +96,9 @@ def run_pipeline(inference_type, project, pubsub_topic, pubsub_subscription, bq_
 
             pipeline
             | 'Read from PubSub' >> beam.io.ReadStringsFromPubSub(subscription=pubsub_subscription_url, id_label="source_id")
-            | 'Estimate Targets - {}'.format(inference_type) >> beam.FlatMap(lambda message: estimate(message, inference_type))
+            | 'Parse Messages' >> beam.Map(json.loads)
+            | 'Estimate Targets - {}'.format(inference_type) >> EstimateTargets(inference_type, max_batch_size=max_batch_size)
+            | 'Add Predict Timestamp' >> beam.Map(add_predict_timestamp)
             | 'Write to BigQuery' >> beam.io.WriteToBigQuery(project=project,
                                                              dataset=bq_dataset,
                                                              table=bq_table)
@@ -143,7 +111,7 @@ def run_pipeline(inference_type, project, pubsub_topic, pubsub_subscription, bq_
 def run_pipeline_with_micro_batches(inference_type, project,
                                     pubsub_topic, pubsub_subscription,
                                     bq_dataset, bq_table,
-                                    window_size, runner, args=None):
+                                    window_size, runner, max_batch_size=100, args=None):
 
     prepare_steaming_source(project, pubsub_topic, pubsub_subscription)
     prepare_steaming_sink(project, bq_dataset, bq_table)
@@ -155,7 +123,9 @@ def run_pipeline_with_micro_batches(inference_type, project,
             pipeline
             | 'Read from PubSub' >> beam.io.ReadStringsFromPubSub(subscription=pubsub_subscription_url, id_label="source_id")
             | 'Micro-batch - Window Size: {} Seconds'.format(window_size) >> beam.WindowInto(FixedWindows(size=window_size))
-            | 'Estimate Targets - {}'.format(inference_type) >> beam.FlatMap(lambda messages: estimate(messages, inference_type))
+            | 'Parse Messages' >> beam.Map(json.loads)
+            | 'Estimate Targets - {}'.format(inference_type) >> EstimateTargets(inference_type, max_batch_size=max_batch_size)
+            | 'Add Predict Timestamp' >> beam.Map(add_predict_timestamp)
             | 'Write to BigQuery' >> beam.io.WriteToBigQuery(project=project,
                                                              dataset=bq_dataset,
                                                              table=bq_table
@@ -12,9 +12,10 @@ def run_experiment(args):
     if experiment.PARAMS.experiment_type == 'batch':
 
         batch_process.run_pipeline(inference_type=experiment.PARAMS.inference_type,
-                                   sample_size=experiment.PARAMS.batch_size,
+                                   sample_size=experiment.PARAMS.batch_sample_size,
                                    sink_location=experiment.PARAMS.sink_dir,
                                    runner=experiment.PARAMS.runner,
+                                   max_batch_size=experiment.PARAMS.max_batch_size,
                                    args=args)
 
     elif experiment.PARAMS.experiment_type == 'batch-predict':
@@ -34,6 +35,7 @@ def run_experiment(args):
                                     bq_dataset=experiment.PARAMS.bq_dataset,
                                     bq_table=experiment.PARAMS.bq_table,
                                     runner=experiment.PARAMS.runner,
+                                    max_batch_size=experiment.PARAMS.max_batch_size,
                                     args=args)
 
     elif experiment.PARAMS.experiment_type == 'stream-m-batches':
@@ -46,6 +48,7 @@ def run_experiment(args):
                                     bq_table=experiment.PARAMS.bq_table,
                                     window_size=experiment.PARAMS.window_size,
                                     runner=experiment.PARAMS.runner,
+                                    max_batch_size=experiment.PARAMS.max_batch_size,
                                     args=args)
 
 
@@ -0,0 +1,67 @@
+from sys import path
+from os.path import dirname as dir
+
+path.append(dir(path[0]))
+__package__ = "pipelines"
+
+import apache_beam as beam
+from apache_beam.testing.util import assert_that
+from model import inference
+from pipelines.batch_inference import EstimateTargets
+from datetime import datetime
+
+
+INFERENCE_TYPE = 'local'  # local' | 'cmle'
+NUM_INSTANCES = 1000
+MAX_BATCH_SIZE = 100
+
+instance = {
+    'is_male': 'True',
+    'mother_age': 26.0,
+    'mother_race': 'Asian Indian',
+    'plurality': 1.0,
+    'gestation_weeks': 39,
+    'mother_married': 'True',
+    'cigarette_use': 'False',
+    'alcohol_use': 'False'
+}
+
+instances = [dict(instance, source_id=i) for i in range(NUM_INSTANCES)]
+
+print("")
+print("Inference Type:{}".format(INFERENCE_TYPE))
+print("")
+
+# one call per instance, as the pipelines used to do
+if INFERENCE_TYPE == 'local':
+    expected_weight = inference.estimate_local([instance])[0]
+else:
+    expected_weight = inference.estimate_cmle([instance])[0]
+
+
+def check_estimates(outputs):
+    assert sorted(output['source_id'] for output in outputs) == list(range(NUM_INSTANCES))
+    for output in outputs:
+        assert abs(output['estimated_weight'] - expected_weight) < 1e-4, output
+
+
+time_start = datetime.utcnow()
+print("Batched inference started at {}".format(time_start.strftime("%H:%M:%S")))
+print(".......................................")
+
+pipeline = beam.Pipeline('DirectRunner')
+estimates = (
+        pipeline
+        | 'Create Instances' >> beam.Create(instances)
+        | 'Estimate Targets' >> EstimateTargets(INFERENCE_TYPE, max_batch_size=MAX_BATCH_SIZE)
+)
+assert_that(estimates, check_estimates)
+pipeline.run().wait_until_finish()
+
+time_end = datetime.utcnow()
+print(".......................................")
+print("Batched inference finished at {}".format(time_end.strftime("%H:%M:%S")))
+print("")
+time_elapsed = time_end - time_start
+print("Batched inference elapsed time: {} seconds for {} instances".format(time_elapsed.total_seconds(),
+                                                                         NUM_INSTANCES))
@@ -0,0 +1,74 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Throughput benchmark of the image labeling stage against a fake service.
+
+Uses FakeLabelClient so no credentials or Vision API quota are needed.  The
+per-image setting sends one request per image with nothing else in flight,
+which is how the stage used to call the API.
+
+    python dataflow_python_examples/benchmark_image_labels.py --images 512
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import functools
+import time
+
+from image_labels import BatchImageLabeler
+from image_labels import FakeLabelClient
+from image_labels import IMAGES_PER_REQUEST
+from image_labels import MAX_BATCH_SIZE
+from image_labels import MAX_IN_FLIGHT
+
+
+def images_per_sec(labeler, uris, batch_size):
+    labeler.setup()
+    start = time.time()
+    for i in range(0, len(uris), batch_size):
+        labeler.process(uris[i:i + batch_size])
+    secs = time.time() - start
+    labeler.teardown()
+    return len(uris) / secs
+
+
+def run(num_images, latency_secs, error_rate):
+    uris = ['gs://python-dataflow-example/images/dog%d.jpg' % i
+            for i in range(num_images)]
+    client_factory = functools.partial(
+        FakeLabelClient, latency_secs=latency_secs, error_rate=error_rate)
+
+    per_image = images_per_sec(
+        BatchImageLabeler(client_factory, max_in_flight=1,
+                          images_per_request=1), uris, 1)
+    batched = images_per_sec(
+        BatchImageLabeler(client_factory, max_in_flight=MAX_IN_FLIGHT,
+                          images_per_request=IMAGES_PER_REQUEST),
+        uris, MAX_BATCH_SIZE)
+    print('per image: %8.1f images/sec' % per_image)
+    print('batched:   %8.1f images/sec (%.1fx)' % (batched,
+                                                  batched / per_image))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=512,
+                        help='Number of image references to label.')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds per fake request round trip.')
+    parser.add_argument('--error-rate', dest='error_rate', type=float,
+                        default=0.0,
+                        help='Probability of a retryable fake error.')
+    args = parser.parse_args()
+    run(args.images, args.latency, args.error_rate)
@@ -0,0 +1,142 @@
+# Copyright 2018 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Local benchmark of the row parsers used by the ingestion pipelines.
+
+Compares rows/sec of the original per-line parsing, which parses the JSON
+schema and builds a CSV reader for every line and dispatches on the type
+string for every field, against the schema-compiled batch parsers.
+
+    python dataflow_python_examples/benchmark_parsers.py --rows 100000
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import csv
+import random
+import time
+from collections import OrderedDict
+
+from apache_beam.io.gcp.bigquery import parse_table_schema_from_json
+
+from data_ingestion_configurable import PrepareFieldTypes
+from data_transformation import DataTransformation
+
+STATES = ['KS', 'NY', 'CA', 'TX', 'WA']
+NAMES = ['Dorothy', 'Mary', 'John', 'Robert', 'Linda']
+FIELDS = OrderedDict([('id', 'INTEGER'), ('name', 'STRING'),
+                      ('price', 'FLOAT'), ('created', 'TIMESTAMP'),
+                      ('updated', 'TIMESTAMP')])
+
+
+def usa_names_lines(num_rows, rng):
+    return ['%s,%s,%d,%s,%d,11/28/2016' % (rng.choice(STATES),
+                                           rng.choice('FM'),
+                                           rng.randint(1910, 2016),
+                                           rng.choice(NAMES),
+                                           rng.randint(5, 5000))
+            for _ in range(num_rows)]
+
+
+def configurable_rows(num_rows, rng):
+    return [OrderedDict([('id', str(i)),
+                         ('name', rng.choice(NAMES)),
+                         ('price', '%.2f' % (rng.random() * 100)),
+                         ('created', '2018-0%d-1%d 10:00:00' % (
+                             rng.randint(1, 9), rng.randint(0, 9))),
+                         ('updated', '2018-06-0%d' % rng.randint(1, 9))])
+            for i in range(num_rows)]
+
+
+def original_parse_method(schema_str, string_input):
+    """The per-line parser before the schema was compiled once."""
+    schema = parse_table_schema_from_json(schema_str)
+    field_map = [f for f in schema.fields]
+    for values in csv.reader(string_input.split('\n')):
+        row = {}
+        for i, value in enumerate(values):
+            if field_map[i].type == 'DATE':
+                value = u'-'.join((values[2], u'01', u'01'))
+            row[field_map[i].name] = value
+        return row
+
+
+def original_prepare_field_types(element, fields, time_formats):
+    """The per-field type dispatch before converters were compiled once."""
+    for k, v in element.items():
+        ftype = fields[k]
+        if not v:
+            v = 0
+        elif ftype == 'INTEGER':
+            v = int(v)
+        elif ftype == 'FLOAT':
+            v = float(v)
+        elif ftype == 'TIMESTAMP':
+            for fmt in time_formats:
+                try:
+                    v = int(time.mktime(time.strptime(v, fmt)))
+                except ValueError:
+                    pass
+                else:
+                    break
+        element[k] = v
+    return [element]
+
+
+def rows_per_sec(fn, num_rows):
+    start = time.time()
+    fn()
+    return num_rows / (time.time() - start)
+
+
+def run(num_rows, batch_size):
+    rng = random.Random(0)
+    transformation = DataTransformation()
+    lines = usa_names_lines(num_rows, rng)
+    batches = [lines[i:i + batch_size]
+               for i in range(0, len(lines), batch_size)]
+
+    before = rows_per_sec(
+        lambda: [original_parse_method(transformation.schema_str, line)
+                 for line in lines], num_rows)
+    transformation.compile_schema()
+    after = rows_per_sec(
+        lambda: [row for batch in batches
+                 for row in transformation.parse_lines(batch)], num_rows)
+    print('data_transformation:  %10.0f -> %10.0f rows/sec (%.1fx)' %
+          (before, after, after / before))
+
+    prepare = PrepareFieldTypes(FIELDS)
+    prepare.setup()
+    time_formats = ['%Y-%m-%d %H:%M:%S %Z', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+    elements = configurable_rows(num_rows, rng)
+    before = rows_per_sec(
+        lambda: [original_prepare_field_types(OrderedDict(e), FIELDS,
+                                              time_formats)
+                 for e in elements], num_rows)
+    after = rows_per_sec(
+        lambda: [prepare.process(OrderedDict(e)) for e in elements], num_rows)
+    print('prepare_field_types:  %10.0f -> %10.0f rows/sec (%.1fx)' %
+          (before, after, after / before))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='Number of synthetic rows to parse.')
+    parser.add_argument('--batch-size', dest='batch_size', type=int,
+                        default=1000,
+                        help='Number of lines per batch for the bulk parser.')
+    args = parser.parse_args()
+    run(args.rows, args.batch_size)
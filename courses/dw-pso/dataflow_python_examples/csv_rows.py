@@ -0,0 +1,48 @@
+# Copyright 2017 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" csv_rows.py converts batches of CSV lines into BigQuery rows, for the
+data_transformation and data_enrichment pipelines.
+
+The pipelines import this module, so it has to be installed on the Dataflow
+workers along with them, e.g. with --extra_package.
+"""
+
+from __future__ import absolute_import
+import csv
+import sys
+
+
+def parse_csv_lines(lines, converters):
+    """Translates many lines of comma separated values at once.
+
+    Each line is parsed with its own CSV reader, so that a line with an
+    unbalanced quote cannot swallow the lines after it.
+
+    Args:
+        lines: A list of CSV lines.
+        converters: A sequence of (column name, converter) pairs, one per
+            CSV column, where each converter is called with the column value
+            and the whole CSV row.
+
+    Yields:
+        One dict per line, mapping BigQuery column names to values.
+    """
+    for line in lines:
+        # Use a CSV Reader which can handle quoted strings etc.
+        for csv_row in csv.reader([line]):
+            if (sys.version_info.major < 3.0):
+                csv_row = [x.decode('utf8') for x in csv_row]
+            yield dict((name, convert(value, csv_row))
+                       for (name, convert), value in zip(converters, csv_row))
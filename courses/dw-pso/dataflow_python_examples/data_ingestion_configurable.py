@@ -71,13 +71,45 @@ class FileCoder(object):
         return dict((self._columns[i], v) for i, v in enumerate(split_value))
 
 
+class _TimeParser(object):
+    """Parses time strings trying several formats, remembering the last match.
+
+    Columns are almost always written in one format, so after the first
+    successful parse that format is tried first and the others are fallbacks.
+    """
+    def __init__(self, tm, formats, to_value):
+        self._tm = tm
+        self._formats = list(formats)
+        self._to_value = to_value
+
+    def __call__(self, v):
+        for i, fmt in enumerate(self._formats):
+            try:
+                parsed = self._tm.strptime(v, fmt)
+            except ValueError:
+                continue
+            if i:
+                self._formats.insert(0, self._formats.pop(i))
+            return self._to_value(self._tm.mktime(parsed))
+        raise ValueError('Cannot convert date %s' % v)
+
+
 class PrepareFieldTypes(beam.DoFn):
-    def __init__(self, encoding='utf-8', time_format='%Y-%m-%d %H:%M:%S %Z'):
-        import importlib
+    def __init__(self, fields, encoding='utf-8',
+                 time_format='%Y-%m-%d %H:%M:%S %Z'):
+        self._fields = fields
         self._encoding = encoding
         # Additional time format to use in case the default one does not work
         self._time_format = [time_format, '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+        self._converters = None
+
+    def setup(self):
+        import importlib
         self._tm = importlib.import_module('time')
+        self._converters = tuple(
+            (k, ftype, self._compile_converter(ftype),
+             self._return_default_value(ftype))
+            for k, ftype in self._fields.items())
 
     def _return_default_value(self, ftype):
         if ftype == 'INTEGER':
@@ -91,55 +123,47 @@ class PrepareFieldTypes(beam.DoFn):
         else:
             return ''
 
-    def process(self, element, fields):
+    def _decode_string(self, v):
+        if isinstance(v, str):
+            v = v.decode(self._encoding, errors='ignore')
+        return v
+
+    def _compile_converter(self, ftype):
+        """Returns the callable converting one value of a field type."""
+        if ftype == 'STRING':
+            return self._decode_string
+        elif ftype == 'INTEGER':
+            return int
+        elif ftype == 'FLOAT':
+            return float
+        elif ftype == 'DATETIME':
+            return _TimeParser(self._tm, self._time_format, float)
+        elif ftype == 'TIMESTAMP':
+            return _TimeParser(self._tm, self._time_format, int)
+        logging.warn('Unknown field type %s' % ftype)
+        return None
+
+    def process(self, element):
+        if self._converters is None:
+            self.setup()
         if not hasattr(element, '__len__'):
             logging.warn('Element %s has no length' % element)
             return []
-        if len(element) != len(fields):
+        if len(element) != len(self._converters):
             logging.warn('Row has %s elements instead of %s' %
-                         (len(element), len(fields)))
+                         (len(element), len(self._converters)))
             return []
-        for k, v in element.items():
-            ftype = fields[k]
-            try:
-                if not v:
-                    v = self._return_default_value(ftype)
-                elif ftype == 'STRING':
-                    if isinstance(v, str):
-                        v = v.decode(self._encoding, errors='ignore')
-                elif ftype == 'INTEGER':
-                    v = int(v)
-                elif ftype == 'FLOAT':
-                    v = float(v)
-                elif ftype == 'DATETIME':
-                    try:
-                        v = self._tm.mktime(
-                            self._tm.strptime(v, self._time_format))
-                    except (ValueError, TypeError), e:
-                        logging.warn('Cannot convert type %s for element %s: '
-                                     '%s. Returning default value.' %
-                                     (ftype, v, e))
-                        v = self._return_default_value(ftype)
-
-                elif ftype == 'TIMESTAMP':
-                    for fmt in (self._time_format):
-                        try:
-                            v = int(self._tm.mktime(self._tm.strptime(v, fmt)))
-                        except ValueError, e:
-                            pass
-                        else:
-                            break
-                    if not isinstance(v, int):
-                        logging.warn('Cannot convert date %s. Error: %s' %
-                                     (v, e))
-                        v = self._return_default_value(ftype)
-                else:
-                    logging.warn('Unknown field type %s' % ftype)
-                    v = self._return_default_value(ftype)
-            except (TypeError, ValueError), e:
-                logging.warn('Cannot convert type %s for element %s: '
-                             '%s. Returning default value.' % (ftype, v, e))
-                v = self._return_default_value(ftype)
+        for k, ftype, convert, default in self._converters:
+            v = element[k]
+            if not v or convert is None:
+                v = default
+            else:
+                try:
+                    v = convert(v)
+                except (TypeError, ValueError), e:
+                    logging.warn('Cannot convert type %s for element %s: '
+                                 '%s. Returning default value.' % (ftype, v, e))
+                    v = default
             element[k] = v
         return [element]
 
@@ -233,7 +257,7 @@ def run(argv=None):
          | 'Read From Text - ' + input_file >> beam.io.ReadFromText(
              gs_path, coder=FileCoder(fields.keys()), skip_header_lines=1)
          | 'Prepare Field Types - ' + input_file >> beam.ParDo(
-             PrepareFieldTypes(), fields)
+             PrepareFieldTypes(fields))
          | 'Inject Timestamp - ' + input_file >> beam.ParDo(InjectTimestamp())
          | 'Write to BigQuery - ' + input_file >> beam.io.Write(
              beam.io.BigQuerySink(
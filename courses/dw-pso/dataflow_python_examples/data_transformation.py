@@ -21,7 +21,6 @@ and transforms the date data to match the format BigQuery expects.
 
 from __future__ import absolute_import
 import argparse
-import csv
 import logging
 import os
 
@@ -29,6 +28,8 @@ import apache_beam as beam
 from apache_beam.options.pipeline_options import PipelineOptions
 from apache_beam.io.gcp.bigquery import parse_table_schema_from_json
 
+from csv_rows import parse_csv_lines
+
 
 class DataTransformation:
     """A helper class which contains the logic to translate the file into a
@@ -45,6 +46,23 @@ class DataTransformation:
             data = f.read()
             # Wrapping the schema in fields is required for the BigQuery API.
             self.schema_str = '{"fields": ' + data + '}'
+        self._converters = None
+
+    def compile_schema(self):
+        """Compiles the output schema into one converter per CSV column.
+
+        Parsing the JSON schema costs far more than converting a row, so this
+        is done once per worker instead of once per line.
+
+        Returns:
+            A tuple of (column name, converter) pairs, where each converter is
+            called with the column value and the whole CSV row.
+        """
+        schema = parse_table_schema_from_json(self.schema_str)
+        self._converters = tuple(
+            (field.name, _year_as_date if field.type == 'DATE' else _as_is)
+            for field in schema.fields)
+        return self._converters
 
     def parse_method(self, string_input):
         """This method translates a single line of comma separated values to a
@@ -69,41 +87,45 @@ class DataTransformation:
                        'created_date': '11/28/2016'
                        }
         """
-        # Strip out return characters and quote characters.
-        schema = parse_table_schema_from_json(self.schema_str)
+        for row in self.parse_lines(string_input.split('\n')):
+            return row
 
-        field_map = [f for f in schema.fields]
-
-        # Use a CSV Reader which can handle quoted strings etc.
-        reader = csv.reader(string_input.split('\n'))
-        for csv_row in reader:
-            if (sys.version_info.major < 3.0):
-                values = [x.decode('utf8') for x in csv_row]
-            else:
-                values = csv_row
-            # Our source data only contains year, so default January 1st as the
-            # month and day.
-            month = u'01'
-            day = u'01'
-            # The year comes from our source data.
-            year = values[2]
-
-            row = {}
-            i = 0
-            # Iterate over the values from our csv file, applying any transformation logic.
-            for value in values:
-                # If the schema indicates this field is a date format, we must
-                # transform the date from the source data into a format that
-                # BigQuery can understand.
-                if field_map[i].type == 'DATE':
-                    # Format the date to YYYY-MM-DD format which BigQuery
-                    # accepts.
-                    value = u'-'.join((year, month, day))
-
-                row[field_map[i].name] = value
-                i += 1
+    def parse_lines(self, lines):
+        """Translates many lines of comma separated values at once.
 
-            return row
+        Args:
+            lines: A list of CSV lines, as described in parse_method.
+
+        Returns:
+            An iterator of one dict per line, mapping BigQuery column names
+            to values.
+        """
+        return parse_csv_lines(lines, self._converters or self.compile_schema())
+
+
+def _as_is(value, values):
+    return value
+
+
+def _year_as_date(value, values):
+    # Our source data only contains year, so default January 1st as the
+    # month and day, in the YYYY-MM-DD format which BigQuery accepts.
+    return u'-'.join((values[2], u'01', u'01'))
+
+
+class StringToBigQueryRows(beam.DoFn):
+    """Parses batches of CSV lines with a schema compiled once per worker."""
+
+    def __init__(self, helper):
+        super(StringToBigQueryRows, self).__init__()
+        self._helper = helper
+
+    def setup(self):
+        self._helper.compile_schema()
+
+    def process(self, lines):
+        for row in self._helper.parse_lines(lines):
+            yield row
 
 
 def run(argv=None):
@@ -148,8 +170,12 @@ def run(argv=None):
      # It refers to a function we have written.  This function will
      # be run in parallel on different workers using input from the
      # previous stage of the pipeline.
-     | 'String to BigQuery Row' >> beam.Map(lambda s:
-                                            data_ingestion.parse_method(s))
+     # Group lines into batches so that each batch is parsed by a single
+     # CSV reader with the schema compiled once per worker.
+     | 'Batch Lines' >> beam.BatchElements(min_batch_size=100,
+                                           max_batch_size=1000)
+     | 'String to BigQuery Row' >> beam.ParDo(
+        StringToBigQueryRows(data_ingestion))
      | 'Write to BigQuery' >> beam.io.Write(
         beam.io.BigQuerySink(
             # The table name is a required argument for the BigQuery sink.
@@ -23,9 +23,13 @@ identified by the Cloud Vision API.
 from __future__ import absolute_import
 import argparse
 import logging
+import random
+import time
+from multiprocessing.pool import ThreadPool
 
 import apache_beam as beam
 from apache_beam.options.pipeline_options import PipelineOptions
+from google.api_core import exceptions
 from google.cloud import vision
 from google.cloud.vision import types
 
@@ -33,6 +37,11 @@ from google.cloud.vision import types
 INPUT_FILE = 'gs://python-dataflow-example/data_files/image-list.txt'
 BQ_DATASET = 'ImageLabelFlow'
 BQ_TABLE = BQ_DATASET + '.dogs_short'
+# The Vision API accepts at most 16 images in one synchronous batch request.
+IMAGES_PER_REQUEST = 16
+MAX_BATCH_SIZE = 256
+MAX_IN_FLIGHT = 4
+MAX_RETRIES = 5
 
 
 def detect_labels_uri(uri):
@@ -59,24 +68,125 @@ def detect_labels_uri(uri):
     return ', '.join(label_list)
 
 
-class ImageLabeler(beam.DoFn):
+class VisionLabelClient(object):
+    """Labels batches of images with the Cloud Vision API.
+
+    This is the client interface used by BatchImageLabeler.  Any object with
+    a label_images(uris) method returning one list of labels per uri, and a
+    retryable_errors tuple of exception types, can stand in for it, for
+    example FakeLabelClient in tests and benchmarks.
+    """
+    retryable_errors = (exceptions.ServiceUnavailable,
+                        exceptions.DeadlineExceeded,
+                        exceptions.ResourceExhausted,
+                        exceptions.InternalServerError)
+
+    def __init__(self):
+        self._client = vision.ImageAnnotatorClient()
+        self._features = [
+            types.Feature(type=vision.enums.Feature.Type.LABEL_DETECTION)]
+
+    def label_images(self, uris):
+        requests = [
+            types.AnnotateImageRequest(
+                image=types.Image(source=types.ImageSource(image_uri=uri)),
+                features=self._features)
+            for uri in uris]
+        response = self._client.batch_annotate_images(requests)
+        labels = []
+        for uri, image_response in zip(uris, response.responses):
+            # Like detect_labels_uri, an invalid image gets no labels.
+            if image_response.error.message:
+                logging.warning('Cannot label %s: %s', uri,
+                                image_response.error.message)
+            labels.append(
+                [l.description for l in image_response.label_annotations])
+        return labels
+
+
+class FakeLabelClient(object):
+    """Local stand in for VisionLabelClient that needs no credentials.
+
+    Each call sleeps for latency_secs to mimic one round trip, and fails with
+    a retryable error with probability error_rate.
+    """
+    retryable_errors = (IOError,)
+
+    def __init__(self, latency_secs=0.1, error_rate=0.0):
+        self._latency_secs = latency_secs
+        self._error_rate = error_rate
+
+    def label_images(self, uris):
+        time.sleep(self._latency_secs)
+        if random.random() < self._error_rate:
+            raise IOError('Fake transient error')
+        return [['label for ' + uri.rsplit('/', 1)[-1]] for uri in uris]
+
+
+class BatchImageLabeler(beam.DoFn):
     """
-    This DoFn wraps the inner function detect_labels_uri to write a BigQuery row dictionary
-    with the image file reference specified by the element from the prior PCollection and a list
-    of labels for that image assigned by the Google Cloud Vision API.
+    This DoFn labels batches of image references, as produced by
+    beam.BatchElements, and emits one BigQuery row dictionary per image with
+    the image file reference and a comma separated list of its labels.
+
+    The client is created once per worker in setup().  Each batch is split
+    into batch-annotate requests of at most IMAGES_PER_REQUEST images, and at
+    most max_in_flight of those requests are outstanding at once.  Requests
+    failing with a retryable error are retried with exponential backoff.
     """
 
+    def __init__(self, client_factory=VisionLabelClient,
+                 max_in_flight=MAX_IN_FLIGHT, max_retries=MAX_RETRIES,
+                 images_per_request=IMAGES_PER_REQUEST):
+        super(BatchImageLabeler, self).__init__()
+        self._client_factory = client_factory
+        self._max_in_flight = max_in_flight
+        self._max_retries = max_retries
+        self._images_per_request = images_per_request
+        self._client = None
+        self._pool = None
+
+    def setup(self):
+        self._client = self._client_factory()
+        self._pool = ThreadPool(self._max_in_flight)
+
+    def teardown(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def _label_with_retry(self, uris):
+        for attempt in range(self._max_retries + 1):
+            try:
+                return self._client.label_images(uris)
+            except self._client.retryable_errors as e:
+                if attempt == self._max_retries:
+                    raise
+                delay = min(2 ** attempt * 0.1, 10.0) * (0.5 + random.random())
+                logging.warning('Labeling %d images failed (%s), retrying in '
+                                '%.2fs', len(uris), e, delay)
+                time.sleep(delay)
+
     def process(self, element, *args, **kwargs):
         """
         Args:
-            element: A string specifying the uri of an image
+            element: A list of strings specifying the uris of images
 
         Returns:
-            row: A list containing a dictionary defining a record to be written to BigQuery
+            rows: A list of dictionaries defining records to be written to BigQuery
         """
-        labels_string = detect_labels_uri(element)
-
-        return [{'image_location': element, 'labels': labels_string}]
+        if self._pool is None:
+            self.setup()
+        uris = list(element)
+        requests = [uris[i:i + self._images_per_request]
+                    for i in range(0, len(uris), self._images_per_request)]
+        rows = []
+        for request_uris, labels in zip(
+                requests, self._pool.imap(self._label_with_retry, requests)):
+            for uri, image_labels in zip(request_uris, labels):
+                rows.append({'image_location': uri,
+                             'labels': ', '.join(image_labels)})
+        return rows
 
 
 def run(argv=None):
@@ -125,7 +235,11 @@ def run(argv=None):
      # and the labels from the vision api.  This function will
      # be run in parallel on different workers using input from the
      # previous stage of the pipeline.
-     | 'Vision API label_annotation wrapper' >> beam.ParDo(ImageLabeler())
+     # Group image references so that each worker sends few, large
+     # batch-annotate requests instead of one request per image.
+     | 'Batch image references' >> beam.BatchElements(
+         min_batch_size=IMAGES_PER_REQUEST, max_batch_size=MAX_BATCH_SIZE)
+     | 'Vision API label_annotation wrapper' >> beam.ParDo(BatchImageLabeler())
      # This stage writes the data to the BigQuery table.
      | 'Write to BigQuery' >> beam.io.gcp.bigquery.WriteToBigQuery(
          # The table name is a required argument for the WriteToBigQuery io transform.
@@ -57,11 +57,11 @@ def anomaly_detection(features, labels, mode, params):
   (abs_err_count_time_var,
    abs_err_mean_time_var,
    abs_err_cov_time_var,
-   abs_err_inv_cov_time_var,
+   abs_err_chol_cov_time_var,
    abs_err_count_feat_var,
    abs_err_mean_feat_var,
    abs_err_cov_feat_var,
-   abs_err_inv_cov_feat_var) = create_both_mahalanobis_dist_vars(
+   abs_err_chol_cov_feat_var) = create_both_mahalanobis_dist_vars(
        seq_len=params["seq_len"], num_feat=params["num_feat"])
 
   # Variables for automatically tuning anomaly thresh
@@ -163,12 +163,12 @@ def anomaly_detection(features, labels, mode, params):
           abs_err_count_time_var,
           abs_err_mean_time_var,
           abs_err_cov_time_var,
-          abs_err_inv_cov_time_var,
+          abs_err_chol_cov_time_var,
           X_feat_abs_recon_err,
           abs_err_count_feat_var,
           abs_err_mean_feat_var,
           abs_err_cov_feat_var,
-          abs_err_inv_cov_feat_var,
+          abs_err_chol_cov_feat_var,
           params,
           dummy_var)
     elif (mode == tf.estimator.ModeKeys.EVAL and
@@ -186,7 +186,7 @@ def anomaly_detection(features, labels, mode, params):
         mahalanobis_dist_time = mahalanobis_dist(
             err_vec=X_time_abs_recon_err,
             mean_vec=abs_err_mean_time_var,
-            inv_cov=abs_err_inv_cov_time_var,
+            chol_cov=abs_err_chol_cov_time_var,
             final_shape=params["seq_len"])
 
         # Features based
@@ -194,7 +194,7 @@ def anomaly_detection(features, labels, mode, params):
         mahalanobis_dist_feat = mahalanobis_dist(
             err_vec=X_feat_abs_recon_err,
             mean_vec=abs_err_mean_feat_var,
-            inv_cov=abs_err_inv_cov_feat_var,
+            chol_cov=abs_err_chol_cov_feat_var,
             final_shape=params["num_feat"])
 
       if mode != tf.estimator.ModeKeys.PREDICT:
@@ -0,0 +1,164 @@
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .calculate_error_distribution_statistics import mahalanobis_dist
+
+
+def mahalanobis_dist_full_matrix(err_vec, mean_vec, inv_cov, final_shape):
+  """Calculates mahalanobis distance from MLE using the full product matrix.
+
+  This is the original quadratic implementation, kept here as the baseline
+  that the row-wise Cholesky kernel is benchmarked against.
+
+  Args:
+    err_vec: tf.float64 matrix tensor of reconstruction errors.
+    mean_vec: tf.float64 vector tensor of column means of reconstruction errors.
+    inv_cov: tf.float64 matrix tensor of inverse covariance matrix of
+      reconstruction errors.
+    final_shape: Final shape of mahalanobis distance tensor.
+
+  Returns:
+    tf.float64 matrix tensor of mahalanobis distance.
+  """
+  err_vec_cen = err_vec - mean_vec
+
+  mahalanobis_right_product = tf.matmul(
+      a=inv_cov, b=err_vec_cen, transpose_b=True)
+
+  mahalanobis_dist_vectorized = tf.matmul(
+      a=err_vec_cen, b=mahalanobis_right_product)
+
+  mahalanobis_dist_flat = tf.diag_part(input=mahalanobis_dist_vectorized)
+
+  mahalanobis_dist_final_shaped = tf.reshape(
+      tensor=mahalanobis_dist_flat, shape=[-1, final_shape])
+
+  return tf.sqrt(x=mahalanobis_dist_final_shaped)
+
+
+def peak_tensor_bytes(run_metadata):
+  """Finds the largest single tensor allocation recorded in a traced run.
+
+  Args:
+    run_metadata: tf.RunMetadata filled by a FULL_TRACE session run.
+
+  Returns:
+    Integer number of bytes of the largest requested output allocation.
+  """
+  peak = 0
+  for dev_stats in run_metadata.step_stats.dev_stats:
+    for node_stats in dev_stats.node_stats:
+      for output in node_stats.output:
+        alloc = output.tensor_description.allocation_description
+        peak = max(peak, alloc.requested_bytes)
+
+  return peak
+
+
+def benchmark_batch_size(batch_size, seq_len, num_feat, num_iters, eps):
+  """Times old and new mahalanobis kernels for one batch size.
+
+  Args:
+    batch_size: Number of sequences in the batch.
+    seq_len: Number of timesteps in sequence.
+    num_feat: Number of features.
+    num_iters: Number of timed session runs per kernel.
+    eps: Added to the covariance diagonal before inversion/factorization.
+
+  Returns:
+    Dictionary of timings, peak tensor bytes, and max absolute difference.
+  """
+  rng = np.random.RandomState(seed=0)
+  err = np.abs(rng.randn(batch_size * seq_len, num_feat))
+  mean = err.mean(axis=0)
+  cov = np.cov(err, rowvar=False) + np.eye(num_feat) * eps
+
+  with tf.Graph().as_default():
+    err_vec = tf.constant(value=err, dtype=tf.float64)
+    mean_vec = tf.constant(value=mean, dtype=tf.float64)
+    cov_mat = tf.constant(value=cov, dtype=tf.float64)
+
+    old_dist = mahalanobis_dist_full_matrix(
+        err_vec=err_vec,
+        mean_vec=mean_vec,
+        inv_cov=tf.matrix_inverse(input=cov_mat),
+        final_shape=seq_len)
+
+    new_dist = mahalanobis_dist(
+        err_vec=err_vec,
+        mean_vec=mean_vec,
+        chol_cov=tf.cholesky(input=cov_mat),
+        final_shape=seq_len)
+
+    results = {"batch_size": batch_size}
+    with tf.Session() as sess:
+      for name, dist in (("old", old_dist), ("new", new_dist)):
+        # Warm up and record memory with a traced run
+        run_metadata = tf.RunMetadata()
+        value = sess.run(
+            fetches=dist,
+            options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+            run_metadata=run_metadata)
+        results["{}_peak_bytes".format(name)] = peak_tensor_bytes(run_metadata)
+        results["{}_value".format(name)] = value
+
+        start = time.time()
+        for _ in range(num_iters):
+          sess.run(fetches=dist)
+        results["{}_secs".format(name)] = (time.time() - start) / num_iters
+
+  results["max_abs_diff"] = np.max(
+      np.abs(results.pop("old_value") - results.pop("new_value")))
+
+  return results
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      "--batch_sizes",
+      help="Comma separated batch sizes to benchmark.",
+      type=str,
+      default="16,64,256,1024"
+  )
+  parser.add_argument(
+      "--seq_len",
+      help="Number of timesteps in sequence.",
+      type=int,
+      default=30
+  )
+  parser.add_argument(
+      "--num_feat",
+      help="Number of features.",
+      type=int,
+      default=5
+  )
+  parser.add_argument(
+      "--num_iters",
+      help="Number of timed runs per kernel and batch size.",
+      type=int,
+      default=10
+  )
+  parser.add_argument(
+      "--eps",
+      help="Added to the cov matrix before inversion/factorization.",
+      type=float,
+      default=1e-12
+  )
+  args = parser.parse_args()
+
+  print("{:>10} {:>12} {:>12} {:>14} {:>14} {:>12}".format(
+      "batch", "old_ms", "new_ms", "old_peak_MB", "new_peak_MB", "max_diff"))
+  for batch_size in [int(x) for x in args.batch_sizes.split(",")]:
+    res = benchmark_batch_size(
+        batch_size, args.seq_len, args.num_feat, args.num_iters, args.eps)
+    print("{:>10} {:>12.3f} {:>12.3f} {:>14.3f} {:>14.3f} {:>12.3g}".format(
+        res["batch_size"],
+        res["old_secs"] * 1000.0,
+        res["new_secs"] * 1000.0,
+        res["old_peak_bytes"] / 2.0 ** 20,
+        res["new_peak_bytes"] / 2.0 ** 20,
+        res["max_abs_diff"]))
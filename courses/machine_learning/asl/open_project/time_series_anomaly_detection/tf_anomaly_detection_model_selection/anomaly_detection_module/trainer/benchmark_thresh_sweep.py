@@ -0,0 +1,127 @@
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .tune_anomaly_thresholds_supervised import update_anom_thresh_vars
+from .tune_anomaly_thresholds_supervised import update_anom_thresh_vars_sorted
+from .tune_anomaly_threshold_vars import create_confusion_matrix_thresh_vars
+
+
+def benchmark_num_thresh(
+    num_thresh, batch_size, seq_len, num_batches, anom_frac):
+  """Times grid and sorted supervised threshold sweeps for one grid size.
+
+  Args:
+    num_thresh: Number of anomaly thresholds in the grid.
+    batch_size: Number of sequences per batch.
+    seq_len: Number of timesteps in sequence.
+    num_batches: Number of timed batches per sweep method.
+    anom_frac: Fraction of sequences labeled anomalous.
+
+  Returns:
+    Dictionary of per batch timings and whether the counts matched.
+  """
+  rng = np.random.RandomState(seed=0)
+  dist = np.abs(rng.randn(batch_size, seq_len)) * 1000.0
+  labels = (rng.rand(batch_size) < anom_frac).astype(np.float64)
+
+  with tf.Graph().as_default():
+    mahalanobis_dist = tf.constant(value=dist, dtype=tf.float64)
+    labels_norm_mask = tf.equal(x=tf.constant(value=labels), y=0)
+    labels_anom_mask = tf.equal(x=tf.constant(value=labels), y=1)
+    anom_threshs = tf.linspace(
+        start=tf.constant(value=0.0, dtype=tf.float64),
+        stop=tf.constant(value=4000.0, dtype=tf.float64),
+        num=num_thresh)
+
+    grid_vars = create_confusion_matrix_thresh_vars(
+        scope="grid", var_name="time", size=[num_thresh])
+    sorted_vars = create_confusion_matrix_thresh_vars(
+        scope="sorted", var_name="time", size=[num_thresh])
+
+    grid_update = update_anom_thresh_vars(
+        labels_norm_mask,
+        labels_anom_mask,
+        num_thresh,
+        anom_threshs,
+        mahalanobis_dist,
+        *grid_vars,
+        mode=tf.estimator.ModeKeys.TRAIN)
+
+    sorted_update = update_anom_thresh_vars_sorted(
+        labels_norm_mask,
+        labels_anom_mask,
+        anom_threshs,
+        mahalanobis_dist,
+        *sorted_vars)
+
+    results = {"num_thresh": num_thresh}
+    with tf.Session() as sess:
+      sess.run(fetches=tf.global_variables_initializer())
+      for name, update in (("grid", grid_update), ("sorted", sorted_update)):
+        sess.run(fetches=update)  # warm up
+        start = time.time()
+        for _ in range(num_batches):
+          counts = sess.run(fetches=update)
+        results["{}_secs".format(name)] = (time.time() - start) / num_batches
+        results["{}_counts".format(name)] = counts
+
+  results["match"] = all(
+      np.array_equal(grid, srt)
+      for grid, srt in zip(results.pop("grid_counts"),
+                           results.pop("sorted_counts")))
+
+  return results
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      "--num_threshs",
+      help="Comma separated numbers of anomaly thresholds to benchmark.",
+      type=str,
+      default="10,100,1000,10000"
+  )
+  parser.add_argument(
+      "--batch_size",
+      help="Number of sequences per batch.",
+      type=int,
+      default=256
+  )
+  parser.add_argument(
+      "--seq_len",
+      help="Number of timesteps in sequence.",
+      type=int,
+      default=30
+  )
+  parser.add_argument(
+      "--num_batches",
+      help="Number of timed batches per sweep method.",
+      type=int,
+      default=10
+  )
+  parser.add_argument(
+      "--anom_frac",
+      help="Fraction of sequences labeled anomalous.",
+      type=float,
+      default=0.1
+  )
+  args = parser.parse_args()
+
+  print("{:>10} {:>12} {:>12} {:>10} {:>8}".format(
+      "num_thresh", "grid_ms", "sorted_ms", "speedup", "match"))
+  for num_thresh in [int(x) for x in args.num_threshs.split(",")]:
+    res = benchmark_num_thresh(
+        num_thresh,
+        args.batch_size,
+        args.seq_len,
+        args.num_batches,
+        args.anom_frac)
+    print("{:>10} {:>12.3f} {:>12.3f} {:>10.1f} {:>8}".format(
+        res["num_thresh"],
+        res["grid_secs"] * 1000.0,
+        res["sorted_secs"] * 1000.0,
+        res["grid_secs"] / res["sorted_secs"],
+        res["match"]))
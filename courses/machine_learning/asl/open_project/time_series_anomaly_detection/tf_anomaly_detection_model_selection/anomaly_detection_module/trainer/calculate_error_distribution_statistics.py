@@ -422,19 +422,23 @@ def non_singleton_batch_var_variable_updating(
                 tf.identity(input=count_variable))
 
 
-def mahalanobis_dist(err_vec, mean_vec, inv_cov, final_shape):
+def mahalanobis_dist(err_vec, mean_vec, chol_cov, final_shape):
   """Calculates mahalanobis distance from MLE.
 
-  Given reconstruction error vector, mean reconstruction error vector, inverse
-  covariance of reconstruction error, and mahalanobis distance tensor's final
-  shape, return mahalanobis distance.
+  Given reconstruction error vector, mean reconstruction error vector, lower
+  triangular Cholesky factor of the covariance of reconstruction error, and
+  mahalanobis distance tensor's final shape, return mahalanobis distance.
+
+  Only the row-wise quadratic forms are computed, so memory and FLOPs grow
+  linearly with the number of rows instead of building the full
+  (rows x rows) product and keeping only its diagonal.
 
   Args:
     err_vec: tf.float64 matrix tensor of reconstruction errors.
     mean_vec: tf.float64 vector variable tracking running column means of
       reconstruction errors.
-    inv_cov: tf.float64 matrix variable tracking running covariance matrix of
-      reconstruction errors.
+    chol_cov: tf.float64 matrix variable tracking lower triangular Cholesky
+      factor of running covariance matrix of reconstruction errors.
     final_shape: Final shape of mahalanobis distance tensor.
 
   Returns:
@@ -444,19 +448,17 @@ def mahalanobis_dist(err_vec, mean_vec, inv_cov, final_shape):
   # features_shape = (cur_batch_size * num_feat, seq_len)
   err_vec_cen = err_vec - mean_vec
 
+  # Solve L * Z = (X - mu)^T, so that (X - mu) * inv(cov) * (X - mu)^T has
+  # diagonal equal to the column sums of Z squared
   # time_shape = (num_feat, cur_batch_size * seq_len)
   # features_shape = (seq_len, cur_batch_size * num_feat)
-  mahalanobis_right_product = tf.matmul(
-      a=inv_cov, b=err_vec_cen, transpose_b=True)
-
-  # time_shape = (cur_batch_size * seq_len, cur_batch_size * seq_len)
-  # features_shape = (cur_batch_size * num_feat, cur_batch_size * num_feat)
-  mahalanobis_dist_vectorized = tf.matmul(
-      a=err_vec_cen, b=mahalanobis_right_product)
+  mahalanobis_whitened = tf.matrix_triangular_solve(
+      matrix=chol_cov, rhs=tf.transpose(a=err_vec_cen), lower=True)
 
   # time_shape = (cur_batch_size * seq_len,)
   # features_shape = (cur_batch_size * num_feat,)
-  mahalanobis_dist_flat = tf.diag_part(input=mahalanobis_dist_vectorized)
+  mahalanobis_dist_flat = tf.reduce_sum(
+      input_tensor=tf.square(x=mahalanobis_whitened), axis=0)
 
   # time_shape = (cur_batch_size, seq_len)
   # features_shape = (cur_batch_size, num_feat)
@@ -476,12 +478,12 @@ def calculate_error_distribution_statistics_training(
     abs_err_count_time_var,
     abs_err_mean_time_var,
     abs_err_cov_time_var,
-    abs_err_inv_cov_time_var,
+    abs_err_chol_cov_time_var,
     X_feat_abs_recon_err,
     abs_err_count_feat_var,
     abs_err_mean_feat_var,
     abs_err_cov_feat_var,
-    abs_err_inv_cov_feat_var,
+    abs_err_chol_cov_feat_var,
     params,
     dummy_var):
   """Calculates error distribution statistics during training mode.
@@ -498,16 +500,16 @@ def calculate_error_distribution_statistics_training(
     abs_err_mean_time_var: Time major running column means of absolute error.
     abs_err_cov_time_var: Time major running covariance matrix of absolute
       error.
-    abs_err_inv_cov_time_var: Time major running inverse covariance matrix of
-    absolute error.
+    abs_err_chol_cov_time_var: Time major running Cholesky factor of covariance
+      matrix of absolute error.
     X_feat_abs_recon_err: Feature major reconstructed input data's absolute
       reconstruction error.
     abs_err_count_feat_var: Feature major running count of number of records.
     abs_err_mean_feat_var: Feature major running column means of absolute error.
     abs_err_cov_feat_var: Feature major running covariance matrix of absolute
       error.
-    abs_err_inv_cov_feat_var: Feature major running inverse covariance matrix of
-    absolute error.
+    abs_err_chol_cov_feat_var: Feature major running Cholesky factor of
+      covariance matrix of absolute error.
     params: Dictionary of parameters.
     dummy_var: Dummy variable used to allow training mode to happen since it
       requires a gradient to tie back to the graph dependency.
@@ -569,22 +571,22 @@ def calculate_error_distribution_statistics_training(
           control_inputs=[count_time_var, count_feat_var]):
         # Time based
         # shape = (num_feat, num_feat)
-        abs_err_inv_cov_time_tensor = \
-          tf.matrix_inverse(input=cov_time_var + \
+        abs_err_chol_cov_time_tensor = \
+          tf.cholesky(input=cov_time_var + \
             tf.eye(num_rows=tf.shape(input=cov_time_var)[0],
                    dtype=tf.float64) * params["eps"])
         # Features based
         # shape = (seq_len, seq_len)
-        abs_err_inv_cov_feat_tensor = \
-          tf.matrix_inverse(input=cov_feat_var + \
+        abs_err_chol_cov_feat_tensor = \
+          tf.cholesky(input=cov_feat_var + \
             tf.eye(num_rows=tf.shape(input=cov_feat_var)[0],
                    dtype=tf.float64) * params["eps"])
 
         with tf.control_dependencies(
-            control_inputs=[tf.assign(ref=abs_err_inv_cov_time_var,
-                                      value=abs_err_inv_cov_time_tensor),
-                            tf.assign(ref=abs_err_inv_cov_feat_var,
-                                      value=abs_err_inv_cov_feat_tensor)]):
+            control_inputs=[tf.assign(ref=abs_err_chol_cov_time_var,
+                                      value=abs_err_chol_cov_time_tensor),
+                            tf.assign(ref=abs_err_chol_cov_feat_var,
+                                      value=abs_err_chol_cov_feat_tensor)]):
           loss = tf.reduce_sum(
               input_tensor=tf.zeros(shape=(), dtype=tf.float64) * dummy_var)
 
@@ -0,0 +1,109 @@
+import argparse
+import os
+
+import numpy as np
+import tensorflow as tf
+
+
+def csv_line_to_example(line, num_feat, seq_len, labeled):
+  """Converts one CSV line of delimited sequences into a tf.train.Example.
+
+  Args:
+    line: String line of CSV file, one ";" delimited sequence per feature
+      followed by the anomalous_sequence_flag if labeled.
+    num_feat: Number of features.
+    seq_len: Number of timesteps in sequence.
+    labeled: Whether the line ends with the anomalous_sequence_flag column.
+
+  Returns:
+    tf.train.Example holding the sequences as raw float64 bytes.
+  """
+  columns = line.strip().split(",")
+
+  # shape = (num_feat, seq_len)
+  sequences = np.array(
+      [column.split(";") for column in columns[:num_feat]], dtype=np.float64)
+  if sequences.shape != (num_feat, seq_len):
+    raise ValueError(
+        "Expected sequences of shape {} but got {}".format(
+            (num_feat, seq_len), sequences.shape))
+
+  feature = {
+      "sequences": tf.train.Feature(
+          bytes_list=tf.train.BytesList(value=[sequences.tobytes()]))}
+  if labeled:
+    feature["anomalous_sequence_flag"] = tf.train.Feature(
+        float_list=tf.train.FloatList(value=[float(columns[num_feat])]))
+
+  return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def convert_file(input_file, output_file, num_feat, seq_len, labeled):
+  """Converts one CSV file into one TFRecord shard.
+
+  Args:
+    input_file: Path of CSV file to read.
+    output_file: Path of TFRecord file to write.
+    num_feat: Number of features.
+    seq_len: Number of timesteps in sequence.
+    labeled: Whether each line ends with the anomalous_sequence_flag column.
+
+  Returns:
+    Number of examples written.
+  """
+  num_examples = 0
+  with tf.gfile.GFile(name=input_file, mode="r") as reader:
+    with tf.python_io.TFRecordWriter(path=output_file) as writer:
+      for line in reader:
+        if not line.strip():
+          continue
+        example = csv_line_to_example(line, num_feat, seq_len, labeled)
+        writer.write(example.SerializeToString())
+        num_examples += 1
+
+  return num_examples
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      "--input_file_pattern",
+      help="GCS or local location of CSV files to convert.",
+      required=True
+  )
+  parser.add_argument(
+      "--output_dir",
+      help="GCS or local directory to write TFRecord shards to.",
+      required=True
+  )
+  parser.add_argument(
+      "--seq_len",
+      help="Number of timesteps to include in each example.",
+      type=int,
+      default=30
+  )
+  parser.add_argument(
+      "--num_feat",
+      help="Number of features for each example.",
+      type=int,
+      default=5
+  )
+  parser.add_argument(
+      "--labeled",
+      help="If the CSV files have an anomalous_sequence_flag column.",
+      type=str,
+      default="False"
+  )
+  args = parser.parse_args()
+
+  labeled = args.labeled.lower() in ("yes", "true", "t", "y", "1")
+
+  tf.gfile.MakeDirs(args.output_dir)
+  for input_file in tf.gfile.Glob(filename=args.input_file_pattern):
+    output_file = os.path.join(
+        args.output_dir,
+        os.path.splitext(os.path.basename(input_file))[0] + ".tfrecord")
+    num_examples = convert_file(
+        input_file, output_file, args.num_feat, args.seq_len, labeled)
+    print("Wrote {} examples from {} to {}".format(
+        num_examples, input_file, output_file))
@@ -0,0 +1,176 @@
+import functools
+
+import numpy as np
+
+
+class ErrorDistributionAccumulator(object):
+  """Streaming, mergeable accumulator of error distribution statistics.
+
+  NumPy counterpart of the running count, mean, and covariance variables
+  updated inside the Estimator graph by
+  calculate_error_distribution_statistics. It keeps the count, column means,
+  and the co-moment matrix (sum of outer products of centered rows), so that
+  accumulators built over separate shards of data, possibly in separate
+  processes, can be combined exactly with Chan et al.'s parallel formula.
+
+  Attributes:
+    size: Number of columns, either number of features (time major) or
+      sequence length (features major).
+    count: Running number of rows processed.
+    mean: float64 vector of running column means.
+    comoment: float64 matrix of running sum of centered outer products.
+  """
+
+  def __init__(self, size):
+    """Creates an empty accumulator.
+
+    Args:
+      size: Number of columns of the data that will be accumulated.
+    """
+    self.size = size
+    self.count = 0
+    self.mean = np.zeros(shape=[size], dtype=np.float64)
+    self.comoment = np.zeros(shape=[size, size], dtype=np.float64)
+
+  def update(self, batch):
+    """Updates running statistics with a batch of rows.
+
+    Args:
+      batch: Array-like of shape (number_of_rows, size).
+
+    Returns:
+      self, to allow chaining.
+    """
+    batch = np.asarray(batch, dtype=np.float64).reshape(-1, self.size)
+    count_b = batch.shape[0]
+    if count_b == 0:
+      return self
+
+    mean_b = batch.mean(axis=0)
+    batch_centered = batch - mean_b
+    comoment_b = np.dot(batch_centered.T, batch_centered)
+
+    return self._combine(count_b, mean_b, comoment_b)
+
+  def merge(self, other):
+    """Merges another accumulator's statistics into this one.
+
+    Args:
+      other: ErrorDistributionAccumulator of the same size.
+
+    Returns:
+      self, to allow chaining.
+    """
+    if other.size != self.size:
+      raise ValueError(
+          "Cannot merge accumulators of size {} and {}".format(
+              self.size, other.size))
+
+    return self._combine(other.count, other.mean, other.comoment)
+
+  def _combine(self, count_b, mean_b, comoment_b):
+    """Combines statistics of another set of rows using Chan's formula.
+
+    Args:
+      count_b: Number of rows of the other set.
+      mean_b: float64 vector of column means of the other set.
+      comoment_b: float64 matrix of co-moments of the other set.
+
+    Returns:
+      self, to allow chaining.
+    """
+    if count_b == 0:
+      return self
+
+    count_a = self.count
+    count_ab = count_a + count_b
+    delta = mean_b - self.mean
+
+    self.mean = self.mean + delta * (float(count_b) / count_ab)
+    self.comoment = (self.comoment + comoment_b +
+                     np.outer(delta, delta) * (float(count_a) * count_b /
+                                               count_ab))
+    self.count = count_ab
+
+    return self
+
+  def covariance(self, sample_cov=True):
+    """Returns the running covariance matrix.
+
+    Args:
+      sample_cov: Bool flag on whether sample or population covariance is used.
+
+    Returns:
+      float64 matrix of covariance, or zeros if too few rows have been seen.
+      With size 1 this is the running variance, as used for the unsupervised
+      mahalanobis distance threshold variables.
+    """
+    den = self.count - 1 if sample_cov else self.count
+    if den <= 0:
+      return np.zeros_like(self.comoment)
+
+    return self.comoment / den
+
+  def cholesky(self, eps, sample_cov=True):
+    """Returns the lower Cholesky factor used for mahalanobis distance.
+
+    Args:
+      eps: Added to the covariance diagonal to keep it positive definite.
+      sample_cov: Bool flag on whether sample or population covariance is used.
+
+    Returns:
+      float64 lower triangular matrix.
+    """
+    return np.linalg.cholesky(
+        self.covariance(sample_cov) + np.eye(self.size) * eps)
+
+  def variable_values(self, eps):
+    """Returns values for the Estimator's mahalanobis distance variables.
+
+    Args:
+      eps: Added to the covariance diagonal before Cholesky factorization.
+
+    Returns:
+      Tuple of count, mean, covariance, and Cholesky factor of covariance in
+      the same order as create_mahalanobis_dist_vars.
+    """
+    return (np.int64(self.count),
+            self.mean.copy(),
+            self.covariance(sample_cov=True),
+            self.cholesky(eps, sample_cov=True))
+
+
+def merge_accumulators(accumulators):
+  """Merges a sequence of accumulators, e.g. one per data shard.
+
+  Args:
+    accumulators: Iterable of ErrorDistributionAccumulator of the same size.
+
+  Returns:
+    New ErrorDistributionAccumulator holding the combined statistics.
+  """
+  accumulators = list(accumulators)
+
+  return functools.reduce(
+      lambda merged, acc: merged.merge(acc),
+      accumulators,
+      ErrorDistributionAccumulator(accumulators[0].size))
+
+
+def time_and_feat_major_errors(abs_recon_err):
+  """Reshapes absolute reconstruction errors into time and feature major rows.
+
+  Args:
+    abs_recon_err: Array of shape (batch_size, seq_len, num_feat).
+
+  Returns:
+    Time major array of shape (batch_size * seq_len, num_feat) and features
+    major array of shape (batch_size * num_feat, seq_len).
+  """
+  abs_recon_err = np.asarray(abs_recon_err, dtype=np.float64)
+  _, seq_len, num_feat = abs_recon_err.shape
+
+  X_time = abs_recon_err.reshape(-1, num_feat)
+  X_feat = np.transpose(abs_recon_err, axes=[0, 2, 1]).reshape(-1, seq_len)
+
+  return X_time, X_feat
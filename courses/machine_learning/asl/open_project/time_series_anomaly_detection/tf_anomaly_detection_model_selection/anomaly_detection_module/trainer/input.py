@@ -2,74 +2,84 @@ import tensorflow as tf
 
 
 # Input function functions
-def split_and_convert_string(string_tensor):
-  """Splits and converts string tensor into dense float tensor.
+def split_and_convert_string_batch(string_tensor, seq_len):
+  """Splits and converts a batch of sequence strings into dense floats.
 
-  Given string tensor, splits string by delimiter, converts to and returns
-  dense float tensor.
+  Given string tensor of any shape whose elements each hold seq_len delimited
+  values, splits all strings with one string_split op and converts them to a
+  dense float tensor in one string_to_number op.
 
   Args:
-    string_tensor: tf.string tensor.
+    string_tensor: tf.string tensor of shape (batch_size, num_feat).
+    seq_len: Number of timesteps in sequence.
 
   Returns:
-    tf.float64 tensor split along delimiter.
+    tf.float64 tensor of shape (batch_size, num_feat, seq_len).
   """
-  # Split string tensor into a sparse tensor based on delimiter
-  split_string = tf.string_split(source=tf.expand_dims(
-      input=string_tensor, axis=0), delimiter=";")
+  # Split every string of the whole batch at once into a sparse tensor
+  split_string = tf.string_split(
+      source=tf.reshape(tensor=string_tensor, shape=[-1]), delimiter=";")
 
-  # Converts the values of the sparse tensor to floats
+  # Every sequence has exactly seq_len values, so the sparse values are
+  # already laid out densely in row major order
   converted_tensor = tf.string_to_number(
       string_tensor=split_string.values,
       out_type=tf.float64)
 
-  # Create a new sparse tensor with the new converted values,
-  # because the original sparse tensor values are immutable
-  new_sparse_tensor = tf.SparseTensor(
-      indices=split_string.indices,
-      values=converted_tensor,
-      dense_shape=split_string.dense_shape)
-
-  # Create a dense tensor of the float values that were converted from text csv
-  dense_floats = tf.sparse_tensor_to_dense(
-      sp_input=new_sparse_tensor, default_value=0.0)
-
-  dense_floats_vector = tf.squeeze(input=dense_floats, axis=0)
+  # shape = (batch_size, num_feat, seq_len)
+  dense_floats = tf.reshape(
+      tensor=converted_tensor,
+      shape=tf.concat(
+          values=[tf.shape(input=string_tensor), [seq_len]], axis=0))
 
-  return dense_floats_vector
+  return dense_floats
 
 
-def convert_sequences_from_strings_to_floats(features, column_list, seq_len):
-  """Converts sequences from single strings to a sequence of floats.
-
-  Given features dictionary and feature column names list, convert features
-  from strings to a sequence of floats.
+def features_from_sequences(sequences, feat_names, seq_len):
+  """Unstacks a dense batch of sequences into a features dictionary.
 
   Args:
-    features: Dictionary of tensors of our features as tf.strings.
-    column_list: List of column names of our features.
+    sequences: tf.float64 tensor of shape (batch_size, num_feat, seq_len).
+    feat_names: List of column names of our features.
     seq_len: Number of timesteps in sequence.
 
   Returns:
-    Dictionary of tensors of our features as tf.float64s.
+    Dictionary of tf.float64 tensors of shape (batch_size, seq_len).
   """
-  for column in column_list:
-    features[column] = split_and_convert_string(features[column])
+  features = dict(zip(feat_names, tf.unstack(value=sequences, axis=1)))
+  for column in feat_names:
     # Since we know the sequence length, set the shape to remove the ambiguity
-    features[column].set_shape([seq_len])
+    features[column].set_shape([None, seq_len])
 
   return features
 
 
+def has_labels(mode, params):
+  """Returns whether the files read in this mode contain a label column.
+
+  Args:
+    mode: The estimator ModeKeys. Can be TRAIN or EVAL.
+    params: Dictionary of user passed parameters.
+
+  Returns:
+    Bool whether the files contain the anomalous_sequence_flag column.
+  """
+  return (mode == tf.estimator.ModeKeys.EVAL and
+          params["training_mode"] == "tune_anomaly_thresholds" and
+          params["labeled_tune_thresh"])
+
+
 def decode_csv(value_column, mode, batch_size, params):
-  """Decodes CSV file into tensors.
+  """Decodes a batch of CSV lines into tensors.
 
-  Given single string tensor, sequence length, and number of features,
-  returns features dictionary of tensors and labels tensor.
+  Given string tensor of a batch of lines, sequence length, and number of
+  features, returns features dictionary of tensors and labels tensor. All
+  columns of the batch are parsed together by one vectorized op, so this is
+  applied after dataset.batch().
 
   Args:
-    value_column: tf.string tensor of shape () compromising entire line of
-      CSV file.
+    value_column: tf.string tensor of shape (batch_size,) compromising entire
+      lines of CSV file.
     mode: The estimator ModeKeys. Can be TRAIN or EVAL.
     batch_size: Number of examples per batch.
     params: Dictionary of user passed parameters.
@@ -77,24 +87,12 @@ def decode_csv(value_column, mode, batch_size, params):
   Returns:
     Features dictionary of tensors and labels tensor.
   """
-  if (mode == tf.estimator.ModeKeys.TRAIN or
-      (mode == tf.estimator.ModeKeys.EVAL and
-       (params["training_mode"] != "tune_anomaly_thresholds" or
-        (params["training_mode"] == "tune_anomaly_thresholds" and
-         not params["labeled_tune_thresh"])))):
+  if not has_labels(mode, params):
     # For subset of CSV files that do NOT have labels
     columns = tf.decode_csv(
         records=value_column,
         record_defaults=params["feat_defaults"],
         field_delim=",")
-
-    features = dict(zip(params["feat_names"], columns))
-    features = convert_sequences_from_strings_to_floats(
-        features=features,
-        column_list=params["feat_names"],
-        seq_len=params["seq_len"])
-
-    return features
   else:
     # For subset of CSV files that DO have labels
     columns = tf.decode_csv(
@@ -102,14 +100,63 @@ def decode_csv(value_column, mode, batch_size, params):
         record_defaults=params["feat_defaults"] + [[0.0]],  # add label default
         field_delim=",")
 
-    features = dict(zip(params["feat_names"] + ["anomalous_sequence_flag"], columns))
+  # shape = (batch_size, num_feat, seq_len)
+  sequences = split_and_convert_string_batch(
+      string_tensor=tf.stack(
+          values=columns[:len(params["feat_names"])], axis=1),
+      seq_len=params["seq_len"])
+
+  features = features_from_sequences(
+      sequences=sequences,
+      feat_names=params["feat_names"],
+      seq_len=params["seq_len"])
+
+  if not has_labels(mode, params):
+    return features
+  else:
+    labels = tf.cast(x=columns[-1], dtype=tf.float64)
+
+    return features, labels
+
+
+def decode_tfrecord(serialized, mode, batch_size, params):
+  """Decodes a batch of precompiled TFRecord examples into tensors.
 
-    labels = tf.cast(x=features.pop("anomalous_sequence_flag"), dtype=tf.float64)
+  Examples are written by trainer.convert_to_tfrecord and hold all of an
+  example's sequences as raw float64 bytes, so no text parsing is needed.
 
-    features = convert_sequences_from_strings_to_floats(
-        features=features,
-        column_list=params["feat_names"],
-        seq_len=params["seq_len"])
+  Args:
+    serialized: tf.string tensor of shape (batch_size,) of serialized
+      tf.train.Example protos.
+    mode: The estimator ModeKeys. Can be TRAIN or EVAL.
+    batch_size: Number of examples per batch.
+    params: Dictionary of user passed parameters.
+
+  Returns:
+    Features dictionary of tensors and labels tensor.
+  """
+  feature_spec = {"sequences": tf.FixedLenFeature(shape=[], dtype=tf.string)}
+  if has_labels(mode, params):
+    feature_spec["anomalous_sequence_flag"] = tf.FixedLenFeature(
+        shape=[], dtype=tf.float32, default_value=0.0)
+
+  parsed = tf.parse_example(serialized=serialized, features=feature_spec)
+
+  # shape = (batch_size, num_feat, seq_len)
+  sequences = tf.reshape(
+      tensor=tf.decode_raw(bytes=parsed["sequences"], out_type=tf.float64),
+      shape=[-1, len(params["feat_names"]), params["seq_len"]])
+
+  features = features_from_sequences(
+      sequences=sequences,
+      feat_names=params["feat_names"],
+      seq_len=params["seq_len"])
+
+  if not has_labels(mode, params):
+    return features
+  else:
+    labels = tf.cast(
+        x=parsed["anomalous_sequence_flag"], dtype=tf.float64)
 
     return features, labels
 
@@ -141,12 +188,12 @@ def read_dataset(filename, mode, batch_size, params):
     file_list = tf.gfile.Glob(filename=filename)
 
     # Create dataset from file list
-    dataset = tf.data.TextLineDataset(filenames=file_list)  # Read text file
-
-    # Decode the CSV file into a features dictionary of tensors
-    dataset = dataset.map(
-        map_func=lambda x: decode_csv(
-            value_column=x, mode=mode, batch_size=batch_size, params=params))
+    if params["input_format"] == "tfrecord":
+      dataset = tf.data.TFRecordDataset(filenames=file_list)
+      decode_fn = decode_tfrecord
+    else:  # csv
+      dataset = tf.data.TextLineDataset(filenames=file_list)  # Read text file
+      decode_fn = decode_csv
 
     # Determine amount of times to repeat file if we are training or evaluating
     if mode == tf.estimator.ModeKeys.TRAIN:
@@ -160,6 +207,10 @@ def read_dataset(filename, mode, batch_size, params):
     # Group the data into batches
     dataset = dataset.batch(batch_size=batch_size)
 
+    # Decode each whole batch into a features dictionary of tensors
+    dataset = dataset.map(
+        map_func=lambda x: decode_fn(x, mode, batch_size, params))
+
     # Determine if we should shuffle based on if we are training or evaluating
     if mode == tf.estimator.ModeKeys.TRAIN:
       dataset = dataset.shuffle(buffer_size=10 * batch_size)
@@ -56,6 +56,12 @@ if __name__ == "__main__":
       type=str,
       required=True
   )
+  parser.add_argument(
+      "--input_format",
+      help="Format of input files: csv or tfrecord from convert_to_tfrecord.",
+      type=str,
+      default="csv"
+  )
 
   # Training parameters
   parser.add_argument(
@@ -230,6 +236,12 @@ if __name__ == "__main__":
       type=int,
       default=120
   )
+  parser.add_argument(
+      "--thresh_sweep_method",
+      help="How to sweep supervised anomaly thresholds: grid or sorted.",
+      type=str,
+      default="grid"
+  )
   parser.add_argument(
       "--min_time_anom_thresh",
       help="Minimum anomaly threshold to evaluate in time dimension.",
@@ -280,7 +292,7 @@ if __name__ == "__main__":
   )
   parser.add_argument(
       "--eps",
-      help="Added to the cov matrix before inversion to avoid being singular.",
+      help="Added to the cov matrix before Cholesky factorization to keep it PD.",
       type=str,
       default="1e-12"
   )
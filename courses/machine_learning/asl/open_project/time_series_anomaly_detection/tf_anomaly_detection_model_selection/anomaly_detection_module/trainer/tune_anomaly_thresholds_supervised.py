@@ -136,6 +136,106 @@ def update_anom_thresh_vars(
             tf.identity(input=tn_at_thresh_var))
 
 
+def calculate_sorted_threshold_confusion_matrix(
+    labels_mask, max_dist, anom_thresh):
+  """Calculates confusion matrix counts for all thresholds with one sort.
+
+  Given labels mask, each example's maximum mahalanobis distance, and the
+  sorted grid of anomaly thresholds, returns the number of examples of that
+  label predicted normal and predicted anomalous at each threshold.
+
+  Args:
+    labels_mask: tf.bool vector tensor when label was normal or
+      anomalous.
+    max_dist: tf.float64 vector tensor of maximum mahalanobis distance of each
+      example across the sequence.
+    anom_thresh: tf.float64 vector tensor of ascending grid of anomaly
+      thresholds to try.
+
+  Returns:
+    Counts of predicted normals and predicted anomalies for each threshold.
+  """
+  # shape = (num_label_examples,)
+  label_dist = tf.sort(values=tf.boolean_mask(tensor=max_dist, mask=labels_mask))
+
+  # Number of examples whose max distance is <= each threshold, i.e. those
+  # that are predicted normal at that threshold
+  # shape = (num_anom_thresh,)
+  predicted_normals = tf.squeeze(
+      input=tf.searchsorted(
+          sorted_sequence=tf.expand_dims(input=label_dist, axis=0),
+          values=tf.expand_dims(input=anom_thresh, axis=0),
+          side="right",
+          out_type=tf.int64),
+      axis=0)
+
+  # shape = (num_anom_thresh,)
+  predicted_anomalies = tf.size(
+      input=label_dist, out_type=tf.int64) - predicted_normals
+
+  return predicted_normals, predicted_anomalies
+
+
+def update_anom_thresh_vars_sorted(
+    labels_norm_mask,
+    labels_anom_mask,
+    anom_thresh,
+    mahalanobis_dist,
+    tp_at_thresh_var,
+    fn_at_thresh_var,
+    fp_at_thresh_var,
+    tn_at_thresh_var):
+  """Updates anomaly threshold variables using a single sorted sweep.
+
+  Produces the same counts as update_anom_thresh_vars in TRAIN mode, but each
+  batch costs O(batch * log(batch) + num_thresh * log(batch)) instead of
+  O(num_thresh * batch * final_shape), since an example is predicted
+  anomalous at a threshold exactly when its maximum distance exceeds it.
+
+  Args:
+    labels_norm_mask: tf.bool vector tensor that is true when label was normal.
+    labels_anom_mask: tf.bool vector tensor that is true when label was
+      anomalous.
+    anom_thresh: tf.float64 vector tensor of ascending grid of anomaly
+      thresholds to try.
+    mahalanobis_dist: tf.float64 matrix tensor of mahalanobis distances across
+      batch.
+    tp_at_thresh_var: tf.int64 variable tracking number of true positives at
+      each possible anomaly threshold.
+    fn_at_thresh_var: tf.int64 variable tracking number of false negatives at
+      each possible anomaly threshold.
+    fp_at_thresh_var: tf.int64 variable tracking number of false positives at
+      each possible anomaly threshold.
+    tn_at_thresh_var: tf.int64 variable tracking number of true negatives at
+      each possible anomaly threshold.
+
+  Returns:
+    Updated confusion matrix variables.
+  """
+  # shape = (cur_batch_size,)
+  max_dist = tf.reduce_max(input_tensor=mahalanobis_dist, axis=-1)
+
+  # Calculate confusion matrix of current batch
+  # time_shape = (num_time_anom_thresh,)
+  # feat_shape = (num_feat_anom_thresh,)
+  fn, tp = calculate_sorted_threshold_confusion_matrix(
+      labels_anom_mask, max_dist, anom_thresh)
+
+  tn, fp = calculate_sorted_threshold_confusion_matrix(
+      labels_norm_mask, max_dist, anom_thresh)
+
+  with tf.control_dependencies(
+      control_inputs=[tf.assign_add(ref=tp_at_thresh_var, value=tp),
+                      tf.assign_add(ref=fn_at_thresh_var, value=fn),
+                      tf.assign_add(ref=fp_at_thresh_var, value=fp),
+                      tf.assign_add(ref=tn_at_thresh_var, value=tn)]):
+
+    return (tf.identity(input=tp_at_thresh_var),
+            tf.identity(input=fn_at_thresh_var),
+            tf.identity(input=fp_at_thresh_var),
+            tf.identity(input=tn_at_thresh_var))
+
+
 def calculate_composite_classification_metrics(tp, fn, fp, tn, f_score_beta):
   """Calculates compositive classification metrics from the confusion matrix.
 
@@ -249,21 +349,36 @@ def optimize_anomaly_theshold(
   with tf.variable_scope(
       name_or_scope="mahalanobis_dist_thresh_vars",
       reuse=tf.AUTO_REUSE):
-    (tp_update_op,
-     fn_update_op,
-     fp_update_op,
-     tn_update_op) = \
-      update_anom_thresh_vars(
-          labels_norm_mask,
-          labels_anom_mask,
-          params["num_{}_anom_thresh".format(var_name)],
-          anom_threshs,
-          mahalanobis_dist,
-          tp_thresh_var,
-          fn_thresh_var,
-          fp_thresh_var,
-          tn_thresh_var,
-          mode)
+    if params["thresh_sweep_method"] == "sorted":
+      (tp_update_op,
+       fn_update_op,
+       fp_update_op,
+       tn_update_op) = \
+        update_anom_thresh_vars_sorted(
+            labels_norm_mask,
+            labels_anom_mask,
+            anom_threshs,
+            mahalanobis_dist,
+            tp_thresh_var,
+            fn_thresh_var,
+            fp_thresh_var,
+            tn_thresh_var)
+    else:  # grid
+      (tp_update_op,
+       fn_update_op,
+       fp_update_op,
+       tn_update_op) = \
+        update_anom_thresh_vars(
+            labels_norm_mask,
+            labels_anom_mask,
+            params["num_{}_anom_thresh".format(var_name)],
+            anom_threshs,
+            mahalanobis_dist,
+            tp_thresh_var,
+            fn_thresh_var,
+            fp_thresh_var,
+            tn_thresh_var,
+            mode)
 
   with tf.control_dependencies(
       control_inputs=[
@@ -17,9 +17,109 @@ import tensorflow as tf
 #from tensorflow.python.lib.io import file_io as gfile
 import numpy as np
 import math
+import os
 import sys
 
-def rnn_multistation_sampling_temperature_sequencer(filenames, resample_by=1, batch_size=sys.maxsize, sequence_size=sys.maxsize, n_forward=0, nb_epochs=1, tminmax=False, keepinmem=True):
+def read_temperature_csv(filename):
+    """
+    Reads the CSV file of one weather station.
+    Returns dates as int32 days since 1970-01-01, shape [n], and temperatures (Tmin, Tmax, interpolated), shape [n, 3]
+    """
+    with open(filename, mode='r') as f:
+        next(f) # skip header
+        lines = [line for line in f.read().splitlines() if line]
+    dates = np.array([line[:line.find(',')] for line in lines], dtype='datetime64[D]').astype(np.int32)
+    try:
+        temperatures = np.loadtxt(lines, delimiter=",", usecols=[1,2,3], ndmin=2)
+    except ValueError:
+        # missing values, let genfromtxt fill them with NaN
+        temperatures = np.genfromtxt(lines, delimiter=",", usecols=[1,2,3])
+    return dates, temperatures
+
+
+def convert_temperature_csvs(filenames, store_dir):
+    """
+    One-time conversion of weather station CSV files into a compact store in store_dir:
+      temperatures.npy: float32 (Tmin, Tmax, interpolated), shape [stations, days, 3]
+      dates.npy: int32 days since 1970-01-01, shape [days], shared by all stations
+      stations.txt: station file names, one per line, in the order of temperatures.npy
+    Stations are written one by one to a memory-mapped file so that memory use stays low.
+    """
+    filenames = list(filenames)
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    dates, temperatures = read_temperature_csv(filenames[0])
+    tmp_path = os.path.join(store_dir, 'temperatures.npy.tmp')
+    store = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                      shape=(len(filenames),) + temperatures.shape)
+    print("Converting {} files".format(len(filenames)), end="")
+    for i, filename in enumerate(filenames):
+        if i > 0:
+            station_dates, temperatures = read_temperature_csv(filename)
+            if not np.array_equal(station_dates, dates):
+                raise ValueError("{} does not cover the same dates as {}".format(filename, filenames[0]))
+        store[i] = temperatures
+        print(".", end="")
+    print()
+    store.flush()
+    del store
+    np.save(os.path.join(store_dir, 'dates.npy'), dates)
+    os.rename(tmp_path, os.path.join(store_dir, 'temperatures.npy'))
+    # written last, marks the store as complete
+    with open(os.path.join(store_dir, 'stations.txt'), mode='w') as f:
+        f.write("".join(os.path.basename(filename) + "\n" for filename in filenames))
+
+
+class TemperatureStore(object):
+    """
+    Read-only access to a store written by convert_temperature_csvs.
+    Temperatures are memory-mapped: only the stations that are used are read from disk.
+    """
+    def __init__(self, store_dir):
+        self.temperatures = np.load(os.path.join(store_dir, 'temperatures.npy'), mmap_mode='r')
+        self.dates = np.load(os.path.join(store_dir, 'dates.npy'))
+        with open(os.path.join(store_dir, 'stations.txt'), mode='r') as f:
+            self.stations = {name: i for i, name in enumerate(f.read().splitlines())}
+
+    @staticmethod
+    def exists(store_dir):
+        return os.path.exists(os.path.join(store_dir, 'stations.txt'))
+
+    def station_indices(self, filenames):
+        try:
+            return np.array([self.stations[os.path.basename(filename)] for filename in filenames])
+        except KeyError as e:
+            raise ValueError("{} is not in the temperature store, delete the store to convert again".format(e))
+
+
+def sequence_stations(temperatures, dates, resample_by, sequence_size, n_forward):
+    """
+    Shapes the temperatures of a batch of weather stations, shape [BATCHSIZE, days, 3] and
+    their dates, shape [days] into samples and targets of shape [p, BATCHSIZE, SEQLEN, 3]
+    and dates of shape [p, SEQLEN]. With resample_by=1, these are all views of the inputs.
+    """
+    def adjust(ary, n):
+        return ary[:, :ary.shape[1]//n*n]
+
+    nb_stations = temperatures.shape[0]
+    if resample_by > 1:
+        # Resample temperatures by averaging them across RESAMPLE_BY days
+        temperatures = np.reshape(adjust(temperatures, resample_by), [nb_stations, -1, resample_by, 3]) # [BATCHSIZE, n, RESAMPLE_BY, 3]
+        temperatures = np.mean(temperatures, axis=2) # shape [BATCHSIZE, n, 3]
+    dates = dates[:dates.shape[0]//resample_by*resample_by:resample_by]
+    # Shift temperature sequence to generate training targets
+    targets = temperatures[:, n_forward:]
+    temperatures = temperatures[:, :temperatures.shape[1]-n_forward] # to allow n_forward=0
+    dates = dates[:dates.shape[0]-n_forward]
+    # Group temperatures into sequences of SEQLEN values
+    nseq = min(sequence_size, temperatures.shape[1]) # If not even full sequence, return everything
+    targets = np.reshape(adjust(targets, nseq), [nb_stations, -1, nseq, 3]).swapaxes(0, 1) # [p, BATCHSIZE, SEQLEN, 3]
+    temperatures = np.reshape(adjust(temperatures, nseq), [nb_stations, -1, nseq, 3]).swapaxes(0, 1) # [p, BATCHSIZE, SEQLEN, 3]
+    dates = np.reshape(dates[:dates.shape[0]//nseq*nseq], [-1, nseq]) # shape [p, SEQLEN]
+    return temperatures, targets, dates
+
+
+def rnn_multistation_sampling_temperature_sequencer(filenames, resample_by=1, batch_size=sys.maxsize, sequence_size=sys.maxsize, n_forward=0, nb_epochs=1, tminmax=False, keepinmem=True, store_dir=None):
     """
     Loads temperature data from CSV files.
     Each data sequence is resampled by "resample_by". Use 1 not to resample.
@@ -32,6 +132,8 @@ def rnn_multistation_sampling_temperature_sequencer(filenames, resample_by=1, ba
     When batch_size data files are exhausted, the next batch of files is loaded.
     By default (Tmin, Tmax, interpolated) are returned if tminmax is False. Otherwise (Tmin, Tmax).
     By default, all loaded data is kept in memory and re-served from there. Set keepinmem=False to discard and reload.
+    If store_dir is set, the CSV files are converted once into a memory-mapped store in that directory
+    (see convert_temperature_csvs) and read from there on every later run. Temperatures are then float32.
     
     Returns epoch, filecount, sample, target, date
       epoch: the epoch number. RNN state should be reset on every epoch change.
@@ -43,11 +145,13 @@ def rnn_multistation_sampling_temperature_sequencer(filenames, resample_by=1, ba
     #print('Pattern "{}" matches {} files'.format(filepattern, len(filenames)))
     #filenames = np.array(filenames)
     
-    def adjust(ary, n):
-        return ary[:ary.shape[0]//n*n]
-    
-    loaded_samples = {}
-    loaded_targets = {}
+    store = None
+    if store_dir is not None:
+        if not TemperatureStore.exists(store_dir):
+            convert_temperature_csvs(filenames, store_dir)
+        store = TemperatureStore(store_dir)
+
+    loaded = {}
 
     for epoch in range(nb_epochs):
         np.random.shuffle(filenames)
@@ -57,52 +161,37 @@ def rnn_multistation_sampling_temperature_sequencer(filenames, resample_by=1, ba
         for filecount, filename in enumerate(filenames):
             filebatch.append(filename)
             if len(filebatch) == batchlen:
-                if filecount in loaded_samples:
+                if filecount in loaded:
+                    samples, targets, dates = loaded[filecount]
                     # shuffle lines every time the data is reused (this does not appear to be useful though)
-                    perm = np.random.permutation(loaded_samples[filecount].shape[1])
-                    #print("reshuffling {} rows".format(loaded_samples[filecount].shape[1]))
-                    samples = loaded_samples[filecount][:,perm]
-                    targets = loaded_targets[filecount][:,perm]
+                    # the permutation is applied to one batch at a time, as it is served
+                    perm = np.random.permutation(samples.shape[1])
                 else:
-                    print("Loading {} files".format(batchlen), end="")
-                    samples = []
-                    targets = []
-                    for filename in filebatch:
-                        with open(filename, mode='rb') as f:
+                    perm = None
+                    if store is not None:
+                        print("Loading {} stations from {}".format(batchlen, store_dir))
+                        temperatures = store.temperatures[store.station_indices(filebatch)] # shape [BATCHSIZE, days, 3]
+                        dates = store.dates
+                    else:
+                        print("Loading {} files".format(batchlen), end="")
+                        temperatures = []
+                        for filename in filebatch:
                             # Load min max temperatures from CSV
                             print(".", end="")
-                            temperatures = np.genfromtxt(f, delimiter=",", skip_header=True, usecols=[0,1,2,3],
-                                                         converters = {0: lambda s: np.datetime64(s)})
-                            dates = temperatures[:]['f0']                    # dates
-                            temperatures = np.stack([temperatures[:]['f1'],  # min temperatures
-                                                     temperatures[:]['f2'],  # max temperatures
-                                                     temperatures[:]['f3']], # interpolated
-                                                    axis=1) # shape [18262, 3]
-                            # Resample temperatures by averaging them across RESAMPLE_BY days
-                            temperatures = np.reshape(adjust(temperatures, resample_by), [-1, resample_by, 3]) # [n, RESAMPLE_BY, 3]
-                            temperatures = np.mean(temperatures, axis=1) # shape [n, 3]
-                            # Shift temperature sequence to generate training targets
-                            temp_targets = temperatures[n_forward:]
-                            temperatures = temperatures[:temperatures.shape[0]-n_forward] # to allow n_forward=0
-                            # Group temperatures into sequences of SEQLEN values
-                            nseq = min(sequence_size, temperatures.shape[0]) # If not even full sequence, return everything
-                            temp_targets = np.reshape(adjust(temp_targets, nseq), [-1, nseq, 3]) # [p, SEQLEN, 3]
-                            temperatures = np.reshape(adjust(temperatures, nseq), [-1, nseq, 3]) # [p, SEQLEN, 3]
-                            # do the same with dates, assume all dates identical in all files
-                            dates = np.reshape(adjust(dates, resample_by), [-1, resample_by])
-                            dates = dates[:dates.shape[0]-n_forward,0] # to allow n_forward=0
-                            dates = np.reshape(adjust(dates, nseq), [-1, nseq]) # shape [p, SEQLEN]
-                            # Add to batch, temperatures from one file forming a line across batches
-                            samples.append(temperatures)
-                            targets.append(temp_targets)
-                    samples = np.stack(samples, axis=1) # shape [p, BATCHSIZE, SEQLEN, 3]
-                    targets = np.stack(targets, axis=1) # shape [p, BATCHSIZE, SEQLEN, 3]
+                            dates, station_temperatures = read_temperature_csv(filename) # shape [18262, 3]
+                            temperatures.append(station_temperatures)
+                        temperatures = np.stack(temperatures) # shape [BATCHSIZE, days, 3]
+                        print()
+                    # assume all dates identical in all files
+                    samples, targets, dates = sequence_stations(temperatures, dates.astype('datetime64[D]'),
+                                                                resample_by, sequence_size, n_forward)
                     # keep them in memory
                     if keepinmem:
-                        loaded_samples.update({filecount:samples})
-                        loaded_targets.update({filecount:targets})
-                    print()
+                        loaded[filecount] = (samples, targets, dates)
                 for sample, target, date in zip(samples, targets, dates):
+                    if perm is not None:
+                        sample = sample[perm]
+                        target = target[perm]
                     if tminmax:
                         sample = sample[:,:,0:2] # return (Tmin, Tmax) only
                         target = target[:,:,0:2] # return (Tmin, Tmax) only
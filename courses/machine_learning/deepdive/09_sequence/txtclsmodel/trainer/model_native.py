@@ -7,6 +7,7 @@ import pandas as pd
 import numpy as np
 import re
 import os
+import weakref
 
 from tensorflow.python.keras.preprocessing import text
 from tensorflow.python.keras import models
@@ -26,6 +27,10 @@ TOP_K = 20000  # Limit on the number vocabulary size used for tokenization
 MAX_SEQUENCE_LENGTH = 50  # Sentences will be truncated/padded to this length
 VOCAB_FILE_PATH = None # where vocabulary is saved, dynamically set in train_and_eval function
 PADWORD = 'ZYXW'
+EMBEDDING_VOCAB_FILE = 'embedding_vocab.txt'  # files of the cache written by build_embedding_cache
+EMBEDDING_MATRIX_FILE = 'embedding_matrix.npy'
+
+_vocab_tables = weakref.WeakKeyDictionary()  # graph -> {vocabulary file: lookup table}
 
 """
 Helper function to download data from Google Cloud Storage
@@ -142,19 +147,31 @@ def vectorize_sentences(sentences):
     words = tf.sparse_tensor_to_dense(words, default_value=PADWORD)
 
     # 3. Map each word to respective integer
-    table = tf.contrib.lookup.index_table_from_file(
-        vocabulary_file=VOCAB_FILE_PATH,
-        num_oov_buckets=0,
-        vocab_size=None,
-        default_value=0,  # for words not in vocabulary (OOV)
-        key_column_index=0,
-        value_column_index=1,
-        delimiter=',')
-    numbers = table.lookup(words)
+    numbers = vocab_lookup_table().lookup(words)
 
     return numbers
 
 
+"""
+Returns the word to integer lookup table of VOCAB_FILE_PATH. The table is created
+  once per graph and shared by every later call in the same graph.
+  # Arguments: none
+  # Returns: tf lookup table, words out of vocabulary map to 0
+"""
+def vocab_lookup_table():
+    tables = _vocab_tables.setdefault(tf.compat.v1.get_default_graph(), {})
+    if VOCAB_FILE_PATH not in tables:
+        tables[VOCAB_FILE_PATH] = tf.contrib.lookup.index_table_from_file(
+            vocabulary_file=VOCAB_FILE_PATH,
+            num_oov_buckets=0,
+            vocab_size=None,
+            default_value=0,  # for words not in vocabulary (OOV)
+            key_column_index=0,
+            value_column_index=1,
+            delimiter=',')
+    return tables[VOCAB_FILE_PATH]
+
+
 """
 Builds a CNN model using keras and converts to tf.estimator.Estimator
   # Arguments
@@ -169,6 +186,9 @@ Builds a CNN model using keras and converts to tf.estimator.Estimator
         defaults to None which will cause the model to train embedding from scratch
       word_index: dictionary, mapping of vocabulary to integers. used only if
         pre-trained embedding is provided
+      embedding_cache_dir: string, local directory of a binary cache of the
+        pre-trained embedding (see build_embedding_cache), built on first use.
+        defaults to None which will read the embedding text file every time
 
     # Returns
         A tf.estimator.Estimator
@@ -182,7 +202,8 @@ def keras_estimator(model_dir,
                     kernel_size=3,
                     pool_size=3,
                     embedding_path=None,
-                    word_index=None):
+                    word_index=None,
+                    embedding_cache_dir=None):
     # Create model instance.
     model = models.Sequential()
     num_features = min(len(word_index) + 1, TOP_K)
@@ -190,7 +211,8 @@ def keras_estimator(model_dir,
     # Add embedding layer. If pre-trained embedding is used add weights to the
     # embeddings layer and set trainable to input is_embedding_trainable flag.
     if embedding_path != None:
-        embedding_matrix = get_embedding_matrix(word_index, embedding_path, embedding_dim)
+        embedding_matrix = get_embedding_matrix(word_index, embedding_path, embedding_dim,
+                                                embedding_cache_dir)
         is_embedding_trainable = True  # set to False to freeze embedding weights
 
         model.add(Embedding(input_dim=num_features,
@@ -241,43 +263,102 @@ def serving_input_fn():
 
 
 """
-Takes embedding for generic vocabulary and extracts the embeddings
-  matching the current vocabulary
-  The pre-trained embedding file is obtained from https://nlp.stanford.edu/projects/glove/
+Downloads the pre-trained embedding file if it is in GCS
   # Arguments:
-      word_index: dict, {key =word in vocabulary: value= integer mapped to that word}
-      embedding_path: string, location of the pre-trained embedding file on disk
-      embedding_dim: int, dimension of the embedding space
-  # Returns: numpy matrix of shape (vocabulary, embedding_dim) that contains the embedded
-      representation of each word in the vocabulary.
+      embedding_path: string, local path or GCS url of the pre-trained embedding file
+  # Returns: string, local path of the embedding file
 """
-def get_embedding_matrix(word_index, embedding_path, embedding_dim):
-    # Read the pre-trained embedding file and get word to word vector mappings.
-    embedding_matrix_all = {}
-
-    # Download if embedding file is in GCS
+def local_embedding_path(embedding_path):
     if embedding_path.startswith('gs://'):
         download_from_gcs(embedding_path, destination='embedding.csv')
         embedding_path = 'embedding.csv'
+    return embedding_path
 
+
+"""
+Streams the pre-trained embedding file once, parsing only the vectors of wanted words
+  # Arguments:
+      embedding_path: string, location of the pre-trained embedding file on disk
+      wanted: dict, {key =word: value= row of the word in the returned matrix}
+      num_rows: int, number of rows of the returned matrix
+      embedding_dim: int, dimension of the embedding space
+  # Returns: float32 numpy matrix of shape (num_rows, embedding_dim). Rows of words
+      not found are all-zeros.
+"""
+def read_embedding_vectors(embedding_path, wanted, num_rows, embedding_dim):
+    embedding_matrix = np.zeros((num_rows, embedding_dim), dtype=np.float32)
     with open(embedding_path) as f:
         for line in f:  # Every line contains word followed by the vector value
-            values = line.split()
-            word = values[0]
-            coefs = np.asarray(values[1:], dtype='float32')
-            embedding_matrix_all[word] = coefs
+            word, _, coefs = line.partition(' ')
+            i = wanted.get(word)
+            if i is not None:
+                embedding_matrix[i] = coefs.split()
+    return embedding_matrix
 
-    # Prepare embedding matrix with just the words in our word_index dictionary
+
+"""
+Converts the pre-trained embedding text file into a binary cache in cache_dir: the
+  words, one per line, and a float32 matrix with one row per word saved as .npy
+  # Arguments:
+      embedding_path: string, location of the pre-trained embedding file on disk
+      cache_dir: string, local directory to write the cache to
+      embedding_dim: int, dimension of the embedding space
+  # Returns: nothing, files are written to cache_dir
+"""
+def build_embedding_cache(embedding_path, cache_dir, embedding_dim):
+    with open(embedding_path) as f:
+        words = [line.partition(' ')[0] for line in f]
+    # later duplicates of a word win, as they would in a dict
+    embedding_matrix = read_embedding_vectors(
+        embedding_path, {word: i for i, word in enumerate(words)}, len(words), embedding_dim)
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    np.save(os.path.join(cache_dir, EMBEDDING_MATRIX_FILE), embedding_matrix)
+    # the vocabulary is written last, it marks the cache as complete
+    vocab_path = os.path.join(cache_dir, EMBEDDING_VOCAB_FILE)
+    with open(vocab_path + '.tmp', 'w') as f:
+        f.write(''.join(word + '\n' for word in words))
+    os.rename(vocab_path + '.tmp', vocab_path)
+
+
+"""
+Takes embedding for generic vocabulary and extracts the embeddings
+  matching the current vocabulary
+  The pre-trained embedding file is obtained from https://nlp.stanford.edu/projects/glove/
+  # Arguments:
+      word_index: dict, {key =word in vocabulary: value= integer mapped to that word}
+      embedding_path: string, location of the pre-trained embedding file on disk
+      embedding_dim: int, dimension of the embedding space
+      cache_dir: string, optional local directory of a binary cache of the embedding
+        file, built on first use. The cached matrix is memory-mapped so that only
+        the rows of the vocabulary are read.
+  # Returns: float32 numpy matrix of shape (vocabulary, embedding_dim) that contains
+      the embedded representation of each word in the vocabulary.
+"""
+def get_embedding_matrix(word_index, embedding_path, embedding_dim, cache_dir=None):
+    # Only the TOP_K words of our word_index dictionary are used
     num_words = min(len(word_index) + 1, TOP_K)
-    embedding_matrix = np.zeros((num_words, embedding_dim))
-
-    for word, i in word_index.items():
-        if i >= TOP_K:
-            continue
-        embedding_vector = embedding_matrix_all.get(word)
-        if embedding_vector is not None:
-            # words not found in embedding index will be all-zeros.
-            embedding_matrix[i] = embedding_vector
+    wanted = {word: i for word, i in word_index.items() if i < num_words}
+
+    if cache_dir is None:
+        return read_embedding_vectors(local_embedding_path(embedding_path), wanted, num_words, embedding_dim)
+
+    if not os.path.exists(os.path.join(cache_dir, EMBEDDING_VOCAB_FILE)):
+        build_embedding_cache(local_embedding_path(embedding_path), cache_dir, embedding_dim)
+    cached_matrix = np.load(os.path.join(cache_dir, EMBEDDING_MATRIX_FILE), mmap_mode='r')
+    if cached_matrix.shape[1] != embedding_dim:
+        raise ValueError('Embedding cache in {} has dimension {}, expected {}'.format(
+            cache_dir, cached_matrix.shape[1], embedding_dim))
+    with open(os.path.join(cache_dir, EMBEDDING_VOCAB_FILE)) as f:
+        cached_rows = {word: i for i, word in enumerate(f.read().splitlines())}
+
+    # words not found in embedding index will be all-zeros.
+    found = [(i, cached_rows[word]) for word, i in wanted.items() if word in cached_rows]
+    embedding_matrix = np.zeros((num_words, embedding_dim), dtype=np.float32)
+    if found:
+        rows, cached = zip(*found)
+        embedding_matrix[list(rows)] = cached_matrix[list(cached)]
     return embedding_matrix
 
 
@@ -316,7 +397,8 @@ def train_and_evaluate(output_dir, hparams):
         config=run_config,
         learning_rate=hparams['learning_rate'],
         embedding_path=hparams['embedding_path'],
-        word_index=tokenizer.word_index
+        word_index=tokenizer.word_index,
+        embedding_cache_dir=hparams.get('embedding_cache_dir')
     )
 
     # Create TrainSpec
@@ -29,6 +29,11 @@ if __name__ == '__main__':
         help='OPTIONAL: can be a local path or a GCS url (gs://...). \
               Download from: https://nlp.stanford.edu/projects/glove/',
     )
+    parser.add_argument(
+        '--embedding_cache_dir',
+        help='OPTIONAL: local directory of a binary cache of the embedding file, \
+              built on first use and reused by later runs. Native model only.',
+    )
     parser.add_argument(
         '--num_epochs',
         help='number of times to go through the data, default=10',
@@ -0,0 +1,97 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Latency benchmark of recommendation generation.
+
+Sweeps catalog size and k, comparing the full argsort baseline, the single
+user argpartition path and the batched many-user path.
+
+  python benchmark_recommendations.py --items 1000,10000,100000 --ks 5,50
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from recommendations import generate_recommendations
+from recommendations import generate_recommendations_many
+
+
+def generate_recommendations_argsort(user_idx, user_rated, row_factor,
+                                     col_factor, k):
+  """Baseline full argsort implementation, used for comparison only."""
+  user_f = row_factor[user_idx]
+  pred_ratings = col_factor.dot(user_f)
+  k_r = k + len(user_rated)
+  candidate_items = np.argsort(pred_ratings)[-k_r:]
+  recommended_items = [i for i in candidate_items if i not in user_rated]
+  recommended_items = recommended_items[-k:]
+  recommended_items.reverse()
+  return recommended_items
+
+
+def time_per_user(fn, num_users):
+  """Return mean milliseconds per user of calling fn()."""
+  start = time.time()
+  fn()
+  return (time.time() - start) * 1000.0 / num_users
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--items', type=str, default='1000,10000,100000',
+                      help='comma separated catalog sizes')
+  parser.add_argument('--ks', type=str, default='5,50',
+                      help='comma separated numbers of recommendations')
+  parser.add_argument('--users', type=int, default=1000,
+                      help='number of users in the model')
+  parser.add_argument('--batch', type=int, default=256,
+                      help='number of users scored per benchmark run')
+  parser.add_argument('--rated', type=int, default=20,
+                      help='number of already viewed items per user')
+  parser.add_argument('--factors', type=int, default=30,
+                      help='number of latent factors')
+  args = parser.parse_args()
+
+  rng = np.random.RandomState(0)
+  print('%10s %6s %14s %14s %14s' % ('items', 'k', 'argsort_ms',
+                                     'single_ms', 'batched_ms'))
+  for n_items in [int(n) for n in args.items.split(',')]:
+    row_factor = rng.randn(args.users, args.factors)
+    col_factor = rng.randn(n_items, args.factors)
+    user_idxs = rng.randint(0, args.users, size=args.batch)
+    users_rated = [rng.choice(n_items, size=args.rated, replace=False)
+                   for _ in user_idxs]
+
+    for k in [int(k) for k in args.ks.split(',')]:
+      baseline = time_per_user(
+          lambda: [generate_recommendations_argsort(u, list(r), row_factor,
+                                                    col_factor, k)
+                   for u, r in zip(user_idxs, users_rated)],
+          args.batch)
+      single = time_per_user(
+          lambda: [generate_recommendations(u, r, row_factor, col_factor, k)
+                   for u, r in zip(user_idxs, users_rated)],
+          args.batch)
+      batched = time_per_user(
+          lambda: generate_recommendations_many(user_idxs, users_rated,
+                                                row_factor, col_factor, k),
+          args.batch)
+      print('%10d %6d %14.4f %14.4f %14.4f' % (n_items, k, baseline, single,
+                                               batched))
+
+
+if __name__ == '__main__':
+  main()
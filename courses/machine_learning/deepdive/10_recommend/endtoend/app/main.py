@@ -14,13 +14,21 @@
 
 """Main module for App Engine app."""
 
+import os
+
 from flask import Flask, jsonify, request
 
+from recommendations import LocalModelStore
 from recommendations import Recommendations
 
 app = Flask(__name__)
 
-rec_util = Recommendations()
+# MODEL_DIR points at a local directory laid out like the model bucket,
+# e.g. for tests; by default the model is read from the recserve GCS bucket
+model_dir = os.environ.get('MODEL_DIR')
+rec_util = Recommendations(
+    model_store=LocalModelStore(model_dir) if model_dir else None,
+    refresh_secs=int(os.environ.get('MODEL_REFRESH_SECS', '300')))
 
 DEFAULT_RECS = 5
 
@@ -14,10 +14,18 @@
 
 """Recommendation generation module."""
 
+import base64
+from concurrent import futures
+import hashlib
+import json
 import logging
 import numpy as np
 import os
 import pandas as pd
+import shutil
+import tempfile
+import threading
+import time
 
 import google.auth
 import google.cloud.storage as storage
@@ -30,59 +38,365 @@ ROW_MODEL_FILE = 'model/row.npy'
 COL_MODEL_FILE = 'model/col.npy'
 USER_MODEL_FILE = 'model/user.npy'
 ITEM_MODEL_FILE = 'model/item.npy'
+USER_ITEM_INDEX_FILE = 'model/user_items.npz'
 USER_ITEM_DATA_FILE = 'data/recommendation_events.csv'
+# written last by the trainer, lists the files of a model and their md5
+MANIFEST_FILE = 'model/manifest.json'
+
+MODEL_FILES = [ROW_MODEL_FILE, COL_MODEL_FILE, USER_MODEL_FILE,
+               ITEM_MODEL_FILE]
+
+DOWNLOAD_THREADS = 8
+
+# cached files used more recently than this are never pruned, they may
+# belong to a newer version another worker is loading
+CACHE_GRACE_SECS = 600
+
+# prefix of the files being downloaded into the cache
+_TMP_PREFIX = 'tmp'
+
+
+def _md5_hash(md5):
+  """Return the content hash of a file given its md5, as listed by GCS."""
+  return 'md5:' + base64.b64encode(md5.digest()).decode('ascii')
+
+
+class _HashingWriter(object):
+  """Binary file object wrapper computing the md5 of the bytes written."""
+
+  def __init__(self, file_obj):
+    self._file_obj = file_obj
+    self.md5 = hashlib.md5()
+
+  def write(self, data):
+    self.md5.update(data)
+    return self._file_obj.write(data)
+
+
+class GCSModelStore(object):
+  """Model files stored as blobs in a GCS bucket.
+
+  Args:
+    bucket_name: (string) name of the GCS bucket holding the model files
+  """
+
+  def __init__(self, bucket_name):
+    self._bucket = storage.Client().get_bucket(bucket_name)
+
+  def content_hash(self, name):
+    """Return a hash of the current content of a file, or None if missing."""
+    blob = self._bucket.get_blob(name)
+    if blob is None:
+      return None
+    # composite objects have no md5, only an etag
+    if blob.md5_hash:
+      return 'md5:' + blob.md5_hash
+    return 'etag:' + blob.etag
+
+  def download(self, name, content_hash, file_obj):
+    """Write the content of a file into a binary file object.
+
+    Raises:
+      IOError: the file no longer has content_hash, e.g. it was uploaded again
+        since content_hash() was called
+    """
+    writer = _HashingWriter(file_obj)
+    self._bucket.blob(name).download_to_file(writer)
+    if content_hash.startswith('md5:'):
+      downloaded = _md5_hash(writer.md5)
+    else:
+      downloaded = self.content_hash(name)
+    if downloaded != content_hash:
+      raise IOError('%s changed while downloading it' % name)
+
+
+class LocalModelStore(object):
+  """Model files stored in a local directory, a stand-in for the GCS bucket.
+
+  Args:
+    root_dir: (string) directory laid out like the bucket, e.g. root_dir/model
+  """
+
+  def __init__(self, root_dir):
+    self._root_dir = root_dir
+
+  def content_hash(self, name):
+    """Return a hash of the current content of a file, or None if missing."""
+    path = os.path.join(self._root_dir, name)
+    if not os.path.exists(path):
+      return None
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file_obj:
+      for chunk in iter(lambda: file_obj.read(1 << 20), b''):
+        md5.update(chunk)
+    return _md5_hash(md5)
+
+  def download(self, name, content_hash, file_obj):
+    """Write the content of a file into a binary file object.
+
+    Raises:
+      IOError: the file no longer has content_hash
+    """
+    writer = _HashingWriter(file_obj)
+    with open(os.path.join(self._root_dir, name), 'rb') as src:
+      shutil.copyfileobj(src, writer)
+    if _md5_hash(writer.md5) != content_hash:
+      raise IOError('%s changed while downloading it' % name)
+
+
+class ModelVersion(object):
+  """Immutable set of arrays making up one version of the model.
+
+  Args:
+    version: (tuple) the (file, content hash) pairs this version was built from
+    user_factor: row factors, memory-mapped read only
+    item_factor: column factors, memory-mapped read only
+    user_map: sorted user ids for each row of the ratings matrix
+    item_map: sorted item ids for each column of the ratings matrix
+    user_items_indptr: CSR index pointers of each user's viewed items
+    user_items_indices: CSR item indexes of each user's viewed items
+  """
+
+  def __init__(self, version, user_factor, item_factor, user_map, item_map,
+               user_items_indptr, user_items_indices):
+    self.version = version
+    self.user_factor = user_factor
+    self.item_factor = item_factor
+    self.user_map = user_map
+    self.item_map = item_map
+    self.user_items_indptr = user_items_indptr
+    self.user_items_indices = user_items_indices
 
 
 class Recommendations(object):
   """Provide recommendations from a pre-trained collaborative filtering model.
 
+  A version of the model is made of the files listed in the manifest the
+  trainer writes last, with their md5, so a model still being uploaded is
+  not served. For models trained without a manifest, the files must not
+  change between two polls before they are loaded.
+
+  Model files are cached locally under names derived from their content hash,
+  so unchanged files are never downloaded twice and files are never
+  overwritten while mapped. Downloads are checked against that hash, and the
+  cache only keeps the files of the current and previous versions, and those
+  used by any worker in the last cache_grace_secs. Factor matrices are opened
+  with mmap_mode, so all workers on a host share the same pages. If
+  refresh_secs is set, a background thread polls the store and atomically
+  swaps in new versions.
+
   Args:
     local_model_path: (string) local path to model files
+    model_store: object with content_hash(name) and
+      download(name, content_hash, file_obj), defaults to the project's
+      recserve GCS bucket
+    refresh_secs: (int) seconds between checks for a new model, 0 disables
+    cache_grace_secs: (int) seconds a cached file is kept after its last use
   """
 
-  def __init__(self, local_model_path=LOCAL_MODEL_PATH):
-    _, project_id = google.auth.default()
-    self._bucket = 'recserve_' + project_id
-    self._load_model(local_model_path)
+  def __init__(self, local_model_path=LOCAL_MODEL_PATH, model_store=None,
+               refresh_secs=0, cache_grace_secs=CACHE_GRACE_SECS):
+    if model_store is None:
+      _, project_id = google.auth.default()
+      model_store = GCSModelStore('recserve_' + project_id)
+    self._store = model_store
+    self._cache_path = os.path.join(local_model_path, 'model_cache')
+    os.makedirs(self._cache_path, exist_ok=True)
+    self._cache_grace_secs = cache_grace_secs
+    self._executor = futures.ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS)
+    # (content hash, version) of the last manifest read
+    self._manifest = (None, None)
+    # version without a manifest seen by the last poll, not loaded yet
+    self._pending = None
+    self._model = self._load_model(self._remote_version())
+    self._prune_cache([self._model.version])
+
+    if refresh_secs:
+      self._stop = threading.Event()
+      watcher = threading.Thread(target=self._watch, args=(refresh_secs,))
+      watcher.daemon = True
+      watcher.start()
+
+  @property
+  def version(self):
+    """The (file, content hash) pairs of the model currently served."""
+    return self._model.version
+
+  def _remote_version(self):
+    """Return the (file, content hash) pairs of the model in the store.
+
+    The pairs are those of the manifest, which is included, or the current
+    hashes of the files for models trained without one.
+    """
+    manifest_hash = self._store.content_hash(MANIFEST_FILE)
+    if manifest_hash is None:
+      return self._listed_version()
+    if self._manifest[0] != manifest_hash:
+      with open(self._fetch(MANIFEST_FILE, manifest_hash)) as file_obj:
+        files = json.load(file_obj)['files']
+      hashes = dict((name, 'md5:' + md5) for name, md5 in files.items())
+      hashes[MANIFEST_FILE] = manifest_hash
+      missing = [name for name in MODEL_FILES if name not in hashes]
+      if missing:
+        raise IOError('Model files not in manifest: %s' % ', '.join(missing))
+      if USER_ITEM_INDEX_FILE not in hashes:
+        hashes[USER_ITEM_DATA_FILE] = self._store.content_hash(
+            USER_ITEM_DATA_FILE)
+        if hashes[USER_ITEM_DATA_FILE] is None:
+          raise IOError('Model files not found: %s' % USER_ITEM_DATA_FILE)
+      self._manifest = (manifest_hash, tuple(sorted(hashes.items())))
+    return self._manifest[1]
+
+  def _listed_version(self):
+    """Return the (file, content hash) pairs of the files in the store."""
+    # prefer the prebuilt user/item history index written at training time,
+    # and only fall back to the raw events for models trained without it
+    names = MODEL_FILES + [USER_ITEM_INDEX_FILE, USER_ITEM_DATA_FILE]
+    hashes = dict(zip(names, self._executor.map(self._store.content_hash,
+                                                 names)))
+    if hashes[USER_ITEM_INDEX_FILE] is not None:
+      del hashes[USER_ITEM_DATA_FILE]
+    else:
+      del hashes[USER_ITEM_INDEX_FILE]
+
+    missing = [name for name, content_hash in hashes.items()
+               if content_hash is None]
+    if missing:
+      raise IOError('Model files not found: %s' % ', '.join(missing))
+
+    return tuple(sorted(hashes.items()))
+
+  def _cache_file(self, name, content_hash):
+    """Return the local path of a file in the content-addressed cache."""
+    key = hashlib.sha1((name + content_hash).encode('utf-8')).hexdigest()
+    return os.path.join(self._cache_path, key + os.path.splitext(name)[1])
+
+  def _fetch(self, name, content_hash):
+    """Download a file into the content-addressed cache unless already there.
 
-  def _load_model(self, local_model_path):
-    """Load recommendation model files from GCS.
+    Returns:
+      local path of the cached file
+    """
+    path = self._cache_file(name, content_hash)
+    try:
+      # mark the file as used, so that other workers do not prune it
+      os.utime(path)
+      return path
+    except OSError:  # not cached
+      pass
+    # write to a temporary file and rename, so other workers never see a
+    # partial file
+    fd, tmp_path = tempfile.mkstemp(dir=self._cache_path, prefix=_TMP_PREFIX)
+    try:
+      with os.fdopen(fd, 'wb') as file_obj:
+        self._store.download(name, content_hash, file_obj)
+      os.replace(tmp_path, path)
+    except BaseException:
+      os.remove(tmp_path)
+      raise
+    return path
+
+  def _prune_cache(self, versions):
+    """Remove the cached files that belong to none of the given versions.
+
+    Files written or used in the last cache_grace_secs, by this or another
+    worker, are kept, as are those being downloaded. Files still
+    memory-mapped by a worker stay readable until unmapped.
+    """
+    keep = set(os.path.basename(self._cache_file(name, content_hash))
+               for version in versions for name, content_hash in version)
+    used_since = time.time() - self._cache_grace_secs
+    for file_name in os.listdir(self._cache_path):
+      if file_name in keep:
+        continue
+      path = os.path.join(self._cache_path, file_name)
+      try:
+        if os.path.getmtime(path) < used_since:
+          os.remove(path)
+      except OSError:  # already removed by another worker
+        pass
+
+  def _load_model(self, version):
+    """Download and load the model files of a version.
 
     Args:
-      local_model_path: (string) local path to model files
-    """
-    # download files from GCS to local storage
-    os.makedirs(os.path.join(local_model_path, 'model'), exist_ok=True)
-    os.makedirs(os.path.join(local_model_path, 'data'), exist_ok=True)
-    client = storage.Client()
-    bucket = client.get_bucket(self._bucket)
+      version: (tuple) the (file, content hash) pairs to load
 
+    Returns:
+      ModelVersion
+    """
     logging.info('Downloading blobs.')
 
-    model_files = [ROW_MODEL_FILE, COL_MODEL_FILE, USER_MODEL_FILE,
-                   ITEM_MODEL_FILE, USER_ITEM_DATA_FILE]
-    for model_file in model_files:
-      blob = bucket.blob(model_file)
-      with open(os.path.join(local_model_path, model_file), 'wb') as file_obj:
-        blob.download_to_file(file_obj)
+    names = [name for name, _ in version]
+    paths = dict(zip(names, self._executor.map(lambda v: self._fetch(*v),
+                                               version)))
 
     logging.info('Finished downloading blobs.')
 
-    # load npy arrays for user/item factors and user/item maps
-    self.user_factor = np.load(os.path.join(local_model_path, ROW_MODEL_FILE))
-    self.item_factor = np.load(os.path.join(local_model_path, COL_MODEL_FILE))
-    self.user_map = np.load(os.path.join(local_model_path, USER_MODEL_FILE))
-    self.item_map = np.load(os.path.join(local_model_path, ITEM_MODEL_FILE))
+    # memory-map npy arrays for user/item factors, load user/item maps
+    user_factor = np.load(paths[ROW_MODEL_FILE], mmap_mode='r')
+    item_factor = np.load(paths[COL_MODEL_FILE], mmap_mode='r')
+    user_map = np.load(paths[USER_MODEL_FILE])
+    item_map = np.load(paths[ITEM_MODEL_FILE])
 
     logging.info('Finished loading arrays.')
 
-    # load user_item history into pandas dataframe
-    views_df = pd.read_csv(os.path.join(local_model_path,
-                                        USER_ITEM_DATA_FILE), sep=',', header=0)
-    self.user_items = views_df.groupby('clientId')
+    # load user_item history as a CSR style index, where the item indexes
+    # viewed by user index u are user_items_indices[indptr[u]:indptr[u + 1]]
+    if USER_ITEM_INDEX_FILE in paths:
+      with np.load(paths[USER_ITEM_INDEX_FILE]) as index:
+        user_items_indptr = index['indptr']
+        user_items_indices = index['indices']
+    else:
+      views_df = pd.read_csv(paths[USER_ITEM_DATA_FILE], sep=',', header=0)
+      user_items_indptr, user_items_indices = build_user_item_index(
+          views_df.clientId.values, views_df.contentId.values,
+          user_map, item_map)
+
+    check_model_consistency(user_factor, item_factor, user_map, item_map,
+                            user_items_indptr, user_items_indices)
 
     logging.info('Finished loading model.')
 
+    return ModelVersion(version, user_factor, item_factor, user_map, item_map,
+                        user_items_indptr, user_items_indices)
+
+  def refresh(self):
+    """Load and swap in the model in the store if it changed.
+
+    Requests in flight keep using the version they started with. Models
+    without a manifest are only loaded once two polls in a row saw them.
+
+    Returns:
+      True if a new version was swapped in.
+    """
+    version = self._remote_version()
+    if version == self._model.version:
+      self._pending = None
+      return False
+    if MANIFEST_FILE not in dict(version) and version != self._pending:
+      # the files may still be uploading, wait for the next poll
+      self._pending = version
+      return False
+    previous = self._model
+    self._model = self._load_model(version)
+    logging.info('Swapped in new model version.')
+    self._prune_cache([self._model.version, previous.version])
+    return True
+
+  def _watch(self, refresh_secs):
+    """Background loop checking for new model versions."""
+    while not self._stop.wait(refresh_secs):
+      try:
+        self.refresh()
+      except Exception:  # keep serving the current version
+        logging.exception('Failed to refresh model.')
+
+  def stop(self):
+    """Stop the background model watcher, if any."""
+    if hasattr(self, '_stop'):
+      self._stop.set()
+
   def get_recommendations(self, user_id, num_recs):
     """Given a user id, return list of num_recs recommended item ids.
 
@@ -95,29 +409,118 @@ class Recommendations(object):
         if user id is found.
       None: The user id was not found.
     """
-    article_recommendations = None
+    return self.get_recommendations_many([user_id], num_recs)[0]
+
+  def get_recommendations_many(self, user_ids, num_recs):
+    """Given user ids, return lists of num_recs recommended item ids.
 
-    # map user id into ratings matrix user index
-    user_idx = np.searchsorted(self.user_map, user_id)
+    All found users are scored together with a single matrix multiply.
 
-    if user_idx:
-      # get already viewed items from views dataframe
-      already_rated = self.user_items.get_group(user_id).contentId
-      already_rated_idx = [np.searchsorted(self.item_map, i)
-                           for i in already_rated]
+    Args:
+      user_ids: (list) The user ids
+      num_recs: (int) The number of recommended items to return per user
 
-      # generate list of recommended article indexes from model
-      recommendations = generate_recommendations(user_idx, already_rated_idx,
-                                                 self.user_factor,
-                                                 self.item_factor,
-                                                 num_recs)
+    Returns:
+      A list with, for each user id, the list of k recommended item ids if the
+      user id is found, or None if it was not found.
+    """
+    # use one model version for the whole request, even if swapped meanwhile
+    model = self._model
+    article_recommendations = [None] * len(user_ids)
+
+    # map user ids into ratings matrix user indexes
+    user_ids = np.asarray(user_ids)
+    user_idx = np.searchsorted(model.user_map, user_ids)
+    found = user_idx < len(model.user_map)
+    found[found] = model.user_map[user_idx[found]] == user_ids[found]
+    found_pos = np.flatnonzero(found)
+
+    if found_pos.size:
+      # get already viewed item indexes as slices of the history index
+      already_rated_idx = [
+          model.user_items_indices[model.user_items_indptr[u]:
+                                   model.user_items_indptr[u + 1]]
+          for u in user_idx[found_pos]]
+
+      # generate recommended article indexes from model
+      recommendations = generate_recommendations_many(user_idx[found_pos],
+                                                      already_rated_idx,
+                                                      model.user_factor,
+                                                      model.item_factor,
+                                                      num_recs)
 
       # map article indexes back to article ids
-      article_recommendations = [self.item_map[i] for i in recommendations]
+      for pos, recs in zip(found_pos, recommendations):
+        article_recommendations[pos] = model.item_map[recs].tolist()
 
     return article_recommendations
 
 
+def check_model_consistency(user_factor, item_factor, user_map, item_map,
+                            user_items_indptr, user_items_indices):
+  """Check that the model files belong together.
+
+  The files are uploaded one by one after training, so a store can briefly
+  hold files from two training runs.
+
+  Raises:
+    ValueError: the arrays do not describe the same ratings matrix
+  """
+  if user_factor.shape[0] != len(user_map):
+    raise ValueError('%d user factors for %d users' %
+                     (user_factor.shape[0], len(user_map)))
+  if item_factor.shape[0] != len(item_map):
+    raise ValueError('%d item factors for %d items' %
+                     (item_factor.shape[0], len(item_map)))
+  if user_factor.shape[1] != item_factor.shape[1]:
+    raise ValueError('%d latent factors per user, %d per item' %
+                     (user_factor.shape[1], item_factor.shape[1]))
+  if len(user_items_indptr) != len(user_map) + 1:
+    raise ValueError('user history index for %d users, model has %d' %
+                     (len(user_items_indptr) - 1, len(user_map)))
+  if len(user_items_indices) and user_items_indices.max() >= len(item_map):
+    raise ValueError('user history index has items outside the model')
+
+
+def build_user_item_index(user_ids, item_ids, user_map, item_map):
+  """Build a CSR style index of the item indexes viewed by each user.
+
+  Args:
+    user_ids: array of user ids of each view event
+
+    item_ids: array of item ids of each view event
+
+    user_map: sorted array of user ids for each row of the ratings matrix
+
+    item_map: sorted array of item ids for each column of the ratings matrix
+
+  Returns:
+    indptr: (n_users + 1,) array, user index u viewed the item indexes
+      indices[indptr[u]:indptr[u + 1]]
+    indices: array of unique, sorted item indexes per user
+  """
+  n_users = len(user_map)
+  n_items = len(item_map)
+
+  # map ids into matrix indexes, dropping ids that are not in the model
+  user_idx = np.searchsorted(user_map, user_ids)
+  item_idx = np.searchsorted(item_map, item_ids)
+  found = (user_idx < n_users) & (item_idx < n_items)
+  found[found] = ((user_map[user_idx[found]] == user_ids[found]) &
+                  (item_map[item_idx[found]] == item_ids[found]))
+
+  # sort and de-duplicate (user, item) pairs in one pass
+  pairs = np.unique(user_idx[found].astype(np.int64) * n_items +
+                    item_idx[found])
+  users = pairs // n_items
+
+  indptr = np.zeros(n_users + 1, dtype=np.int64)
+  np.cumsum(np.bincount(users, minlength=n_users), out=indptr[1:])
+  indices = (pairs % n_items).astype(np.int64)
+
+  return indptr, indices
+
+
 def generate_recommendations(user_idx, user_rated, row_factor, col_factor, k):
   """Generate recommendations for a user.
 
@@ -138,26 +541,71 @@ def generate_recommendations(user_idx, user_rated, row_factor, col_factor, k):
     list of k item indexes with the predicted highest rating,
     excluding those that the user has already rated
   """
+  return generate_recommendations_many([user_idx], [user_rated],
+                                       row_factor, col_factor, k)[0].tolist()
+
+
+def generate_recommendations_many(user_idxs, users_rated, row_factor,
+                                  col_factor, k):
+  """Generate recommendations for many users with one matrix multiply.
+
+  Args:
+    user_idxs: the row indexes of the users in the ratings matrix,
+
+    users_rated: for each user, the list of item indexes previously rated by
+      that user (which will be excluded from the recommendations),
+
+    row_factor: the row factors of the recommendation model
+
+    col_factor: the column factors of the recommendation model
+
+    k: number of recommendations requested per user
+
+  Returns:
+    (num_users, k) array of item indexes with the predicted highest rating,
+    highest first, excluding those that each user has already rated
+  """
+  n_items = col_factor.shape[0]
+  n_rated = np.array([len(rated) for rated in users_rated], dtype=np.int64)
 
   # bounds checking for args
-  assert (row_factor.shape[0] - len(user_rated)) >= k
+  assert np.all((n_items - n_rated) >= k)
+
+  # dot product of item factors with user factors gives predicted ratings
+  pred_ratings = row_factor[np.asarray(user_idxs)].dot(col_factor.T)
+
+  # mask out previously rated items in one scatter
+  if n_rated.sum():
+    rated_rows = np.repeat(np.arange(len(users_rated)), n_rated)
+    rated_cols = np.concatenate([np.asarray(rated, dtype=np.int64)
+                                 for rated in users_rated])
+    pred_ratings[rated_rows, rated_cols] = -np.inf
+
+  return top_k_items(pred_ratings, k)
 
-  # retrieve user factor
-  user_f = row_factor[user_idx]
 
-  # dot product of item factors with user factor gives predicted ratings
-  pred_ratings = col_factor.dot(user_f)
+def top_k_items(pred_ratings, k):
+  """Select the k highest rated item indexes per row, highest first.
 
-  # find candidate recommended item indexes sorted by predicted rating
-  k_r = k + len(user_rated)
-  candidate_items = np.argsort(pred_ratings)[-k_r:]
+  Uses a linear time partial selection and only sorts the k candidates.
 
-  # remove previously rated items and take top k
-  recommended_items = [i for i in candidate_items if i not in user_rated]
-  recommended_items = recommended_items[-k:]
+  Args:
+    pred_ratings: (num_users, n_items) array of predicted ratings
+
+    k: number of items to select per row
+
+  Returns:
+    (num_users, k) array of item indexes
+  """
+  rows = np.arange(pred_ratings.shape[0])[:, np.newaxis]
 
-  # flip to sort highest rated first
-  recommended_items.reverse()
+  if k < pred_ratings.shape[1]:
+    candidate_items = np.argpartition(-pred_ratings, k - 1, axis=1)[:, :k]
+  else:
+    candidate_items = np.tile(np.arange(pred_ratings.shape[1]),
+                              (pred_ratings.shape[0], 1))
 
-  return recommended_items
+  # sort only the candidates, highest rated first
+  order = np.argsort(-pred_ratings[rows, candidate_items], axis=1)
 
+  return candidate_items[rows, order]
@@ -0,0 +1,161 @@
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of model refreshes, from a LocalModelStore.
+
+  python -m unittest recommendations_test
+"""
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+import recommendations
+from recommendations import LocalModelStore, Recommendations
+
+
+class RefreshTest(unittest.TestCase):
+
+  def setUp(self):
+    self.store_dir = tempfile.mkdtemp()
+    self.local_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(self.store_dir, 'model'))
+    self.store = LocalModelStore(self.store_dir)
+
+  def tearDown(self):
+    shutil.rmtree(self.store_dir)
+    shutil.rmtree(self.local_dir)
+
+  def save(self, name, array):
+    """Save an array into the store, as the trainer does."""
+    with open(os.path.join(self.store_dir, name), 'wb') as file_obj:
+      np.save(file_obj, array)
+
+  def write_manifest(self):
+    files = {}
+    for file_name in os.listdir(os.path.join(self.store_dir, 'model')):
+      name = 'model/' + file_name
+      if name == recommendations.MANIFEST_FILE:
+        continue
+      with open(os.path.join(self.store_dir, name), 'rb') as file_obj:
+        md5 = hashlib.md5(file_obj.read()).digest()
+      files[name] = base64.b64encode(md5).decode('ascii')
+    with open(os.path.join(self.store_dir, recommendations.MANIFEST_FILE),
+              'w') as file_obj:
+      json.dump({'files': files}, file_obj)
+
+  def write_model(self, seed, n_users=5, n_items=4, manifest=True):
+    """Write a model, its manifest last; return its row factors."""
+    rs = np.random.RandomState(seed)
+    row_factor = rs.rand(n_users, 3)
+    self.save(recommendations.ROW_MODEL_FILE, row_factor)
+    self.save(recommendations.COL_MODEL_FILE, rs.rand(n_items, 3))
+    self.save(recommendations.USER_MODEL_FILE, np.arange(n_users))
+    self.save(recommendations.ITEM_MODEL_FILE, np.arange(n_items))
+    with open(os.path.join(self.store_dir,
+                           recommendations.USER_ITEM_INDEX_FILE),
+              'wb') as file_obj:
+      np.savez(file_obj, indptr=np.arange(n_users + 1),
+               indices=np.arange(n_users) % n_items)
+    if manifest:
+      self.write_manifest()
+    return row_factor
+
+  def recommendations(self, **kwargs):
+    return Recommendations(self.local_dir, self.store, **kwargs)
+
+  def test_refresh_waits_for_the_manifest(self):
+    old_row_factor = self.write_model(0)
+    rec = self.recommendations()
+    # the next model is being uploaded, same shapes, manifest not written yet
+    new_row_factor = self.write_model(1, manifest=False)
+    self.assertFalse(rec.refresh())
+    np.testing.assert_array_equal(rec._model.user_factor, old_row_factor)
+
+    self.write_manifest()
+    self.assertTrue(rec.refresh())
+    np.testing.assert_array_equal(rec._model.user_factor, new_row_factor)
+    self.assertFalse(rec.refresh())
+
+  def test_refresh_rejects_files_changed_since_the_manifest(self):
+    old_row_factor = self.write_model(0)
+    rec = self.recommendations()
+    version = rec.version
+    self.write_model(1)
+    # the upload of the model after it has started
+    self.save(recommendations.ROW_MODEL_FILE, np.random.rand(5, 3))
+    with self.assertRaises(IOError):
+      rec.refresh()
+    self.assertEqual(rec.version, version)
+    np.testing.assert_array_equal(rec._model.user_factor, old_row_factor)
+
+  def test_refresh_rejects_inconsistent_model(self):
+    self.write_model(0)
+    rec = self.recommendations()
+    version = rec.version
+    self.write_model(1, n_users=6)
+    self.save(recommendations.USER_MODEL_FILE, np.arange(5))
+    self.write_manifest()
+    with self.assertRaises(ValueError):
+      rec.refresh()
+    self.assertEqual(rec.version, version)
+
+  def test_refresh_without_manifest_waits_for_two_polls(self):
+    self.write_model(0, manifest=False)
+    rec = self.recommendations()
+    new_row_factor = self.write_model(1, manifest=False)
+    self.assertFalse(rec.refresh())
+    self.assertTrue(rec.refresh())
+    np.testing.assert_array_equal(rec._model.user_factor, new_row_factor)
+
+  def cached_files(self, rec, *versions):
+    return set(os.path.basename(rec._cache_file(name, content_hash))
+               for version in versions for name, content_hash in version)
+
+  def test_prune_keeps_current_and_previous_versions(self):
+    self.write_model(0)
+    rec = self.recommendations(cache_grace_secs=0)
+    self.write_model(1)
+    rec.refresh()
+    previous = rec.version
+    self.write_model(2)
+    rec.refresh()
+    self.assertEqual(set(os.listdir(rec._cache_path)),
+                     self.cached_files(rec, rec.version, previous))
+
+  def test_prune_keeps_recently_used_files(self):
+    self.write_model(0)
+    rec = self.recommendations()
+    # fetched by another worker, for a version this one does not know
+    recent = os.path.join(rec._cache_path, 'recent.npy')
+    stale = os.path.join(rec._cache_path, 'stale.npy')
+    for path in (recent, stale):
+      open(path, 'w').close()
+    hour_ago = time.time() - 3600
+    os.utime(stale, (hour_ago, hour_ago))
+    self.write_model(1)
+    rec.refresh()
+    self.assertTrue(os.path.exists(recent))
+    self.assertFalse(os.path.exists(stale))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,7 +14,10 @@
 
 """WALS model input data, training and predict functions."""
 
+import base64
 import datetime
+import hashlib
+import json
 import numpy as np
 import os
 import pandas as pd
@@ -116,8 +119,8 @@ def _ratings_train_and_test(use_headers, delimiter, input_file):
                                'timestamp': np.int32,
                            })
 
-  np_users = ratings_df.user_id.as_matrix()
-  np_items = ratings_df.item_id.as_matrix()
+  np_users = ratings_df.user_id.values
+  np_items = ratings_df.item_id.values
   unique_users = np.unique(np_users)
   unique_items = np.unique(np_items)
 
@@ -139,23 +142,15 @@ def _ratings_train_and_test(use_headers, delimiter, input_file):
     z = np.zeros(max_item+1, dtype=int)
     z[unique_items] = np.arange(n_items)
     i_r = z[np_items]
-
-    # construct the ratings set from the three stacks
-    np_ratings = ratings_df.rating.as_matrix()
-    ratings = np.zeros((np_ratings.shape[0], 3), dtype=object)
-    ratings[:, 0] = u_r
-    ratings[:, 1] = i_r
-    ratings[:, 2] = np_ratings
   else:
-    ratings = ratings_df.as_matrix(['user_id', 'item_id', 'rating'])
     # deal with 1-based user indices
-    ratings[:, 0] -= 1
-    ratings[:, 1] -= 1
+    u_r = np_users - 1
+    i_r = np_items - 1
 
-  tr_sparse, test_sparse = _create_sparse_train_and_test(ratings,
-                                                         n_users, n_items)
+  tr_sparse, test_sparse = _create_sparse_train_and_test(
+      u_r, i_r, ratings_df.rating.values, n_users, n_items)
 
-  return ratings[:, 0], ratings[:, 1], tr_sparse, test_sparse
+  return u_r, i_r, tr_sparse, test_sparse
 
 
 def _page_views_train_and_test(input_file):
@@ -168,81 +163,67 @@ def _page_views_train_and_test(input_file):
 
   Returns:
     array of user IDs for each row of the ratings matrix
-    array of item IDs for each column of the rating matrix
+    array of item IDs for each column of the ratings matrix
     sparse coo_matrix for training
     sparse coo_matrix for test
   """
   views_df = pd.read_csv(input_file, sep=',', header=0)
+  views_df = views_df.dropna(subset=['clientId', 'contentId'])
+
+  # map user and item ids to 0-indexed matrix indexes in one vectorized pass.
+  # categories are the sorted unique ids, so codes are searchsorted indexes
+  # and preprocessing is O(r log r) instead of O(r * i log(i))
+  users = pd.Categorical(views_df.clientId)
+  items = pd.Categorical(views_df.contentId)
 
-  df_items = pd.DataFrame({'contentId': views_df.contentId.unique()})
-  df_sorted_items = df_items.sort_values('contentId').reset_index()
-  pds_items = df_sorted_items.contentId
-
-  # preprocess data. df.groupby.agg sorts clientId and contentId
-  df_user_items = views_df.groupby(['clientId', 'contentId']
-                                  ).agg({'timeOnPage': 'sum'})
-
-  # create a list of (userId, itemId, timeOnPage) ratings, where userId and
-  # clientId are 0-indexed
-  current_u = -1
-  ux = -1
-  pv_ratings = []
-  user_ux = []
-  for timeonpg in df_user_items.itertuples():
-    user = timeonpg[0][0]
-    item = timeonpg[0][1]
-
-    # as we go, build a (sorted) list of user ids
-    if user != current_u:
-      user_ux.append(user)
-      ux += 1
-      current_u = user
-
-    # this search makes the preprocessing time O(r * i log(i)),
-    # r = # ratings, i = # items
-    ix = pds_items.searchsorted(item)
-    if not isinstance(ix,int): ix = ix[0]
-    pv_ratings.append((ux, ix, timeonpg[1]))
-
-  # convert ratings list and user map to np array
-  pv_ratings = np.asarray(pv_ratings)
-  user_ux = np.asarray(user_ux)
+  # sum time on page per (user, item) pair, sorted by user then item
+  df_user_items = pd.DataFrame({
+      'ux': users.codes,
+      'ix': items.codes,
+      'timeOnPage': views_df.timeOnPage.values
+  }).groupby(['ux', 'ix'], sort=True).timeOnPage.sum()
 
   # create train and test sets
-  tr_sparse, test_sparse = _create_sparse_train_and_test(pv_ratings,
-                                                         ux + 1,
-                                                         df_items.size)
+  tr_sparse, test_sparse = _create_sparse_train_and_test(
+      df_user_items.index.get_level_values('ux').values,
+      df_user_items.index.get_level_values('ix').values,
+      df_user_items.values,
+      len(users.categories),
+      len(items.categories))
 
-  return user_ux, pds_items.as_matrix(), tr_sparse, test_sparse
+  return (np.asarray(users.categories), np.asarray(items.categories),
+          tr_sparse, test_sparse)
 
 
-def _create_sparse_train_and_test(ratings, n_users, n_items):
+def _create_sparse_train_and_test(users, items, ratings, n_users, n_items):
   """Given ratings, create sparse matrices for train and test sets.
 
   Args:
-    ratings:  list of ratings tuples  (u, i, r)
+    users:    array of user (row) index of each rating
+    items:    array of item (column) index of each rating
+    ratings:  array of rating values
     n_users:  number of users
     n_items:  number of items
 
   Returns:
      train, test sparse matrices in scipy coo_matrix format.
   """
-  # pick a random test set of entries, sorted ascending
-  test_set_size = len(ratings) / TEST_SET_RATIO
-  test_set_idx = np.random.choice(xrange(len(ratings)),
+  # pick a random test set of entries
+  test_set_size = len(ratings) // TEST_SET_RATIO
+  test_set_idx = np.random.choice(len(ratings),
                                   size=test_set_size, replace=False)
-  test_set_idx = sorted(test_set_idx)
+  test_mask = np.zeros(len(ratings), dtype=bool)
+  test_mask[test_set_idx] = True
 
-  # sift ratings into train and test sets
-  ts_ratings = ratings[test_set_idx]
-  tr_ratings = np.delete(ratings, test_set_idx, axis=0)
+  # create training and test matrices as coo_matrix's, sifting ratings into
+  # train and test sets with a boolean mask over the column arrays
+  tr_sparse = coo_matrix((ratings[~test_mask],
+                          (users[~test_mask], items[~test_mask])),
+                         shape=(n_users, n_items))
 
-  # create training and test matrices as coo_matrix's
-  u_tr, i_tr, r_tr = zip(*tr_ratings)
-  tr_sparse = coo_matrix((r_tr, (u_tr, i_tr)), shape=(n_users, n_items))
-
-  u_ts, i_ts, r_ts = zip(*ts_ratings)
-  test_sparse = coo_matrix((r_ts, (u_ts, i_ts)), shape=(n_users, n_items))
+  test_sparse = coo_matrix((ratings[test_mask],
+                            (users[test_mask], items[test_mask])),
+                           shape=(n_users, n_items))
 
   return tr_sparse, test_sparse
 
@@ -292,10 +273,13 @@ def train_model(args, tr_sparse):
   return output_row, output_col
 
 
-def save_model(args, user_map, item_map, row_factor, col_factor):
+def save_model(args, user_map, item_map, row_factor, col_factor,
+               user_items=None):
   """Save the user map, item map, row factor and column factor matrices in numpy format.
 
-  These matrices together constitute the "recommendation model."
+  These matrices together constitute the "recommendation model." A manifest
+  listing the md5 of each file is written last, the serving app only loads
+  the files it lists, so it never serves a partially uploaded model.
 
   Args:
     args:         input args to training job
@@ -303,6 +287,9 @@ def save_model(args, user_map, item_map, row_factor, col_factor):
     item_map:     item map numpy array
     row_factor:   row_factor numpy array
     col_factor:   col_factor numpy array
+    user_items:   optional list of sparse matrices of user/item ratings, e.g.
+                  train and test, saved as a CSR index of each user's rated
+                  items for the serving app
   """
   model_dir = os.path.join(args['output_dir'], 'model')
 
@@ -318,9 +305,45 @@ def save_model(args, user_map, item_map, row_factor, col_factor):
   np.save(os.path.join(model_dir, 'item'), item_map)
   np.save(os.path.join(model_dir, 'row'), row_factor)
   np.save(os.path.join(model_dir, 'col'), col_factor)
+  if user_items is not None:
+    # index the (user, item) pairs, summing the ratings would drop the pairs
+    # whose ratings add up to 0
+    user_items = [ratings.tocoo() for ratings in user_items]
+    rows = np.concatenate([ratings.row for ratings in user_items])
+    cols = np.concatenate([ratings.col for ratings in user_items])
+    user_items = coo_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                            shape=user_items[0].shape).tocsr()
+    user_items.sort_indices()
+    np.savez(os.path.join(model_dir, 'user_items'),
+             indptr=user_items.indptr.astype(np.int64),
+             indices=user_items.indices.astype(np.int64))
+
+  file_names = sorted(os.listdir(model_dir))
+  manifest_path = _write_manifest(model_dir, file_names)
 
   if gs_model_dir:
-    sh.gsutil('cp', '-r', os.path.join(model_dir, '*'), gs_model_dir)
+    sh.gsutil('cp', *([os.path.join(model_dir, f) for f in file_names] +
+                      [gs_model_dir]))
+    sh.gsutil('cp', manifest_path, gs_model_dir)
+
+
+def _write_manifest(model_dir, file_names):
+  """Write the manifest of the model files, with their base64 encoded md5.
+
+  Returns:
+    path of the manifest
+  """
+  files = {}
+  for file_name in file_names:
+    md5 = hashlib.md5()
+    with open(os.path.join(model_dir, file_name), 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+        md5.update(chunk)
+    files['model/' + file_name] = base64.b64encode(md5.digest()).decode('ascii')
+  manifest_path = os.path.join(model_dir, 'manifest.json')
+  with open(manifest_path, 'w') as f:
+    json.dump({'files': files}, f, indent=2, sort_keys=True)
+  return manifest_path
 
 
 def generate_recommendations(user_idx, user_rated, row_factor, col_factor, k):
@@ -344,7 +367,7 @@ def generate_recommendations(user_idx, user_rated, row_factor, col_factor, k):
   """
 
   # bounds checking for args
-  assert (row_factor.shape[0] - len(user_rated)) >= k
+  assert (col_factor.shape[0] - len(user_rated)) >= k
 
   # retrieve user factor
   user_f = row_factor[user_idx]
@@ -352,16 +375,17 @@ def generate_recommendations(user_idx, user_rated, row_factor, col_factor, k):
   # dot product of item factors with user factor gives predicted ratings
   pred_ratings = col_factor.dot(user_f)
 
-  # find candidate recommended item indexes sorted by predicted rating
-  k_r = k + len(user_rated)
-  candidate_items = np.argsort(pred_ratings)[-k_r:]
+  # mask out previously rated items
+  pred_ratings[np.asarray(user_rated, dtype=np.int64)] = -np.inf
 
-  # remove previously rated items and take top k
-  recommended_items = [i for i in candidate_items if i not in user_rated]
-  recommended_items = recommended_items[-k:]
-
-  # flip to sort highest rated first
-  recommended_items.reverse()
+  # find candidate recommended item indexes with a linear time partial
+  # selection instead of sorting every predicted rating
+  if k < pred_ratings.shape[0]:
+    candidate_items = np.argpartition(-pred_ratings, k - 1)[:k]
+  else:
+    candidate_items = np.arange(pred_ratings.shape[0])
 
-  return recommended_items
+  # sort only the candidates, highest rated first
+  recommended_items = candidate_items[np.argsort(-pred_ratings[candidate_items])]
 
+  return recommended_items.tolist()
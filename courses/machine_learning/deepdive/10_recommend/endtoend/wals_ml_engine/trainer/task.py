@@ -34,7 +34,8 @@ def main(args):
   output_row, output_col = model.train_model(args, tr_sparse)
 
   # save trained model to job directory
-  model.save_model(args, user_map, item_map, output_row, output_col)
+  model.save_model(args, user_map, item_map, output_row, output_col,
+                   [tr_sparse, test_sparse])
 
   # log results
   train_rmse = wals.get_rmse(output_row, output_col, tr_sparse)
@@ -20,6 +20,10 @@ import numpy as np
 import tensorflow as tf
 from tensorflow.contrib.factorization.python.ops import factorization_ops
 
+# number of ratings whose factors are gathered at once when computing rmse,
+# bounds memory to RMSE_CHUNK_SIZE * latent_factors * 2 floats
+RMSE_CHUNK_SIZE = 1000000
+
 
 def get_rmse(output_row, output_col, actual):
   """Compute rmse between predicted and actual ratings.
@@ -32,13 +36,16 @@ def get_rmse(output_row, output_col, actual):
   Returns:
     rmse
   """
-  mse = 0
-  for i in xrange(actual.data.shape[0]):
-    row_pred = output_row[actual.row[i]]
-    col_pred = output_col[actual.col[i]]
-    err = actual.data[i] - np.dot(row_pred, col_pred)
-    mse += err * err
-  mse /= actual.data.shape[0]
+  sse = 0.0
+  for start in xrange(0, actual.data.shape[0], RMSE_CHUNK_SIZE):
+    end = start + RMSE_CHUNK_SIZE
+    # gather factors of a chunk of ratings and take row-wise dot products
+    pred = np.einsum('ij,ij->i',
+                     output_row[actual.row[start:end]],
+                     output_col[actual.col[start:end]])
+    err = actual.data[start:end] - pred
+    sse += np.dot(err, err)
+  mse = sse / actual.data.shape[0]
   rmse = math.sqrt(mse)
   return rmse
 
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+'''
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Throughput and latency of the webapp's inference client against the fake
+inference server, with as many concurrent callers as webapp requests:
+
+  python3 benchmark_client.py --concurrency 1,8,32 --requests 2000
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import grpc
+import numpy as np
+from PIL import Image
+
+from tensorrtserver.api import grpc_service_pb2
+from tensorrtserver.api import grpc_service_pb2_grpc
+
+from fake_trtis_server import FakeInferenceServer, serve
+from trtis_client import TRTISClient, build_infer_request, parse_classes, parse_model, preprocess
+
+
+def predict_per_request(image_filename, server_host, server_port, model_name):
+  """
+  The previous client: a new channel, a Status RPC and a batch of 1 per image.
+  """
+  channel = grpc.insecure_channel(server_host + ':' + str(server_port))
+  try:
+    stub = grpc_service_pb2_grpc.GRPCServiceStub(channel)
+    status = stub.Status(grpc_service_pb2.StatusRequest(model_name=model_name))
+    input_name, output_name, c, h, w, format, dtype = parse_model(status, model_name, 1)
+    image_data = preprocess(Image.open(image_filename), format, dtype, c, h, w)
+    request = build_infer_request(model_name, None, input_name, output_name, [image_data.tobytes()])
+    response = stub.Infer(request)
+    return parse_classes(response.meta_data.output[0].batch_classes[0])
+  finally:
+    channel.close()
+
+
+def write_images(image_dir, num_images, seed=0):
+  rng = np.random.RandomState(seed)
+  filenames = []
+  for i in range(num_images):
+    filename = os.path.join(image_dir, 'image_{}.jpg'.format(i))
+    Image.fromarray(rng.randint(0, 256, size=(256, 256, 3), dtype=np.uint8)).save(filename)
+    filenames.append(filename)
+  return filenames
+
+
+def run_callers(predict, filenames, concurrency, num_requests):
+  """
+  Run num_requests predictions from concurrency threads, return the
+  throughput and the latencies in seconds.
+  """
+  latencies = []
+  counter = iter(range(num_requests))
+  counter_lock = threading.Lock()
+
+  def caller():
+    while True:
+      with counter_lock:
+        i = next(counter, None)
+      if i is None:
+        return
+      start = time.time()
+      predict(filenames[i % len(filenames)])
+      latencies.append(time.time() - start)
+
+  threads = [threading.Thread(target=caller) for _ in range(concurrency)]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return num_requests / (time.time() - start), np.array(latencies)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark of the TRTIS webapp client')
+  parser.add_argument('--concurrency', default='1,8,32', help='comma separated numbers of callers')
+  parser.add_argument('--requests', type=int, default=1000)
+  parser.add_argument('--port', type=int, default=18001)
+  parser.add_argument('--max_batch_size', type=int, default=64)
+  parser.add_argument('--max_delay_ms', type=float, default=5.0)
+  parser.add_argument('--base_latency_ms', type=float, default=10.0)
+  parser.add_argument('--image_latency_ms', type=float, default=0.5)
+  args = parser.parse_args()
+
+  model_name = 'resnet_graphdef'
+  servicer = FakeInferenceServer(model_name, args.max_batch_size,
+                                 base_latency_ms=args.base_latency_ms,
+                                 image_latency_ms=args.image_latency_ms)
+  server = serve(servicer, args.port)
+  image_dir = tempfile.mkdtemp()
+  try:
+    filenames = write_images(image_dir, 16)
+    print("{:>12} {:>6} {:>10} {:>9} {:>9} {:>10}".format(
+      'client', 'callers', 'images/s', 'p50_ms', 'p99_ms', 'mean_batch'))
+    for concurrency in [int(x) for x in args.concurrency.split(',')]:
+      client = TRTISClient('localhost', args.port, model_name, max_delay_ms=args.max_delay_ms)
+      for name, predict in [
+          ('per-request', lambda f: predict_per_request(f, 'localhost', args.port, model_name)),
+          ('batched', client.predict)]:
+        del servicer.batch_sizes[:]
+        throughput, latencies = run_callers(predict, filenames, concurrency, args.requests)
+        print("{:>12} {:>6} {:>10.1f} {:>9.2f} {:>9.2f} {:>10.2f}".format(
+          name, concurrency, throughput, np.percentile(latencies, 50) * 1000,
+          np.percentile(latencies, 99) * 1000, np.mean(servicer.batch_sizes)))
+      client.close()
+  finally:
+    shutil.rmtree(image_dir)
+    server.stop(0)
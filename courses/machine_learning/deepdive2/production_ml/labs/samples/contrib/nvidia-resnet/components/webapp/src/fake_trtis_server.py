@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+'''
+Copyright 2018 Google LLC
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+
+import argparse
+import logging
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+from tensorrtserver.api import grpc_service_pb2
+from tensorrtserver.api import grpc_service_pb2_grpc
+import tensorrtserver.api.model_config_pb2 as model_config
+
+
+class FakeInferenceServer(grpc_service_pb2_grpc.GRPCServiceServicer):
+  """
+  Stand-in for the TensorRT inference server to benchmark the webapp client
+  without a GPU. It serves one FP32 NHWC image classification model whose
+  batches run one at a time, each taking base_latency_ms plus
+  image_latency_ms per image, as they would on a single GPU.
+  """
+
+  def __init__(self, model_name='resnet_graphdef', max_batch_size=64, h=224, w=224, c=3,
+               num_classes=1000, base_latency_ms=10.0, image_latency_ms=0.5):
+    self.model_name = model_name
+    self.max_batch_size = max_batch_size
+    self.h, self.w, self.c = h, w, c
+    self.num_classes = num_classes
+    self.base_latency = base_latency_ms / 1000.0
+    self.image_latency = image_latency_ms / 1000.0
+    self._device = threading.Lock()
+    self.batch_sizes = []
+
+  def Status(self, request, context):
+    response = grpc_service_pb2.StatusResponse()
+    config = response.server_status.model_status[self.model_name].config
+    config.name = self.model_name
+    config.max_batch_size = self.max_batch_size
+    config.input.add(name='input', data_type=model_config.TYPE_FP32,
+                     format=model_config.ModelInput.FORMAT_NHWC, dims=[self.h, self.w, self.c])
+    config.output.add(name='output', data_type=model_config.TYPE_FP32, dims=[self.num_classes])
+    return response
+
+  def Infer(self, request, context):
+    batch_size = request.meta_data.batch_size
+    if request.model_name != self.model_name:
+      context.abort(grpc.StatusCode.NOT_FOUND, "unknown model '{}'".format(request.model_name))
+    if not 1 <= batch_size <= max(self.max_batch_size, 1):
+      context.abort(grpc.StatusCode.INVALID_ARGUMENT, "unexpected batch size {}".format(batch_size))
+    expected_bytes = batch_size * self.h * self.w * self.c * 4
+    if len(request.raw_input) != 1 or len(request.raw_input[0]) != expected_bytes:
+      context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                    "expected {} input bytes".format(expected_bytes))
+
+    with self._device:
+      time.sleep(self.base_latency + self.image_latency * batch_size)
+      self.batch_sizes.append(batch_size)
+
+    response = grpc_service_pb2.InferResponse()
+    response.meta_data.model_name = self.model_name
+    response.meta_data.batch_size = batch_size
+    for requested in request.meta_data.output:
+      output = response.meta_data.output.add(name=requested.name)
+      for _ in range(batch_size):
+        classes = output.batch_classes.add()
+        for idx in range(min(requested.cls.count, self.num_classes)):
+          classes.cls.add(idx=idx, value=1.0 / (idx + 2), label='class_{}'.format(idx))
+    return response
+
+
+def serve(servicer, port=8001, max_workers=32):
+  """
+  Start a gRPC server for servicer, returns the server.
+  """
+  server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers),
+                       options=[('grpc.max_receive_message_length', -1)])
+  grpc_service_pb2_grpc.add_GRPCServiceServicer_to_server(servicer, server)
+  server.add_insecure_port('[::]:{}'.format(port))
+  server.start()
+  return server
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Fake TensorRT inference server')
+  parser.add_argument('--port', type=int, default=8001)
+  parser.add_argument('--model_name', default='resnet_graphdef')
+  parser.add_argument('--max_batch_size', type=int, default=64)
+  parser.add_argument('--base_latency_ms', type=float, default=10.0)
+  parser.add_argument('--image_latency_ms', type=float, default=0.5)
+  args = parser.parse_args()
+
+  logging.basicConfig(level=logging.INFO)
+  server = serve(FakeInferenceServer(args.model_name, args.max_batch_size,
+                                     base_latency_ms=args.base_latency_ms,
+                                     image_latency_ms=args.image_latency_ms),
+                 args.port)
+  logging.info("Fake inference server listening on port %d", args.port)
+  server.wait_for_termination()
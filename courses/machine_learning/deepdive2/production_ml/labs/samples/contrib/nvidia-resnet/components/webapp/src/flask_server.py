@@ -19,7 +19,7 @@ import os
 # from threading import Timer
 
 from flask import Flask, render_template, request
-from trtis_client import get_prediction, random_image
+from trtis_client import TRTISClient, random_image
 
 app = Flask(__name__)
 
@@ -27,6 +27,17 @@ name_arg = os.getenv('MODEL_SERVE_NAME', 'resnet_graphdef')
 addr_arg = os.getenv('TRTSERVER_HOST', '10.110.20.210')
 port_arg = os.getenv('TRTSERVER_PORT', '8001')
 model_version = os.getenv('MODEL_VERSION', '-1')
+max_batch_size = int(os.getenv('MAX_BATCH_SIZE', '0'))  # 0 to use the model's
+max_delay_ms = float(os.getenv('MAX_BATCH_DELAY_MS', '5'))
+
+# one client for all requests, so that connections and the model
+# configuration are reused and concurrent requests are batched
+client = TRTISClient(server_host=addr_arg,
+                     server_port=int(port_arg),
+                     model_name=name_arg,
+                     model_version=int(model_version),
+                     max_batch_size=max_batch_size,
+                     max_delay_ms=max_delay_ms)
 
 # handle requests to the server
 @app.route("/")
@@ -40,11 +51,7 @@ def main():
     # get a random test MNIST image
     file_name, truth, serving_path = random_image('/workspace/web_server/static/images')
     # get prediction from TensorFlow server
-    pred, scores = get_prediction(file_name,
-                                  server_host=addr_arg,
-                                  server_port=int(port_arg),
-                                  model_name=name_arg,
-                                  model_version=int(model_version))
+    pred, scores = client.predict(file_name)
     # if no exceptions thrown, server connection was a success
     connection["text"] = "Connected (model version: {0}".format(str(model_version))+ ")"
     connection["success"] = True
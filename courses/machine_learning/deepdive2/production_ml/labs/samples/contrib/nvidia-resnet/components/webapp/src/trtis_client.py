@@ -20,8 +20,13 @@ from __future__ import print_function
 import numpy as np
 import os
 import random
+import threading
+import time
 from builtins import range
+from collections import namedtuple
+from concurrent.futures import Future
 from functools import partial
+from queue import Empty, Queue
 import grpc
 
 from tensorrtserver.api import api_pb2
@@ -32,6 +37,16 @@ import tensorrtserver.api.model_config_pb2 as model_config
 from PIL import Image
 
 
+# Number of class results to report. Default is 10 to match with demo.
+CLASS_COUNT = 10
+
+# Default deadline of the RPCs and predictions, in seconds.
+TIMEOUT = 30
+
+ModelInfo = namedtuple('ModelInfo', ['input_name', 'output_name', 'c', 'h', 'w', 'format', 'dtype',
+                                     'max_batch_size'])
+
+
 def model_dtype_to_np(model_dtype):
   if model_dtype == model_config.TYPE_BOOL:
     return np.bool
@@ -160,6 +175,26 @@ def preprocess(img, format, dtype, c, h, w):
   return scaled
 
 
+def preprocess_into(img, c, h, w, out):
+  """
+  Same as preprocess, but writes the image into out, a floating point
+  array of shape (h, w, c) that can be reused across images.
+  """
+  if c == 1:
+    sample_img = img.convert('L')
+  else:
+    sample_img = img.convert('RGB')
+
+  resized = np.asarray(sample_img.resize((w, h), Image.BILINEAR))
+  if resized.ndim == 2:
+    resized = resized[:, :, np.newaxis]
+
+  out[...] = resized
+  out /= 255
+  out -= 0.5
+  return out
+
+
 def postprocess(results, filenames, batch_size):
   """
   Post-process results to show classifications.
@@ -184,119 +219,285 @@ def postprocess(results, filenames, batch_size):
   return label[0], score
 
 
-def requestGenerator(input_name, output_name, c, h, w, format, dtype, model_name, model_version, image_filename,
-                     result_filenames):
-  # Prepare request for Infer gRPC
-  # The meta data part can be reused across requests
+def parse_classes(result):
+  """
+  Returns the top label and the scores of the classification result
+  of one image in a batch.
+  """
+  score = [{"index": cls.label, "val": cls.value} for cls in result.cls]
+  return result.cls[0].label, score
+
+
+def build_infer_request(model_name, model_version, input_name, output_name, input_batch,
+                        class_count=CLASS_COUNT):
+  """
+  Build an Infer request for a batch of preprocessed images, given as a
+  list of the bytes of each image.
+  """
   request = grpc_service_pb2.InferRequest()
   request.model_name = model_name
-  if model_version is None:
-    request.model_version = -1
-  else:
-    request.model_version = model_version
-  # optional pass in a batch size for generate requester over a set of image files, need to refactor
-  batch_size = 1
-  request.meta_data.batch_size = batch_size
+  request.model_version = -1 if model_version is None else model_version
+  request.meta_data.batch_size = len(input_batch)
   output_message = api_pb2.InferRequestHeader.Output()
   output_message.name = output_name
-  # Number of class results to report. Default is 10 to match with demo.
-  output_message.cls.count = 10
+  output_message.cls.count = class_count
   request.meta_data.output.extend([output_message])
+  request.meta_data.input.add(name=input_name)
+  request.raw_input.extend([b''.join(input_batch)])
+  return request
 
-  filenames = []
-  if os.path.isdir(image_filename):
-    filenames = [os.path.join(image_filename, f)
-                 for f in os.listdir(image_filename)
-                 if os.path.isfile(os.path.join(image_filename, f))]
-  else:
-    filenames = [image_filename, ]
-
-  filenames.sort()
 
-  # Preprocess the images into input data according to model
-  # requirements
-  image_data = []
-  for filename in filenames:
-    img = Image.open(filename)
-    image_data.append(preprocess(img, format, dtype, c, h, w))
+class TRTISClient(object):
+  """
+  Long-lived client of one model on a TensorRT inference server.
 
-  request.meta_data.input.add(name=input_name)
+  The model configuration is read once with a Status RPC, gRPC channels
+  are opened once and reused, and concurrent predictions are coalesced
+  into batches of up to the model's max_batch_size. When the server is
+  idle, the images at hand are sent right away. Otherwise a batch is sent
+  when it is full, or max_delay_ms after its first image arrived.
+  """
 
-  # Send requests of batch_size images. If the number of
-  # images isn't an exact multiple of batch_size then just
-  # start over with the first images until the batch is filled.
-  image_idx = 0
-  last_request = False
-  while not last_request:
-    input_bytes = None
-    input_filenames = []
-    del request.raw_input[:]
-    for idx in range(batch_size):
-      input_filenames.append(filenames[image_idx])
-      if input_bytes is None:
-        input_bytes = image_data[image_idx].tobytes()
-      else:
-        input_bytes += image_data[image_idx].tobytes()
-
-      image_idx = (image_idx + 1) % len(image_data)
-      if image_idx == 0:
-        last_request = True
-
-    request.raw_input.extend([input_bytes])
-    result_filenames.append(input_filenames)
-    yield request
+  def __init__(self, server_host='localhost', server_port=8001, model_name="end2end-demo",
+               model_version=None, num_channels=2, max_in_flight=4, max_batch_size=None,
+               max_delay_ms=5, class_count=CLASS_COUNT, timeout=TIMEOUT):
+    """
+    :param num_channels:   number of gRPC channels, used round robin
+    :param max_in_flight:  number of batches waiting for the server at any time
+    :param max_batch_size: upper bound of the batch size, defaults to the model's
+    :param max_delay_ms:   longest time a request waits for its batch to fill
+    :param timeout:        deadline of each RPC, and default timeout of predict(), in seconds
+    """
+    target = server_host + ':' + str(server_port)
+    # a batch of images is larger than the 4MB default limit of gRPC messages
+    options = [('grpc.max_send_message_length', -1), ('grpc.max_receive_message_length', -1)]
+    self._channels = [grpc.insecure_channel(target, options=options) for _ in range(num_channels)]
+    self._stubs = [grpc_service_pb2_grpc.GRPCServiceStub(channel) for channel in self._channels]
+    self._next_stub = 0
+    self._model_name = model_name
+    self._model_version = model_version
+    self._max_batch_size = max_batch_size
+    self._max_delay = max_delay_ms / 1000.0
+    self._class_count = class_count
+    self._timeout = timeout
+    self._max_in_flight = max_in_flight
+    self._in_flight = threading.BoundedSemaphore(max_in_flight)
+    self._num_in_flight = 0
+    self._queue = Queue()
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._model = None
+    self._batcher = None
+
+  @property
+  def model(self):
+    """
+    ModelInfo of the model, read from the server on first use.
+    """
+    if self._model is None:
+      with self._lock:
+        if self._model is None:
+          self._model = self._read_model()
+    return self._model
+
+  @property
+  def timeout(self):
+    """
+    Deadline of each RPC, and default timeout of predict(), in seconds.
+    """
+    return self._timeout
+
+  def _read_model(self):
+    # Make sure the model matches our requirements, and get some
+    # properties of the model that we need for preprocessing
+    response = self._stubs[0].Status(grpc_service_pb2.StatusRequest(model_name=self._model_name),
+                                     timeout=self._timeout)
+    input_name, output_name, c, h, w, format, dtype = parse_model(response, self._model_name, 1)
+    # images are scaled to [-0.5, 0.5] in place, which needs a floating point input
+    if dtype is None or not np.issubdtype(dtype, np.floating):
+      input_type = response.server_status.model_status[self._model_name].config.input[0].data_type
+      raise Exception("expecting a floating point input, model '" + self._model_name +
+                      "' input type is " + model_config.DataType.Name(input_type))
+    # a max_batch_size of 0 means the model does not support batching
+    max_batch_size = max(response.server_status.model_status[self._model_name].config.max_batch_size, 1)
+    if self._max_batch_size:
+      max_batch_size = min(max_batch_size, self._max_batch_size)
+    return ModelInfo(input_name, output_name, c, h, w, format, dtype, max_batch_size)
+
+  def refresh_model(self):
+    """
+    Forget the cached model configuration, e.g. after a new version was deployed.
+    """
+    with self._lock:
+      self._model = None
+
+  def preprocess(self, img):
+    """
+    Preprocess an image into a buffer kept per thread, and return its bytes.
+    """
+    model = self.model
+    buffer = getattr(self._local, 'buffer', None)
+    if buffer is None or buffer.shape != (model.h, model.w, model.c) or buffer.dtype != model.dtype:
+      buffer = self._local.buffer = np.empty((model.h, model.w, model.c), dtype=model.dtype)
+    return preprocess_into(img, model.c, model.h, model.w, buffer).tobytes()
+
+  def predict_async(self, image_filename):
+    """
+    Classify an image file.
+
+    :return: a concurrent.futures.Future of the (label, scores) of the image
+    """
+    img = Image.open(image_filename)
+    try:
+      input_bytes = self.preprocess(img)
+    finally:
+      img.close()
+    future = Future()
+    self._start_batcher()
+    self._queue.put((input_bytes, future))
+    return future
+
+  def predict(self, image_filename, timeout=None):
+    """
+    Classify an image file, waiting up to timeout seconds for the result,
+    by default the timeout of the client.
+
+    :return 0: the predicted label of the image
+    :return 1: the confidence scores of the top classes
+    """
+    if timeout is None:
+      timeout = self._timeout
+    return self.predict_async(image_filename).result(timeout)
+
+  def close(self):
+    """
+    Send the pending requests, then close the gRPC channels.
+    """
+    if self._batcher is not None:
+      self._queue.put(None)
+      self._batcher.join()
+    # wait for the batches still at the server
+    for _ in range(self._max_in_flight):
+      self._in_flight.acquire()
+    for channel in self._channels:
+      channel.close()
+
+  def _start_batcher(self):
+    if self._batcher is None:
+      with self._lock:
+        if self._batcher is None:
+          batcher = threading.Thread(target=self._batch_requests, name='trtis-batcher')
+          batcher.daemon = True
+          batcher.start()
+          self._batcher = batcher
+
+  def _batch_requests(self):
+    closing = False
+    while not closing:
+      item = self._queue.get()
+      if item is None:
+        break
+      batch = [item]
+      deadline = time.time() + self._max_delay
+      # the model was read by predict_async, unless it was refreshed since
+      max_batch_size = self._model.max_batch_size if self._model is not None else 1
+      while len(batch) < max_batch_size:
+        timeout = max(deadline - time.time(), 0) if self._num_in_flight else 0
+        try:
+          item = self._queue.get(timeout=timeout)
+        except Empty:
+          break
+        if item is None:
+          closing = True
+          break
+        batch.append(item)
+      # blocks while max_in_flight batches are at the server,
+      # the next batch keeps filling up in the meantime
+      self._in_flight.acquire()
+      self._send(batch)
+
+  def _send(self, batch):
+    self._update_in_flight(1)
+    try:
+      # reads the model again after refresh_model(), failing this batch if the server is down
+      model = self.model
+      request = build_infer_request(self._model_name, self._model_version, model.input_name,
+                                    model.output_name, [input_bytes for input_bytes, _ in batch],
+                                    self._class_count)
+      stub = self._stubs[self._next_stub]
+      self._next_stub = (self._next_stub + 1) % len(self._stubs)
+      stub.Infer.future(request, timeout=self._timeout).add_done_callback(
+        partial(self._complete, batch))
+    except Exception as e:  # pylint: disable=broad-except
+      self._update_in_flight(-1)
+      self._in_flight.release()
+      for _, future in batch:
+        future.set_exception(e)
+
+  def _update_in_flight(self, delta):
+    with self._lock:
+      self._num_in_flight += delta
+
+  def _complete(self, batch, call):
+    self._update_in_flight(-1)
+    self._in_flight.release()
+    try:
+      outputs = call.result().meta_data.output
+      if len(outputs) != 1:
+        raise Exception("expected 1 result, got {}".format(len(outputs)))
+      results = outputs[0].batch_classes
+      if len(results) != len(batch):
+        raise Exception("expected {} results, got {}".format(len(batch), len(results)))
+    except Exception as e:  # pylint: disable=broad-except
+      for _, future in batch:
+        future.set_exception(e)
+      return
+    for (_, future), result in zip(batch, results):
+      future.set_result(parse_classes(result))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(server_host='localhost', server_port=8001, model_name="end2end-demo", model_version=None):
+  """
+  Return the TRTISClient shared by all callers for a server and model.
+  """
+  key = (server_host, server_port, model_name, model_version)
+  with _clients_lock:
+    if key not in _clients:
+      _clients[key] = TRTISClient(server_host, server_port, model_name, model_version)
+    return _clients[key]
 
 
 def get_prediction(image_filename, server_host='localhost', server_port=8001,
-                   model_name="end2end-demo", model_version=None):
+                   model_name="end2end-demo", model_version=None, timeout=None):
   """
   Retrieve a prediction from a TensorFlow model server
 
-  :param image:       a end2end-demo image
+  :param image:       a end2end-demo image, or a directory of images
   :param server_host: the address of the TensorRT inference server
   :param server_port: the port used by the server
   :param model_name: the name of the model
-  :param timeout:     the amount of time to wait for a prediction to complete
-  :return 0:          the integer predicted in the end2end-demo image
+  :param timeout:     seconds to wait for each prediction, by default the timeout of the client
+  :return 0:          the integer predicted in the end2end-demo image (the last one, for a directory)
   :return 1:          the confidence scores for all classes
   """
-  channel = grpc.insecure_channel(server_host + ':' + str(server_port))
-  grpc_stub = grpc_service_pb2_grpc.GRPCServiceStub(channel)
-
-  # Prepare request for Status gRPC
-  request = grpc_service_pb2.StatusRequest(model_name=model_name)
-  # Call and receive response from Status gRPC
-  response = grpc_stub.Status(request)
-  # Make sure the model matches our requirements, and get some
-  # properties of the model that we need for preprocessing
-  batch_size = 1
-  verbose = False
-  input_name, output_name, c, h, w, format, dtype = parse_model(
-    response, model_name, batch_size, verbose)
-
-  filledRequestGenerator = partial(requestGenerator, input_name, output_name, c, h, w, format, dtype, model_name,
-                                   model_version, image_filename)
-
-  # Send requests of batch_size images. If the number of
-  # images isn't an exact multiple of batch_size then just
-  # start over with the first images until the batch is filled.
-  result_filenames = []
-  requests = []
-  responses = []
-
-  # Send request
-  for request in filledRequestGenerator(result_filenames):
-    responses.append(grpc_stub.Infer(request))
-
-  # For async, retrieve results according to the send order
-  for request in requests:
-    responses.append(request.result())
-
-  idx = 0
-  for response in responses:
-    print("Request {}, batch size {}".format(idx, batch_size))
-    label, score = postprocess(response.meta_data.output, result_filenames[idx], batch_size)
-    idx += 1
+  client = get_client(server_host, server_port, model_name, model_version)
+
+  if os.path.isdir(image_filename):
+    filenames = sorted(os.path.join(image_filename, f)
+                       for f in os.listdir(image_filename)
+                       if os.path.isfile(os.path.join(image_filename, f)))
+  else:
+    filenames = [image_filename, ]
+
+  if timeout is None:
+    timeout = client.timeout
+  futures = [client.predict_async(filename) for filename in filenames]
+  for future in futures:
+    label, score = future.result(timeout)
 
   return label, score
 
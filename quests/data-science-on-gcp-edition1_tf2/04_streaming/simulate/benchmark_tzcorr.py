@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares the time correction of df05 (a TimezoneFinder per airport and
+# datetime parsing per field) with df06 on 201501_part.csv, and checks that
+# both produce the same rows.
+
+import csv
+import gzip
+import time
+
+import df05
+import df06
+
+def read_airports(flights):
+   needed = set()
+   for line in flights:
+      fields = line.split(',')
+      needed.update([fields[6], fields[10]])
+   with gzip.open('airports.csv.gz', 'rt') as ifp:
+      return [fields for fields in csv.reader(ifp) if fields[0] in needed]
+
+def timed(fn):
+   start = time.time()
+   result = fn()
+   return result, time.time() - start
+
+def benchmark(module, airports, flights):
+   timezones, tz_secs = timed(lambda: {
+      fields[0]: module.addtimezone(fields[21], fields[26]) for fields in airports})
+   rows, tz_correct_secs = timed(lambda: [
+      row for line in flights for row in module.tz_correct(line, timezones)])
+   print('{}: {} airports/sec, {} flights/sec'.format(
+      module.__name__, int(len(airports) / tz_secs), int(len(flights) / tz_correct_secs)))
+   return rows
+
+if __name__ == '__main__':
+   with open('201501_part.csv') as ifp:
+      flights = [line.rstrip('\n') for line in ifp][1:]
+   airports = read_airports(flights)
+
+   before = benchmark(df05, airports, flights)
+   after = benchmark(df06, airports, flights)
+   print('identical output: {}'.format(before == after))
@@ -16,36 +16,79 @@
 
 import apache_beam as beam
 import csv
+import datetime
+import functools
 
 DATETIME_FORMAT='%Y-%m-%dT%H:%M:%S'
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+SECS_PER_DAY = 24 * 60 * 60
+
+_timezonefinder = None
+
+def get_timezonefinder():
+   # loading the polygon data is slow, so build one TimezoneFinder per worker
+   global _timezonefinder
+   if _timezonefinder is None:
+      import timezonefinder
+      _timezonefinder = timezonefinder.TimezoneFinder()
+   return _timezonefinder
 
 def addtimezone(lat, lon):
    try:
-      import timezonefinder
-      tf = timezonefinder.TimezoneFinder()
+      tf = get_timezonefinder()
       return (lat, lon, tf.timezone_at(lng=float(lon), lat=float(lat)))
       #return (lat, lon, 'America/Los_Angeles') # FIXME
    except ValueError:
       return (lat, lon, 'TIMEZONE') # header
 
-def as_utc(date, hhmm, tzone):
+@functools.lru_cache(maxsize=None)
+def utc_offset(tzone, date):
+   # offset in seconds of tzone at local midnight of date; there are only
+   # a few hundred timezones and dates, so each pair is computed just once
+   import pytz
+   loc_tz = pytz.timezone(tzone)
+   loc_dt = loc_tz.localize(datetime.datetime.strptime(date,'%Y-%m-%d'), is_dst=False)
+   return loc_dt.utcoffset().total_seconds()
+
+@functools.lru_cache(maxsize=None)
+def date_to_epoch_secs(date):
+   day = datetime.date(int(date[:4]), int(date[5:7]), int(date[8:10]))
+   return (day.toordinal() - EPOCH_ORDINAL) * SECS_PER_DAY
+
+@functools.lru_cache(maxsize=None)
+def epoch_days_to_date(days):
+   return datetime.date.fromordinal(EPOCH_ORDINAL + days).isoformat()
+
+def epoch_secs_to_string(secs):
+   # same as strftime(DATETIME_FORMAT) of the UTC datetime
+   days, secs = divmod(secs, SECS_PER_DAY)
+   hours, secs = divmod(secs, 3600)
+   mins, secs = divmod(secs, 60)
+   return '{}T{:02d}:{:02d}:{:02d}'.format(epoch_days_to_date(days), hours, mins, secs)
+
+def as_utc_secs(date, hhmm, tzone):
    try:
       if len(hhmm) > 0 and tzone is not None:
-         import datetime, pytz
-         loc_tz = pytz.timezone(tzone)
-         loc_dt = loc_tz.localize(datetime.datetime.strptime(date,'%Y-%m-%d'), is_dst=False)
+         offset = utc_offset(tzone, date)
          # can't just parse hhmm because the data contains 2400 and the like ...
-         loc_dt += datetime.timedelta(hours=int(hhmm[:2]), minutes=int(hhmm[2:]))
-         utc_dt = loc_dt.astimezone(pytz.utc)
-         return utc_dt.strftime(DATETIME_FORMAT), loc_dt.utcoffset().total_seconds()
+         # the offset stays the one at midnight, as when adding a timedelta
+         # to a localized datetime
+         secs = (date_to_epoch_secs(date) + 3600 * int(hhmm[:2]) +
+                 60 * int(hhmm[2:]) - int(offset))
+         return secs, offset
       else:
-         return '',0 # empty string corresponds to canceled flights
+         return None,0 # canceled flights
    except ValueError as e:
       print ('{} {} {}'.format(date, hhmm, tzone))
       raise e
 
+def as_utc(date, hhmm, tzone):
+   secs, offset = as_utc_secs(date, hhmm, tzone)
+   if secs is None:
+      return '',0 # empty string corresponds to canceled flights
+   return epoch_secs_to_string(secs), offset
+
 def add_24h_if_before(arrtime, deptime):
-   import datetime
    if len(arrtime) > 0 and len(deptime) > 0 and (arrtime < deptime):
       adt = datetime.datetime.strptime(arrtime, DATETIME_FORMAT)
       adt += datetime.timedelta(hours=24)
@@ -61,19 +104,26 @@ def tz_correct(line, airport_timezones_dict):
           return ('37.52', '-92.17', u'America/Chicago') # population center of US
    fields = line.split(',')
    if fields[0] != 'FL_DATE' and len(fields) == 27:
-      # convert all times to UTC
+      # convert all times to UTC, as seconds since the epoch
       dep_airport_id = fields[6]
       arr_airport_id = fields[10]
       dep_timezone = airport_timezone(dep_airport_id)[2] 
       arr_timezone = airport_timezone(arr_airport_id)[2]
       
+      secs = {}
       for f in [13, 14, 17]: #crsdeptime, deptime, wheelsoff
-         fields[f], deptz = as_utc(fields[0], fields[f], dep_timezone)
+         secs[f], deptz = as_utc_secs(fields[0], fields[f], dep_timezone)
       for f in [18, 20, 21]: #wheelson, crsarrtime, arrtime
-         fields[f], arrtz = as_utc(fields[0], fields[f], arr_timezone)
+         secs[f], arrtz = as_utc_secs(fields[0], fields[f], arr_timezone)
       
+      # add 24h to times that are before the departure time
+      deptime = secs[14]
       for f in [17, 18, 20, 21]:
-         fields[f] = add_24h_if_before(fields[f], fields[14])
+         if secs[f] is not None and deptime is not None and secs[f] < deptime:
+            secs[f] += SECS_PER_DAY
+
+      for f, utc_secs in secs.items():
+         fields[f] = '' if utc_secs is None else epoch_secs_to_string(utc_secs)
 
       fields.extend(airport_timezone(dep_airport_id))
       fields[-1] = str(deptz)
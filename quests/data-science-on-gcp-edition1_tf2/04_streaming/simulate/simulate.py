@@ -14,85 +14,269 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import csv
 import time
-import pytz
+import queue
 import logging
 import argparse
 import datetime
-from google.cloud import pubsub_v1 # Upgrading The Library
-import google.cloud.bigquery as bq
+import threading
+from concurrent import futures
 
 TIME_FORMAT = '%Y-%m-%d %H:%M:%S %Z'
 RFC3339_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S-00:00'
+EVENT_TYPES = ['wheelsoff', 'arrived', 'departed']
+UTC = datetime.timezone.utc
 
-def publish(publisher, topics, allevents, notify_time):
-   timestamp = notify_time.strftime(RFC3339_TIME_FORMAT)
-   for key in topics:  # 'departed', 'arrived', etc.
-      topic = topics[key]
-      events = allevents[key]
+def parse_time(timestr):
+   return datetime.datetime.strptime(timestr, TIME_FORMAT).replace(tzinfo=UTC)
+
+def bigquery_rows(bqclient, querystr, page_size):
+   # rows are (EVENT, NOTIFY_TIME, EVENT_DATA) in NOTIFY_TIME order
+   for row in bqclient.query(querystr).result(page_size=page_size):
+      yield row[0], row[1], row[2]
+
+def csv_rows(filename, startTime, endTime):
+   # same columns as the BigQuery query, e.g. exported from flights.simevents
+   # with NOTIFY_TIME formatted like '2015-05-01 00:00:00 UTC'
+   with open(filename) as ifp:
+      for fields in csv.reader(ifp):
+         if fields[0] == 'EVENT':
+            continue  # header
+         notify_time = parse_time(fields[1])
+         if startTime <= notify_time < endTime:
+            yield fields[0], notify_time, fields[2]
+
+class RowPrefetcher(object):
+   """Reads rows in pages on a background thread, a few pages ahead."""
+
+   def __init__(self, rows, page_size=10000, max_pages=4):
+      self._rows = rows
+      self._page_size = page_size
+      self._pages = queue.Queue(maxsize=max_pages)
+      self._thread = threading.Thread(target=self._fill, daemon=True)
+      self._thread.start()
+
+   def _fill(self):
+      try:
+         page = []
+         for row in self._rows:
+            page.append(row)
+            if len(page) >= self._page_size:
+               self._pages.put(page)
+               page = []
+         if page:
+            self._pages.put(page)
+         self._pages.put(None)
+      except Exception as e:
+         self._pages.put(e)
+
+   def __iter__(self):
+      while True:
+         page = self._pages.get()
+         if page is None:
+            return
+         if isinstance(page, Exception):
+            raise page
+         for row in page:
+            yield row
+
+class PubSubSink(object):
+   def __init__(self, publisher, topics):
+      self._publisher = publisher
+      self._topics = topics
+
+   def publish(self, event, event_data, timestamp):
       # the client automatically batches
-      logging.info('Publishing {} {} till {}'.format(len(events), key, timestamp))
-      for event_data in events:
-          publisher.publish(topic, event_data.encode(), EventTimeStamp=timestamp)
+      return self._publisher.publish(self._topics[event], event_data.encode(),
+                                     EventTimeStamp=timestamp)
+
+class LocalSink(object):
+   """Writes events to a local file, or just counts them if no file is given."""
+
+   def __init__(self, filename=None):
+      self._ofp = open(filename, 'w') if filename else None
+      self._lock = threading.Lock()
+
+   def publish(self, event, event_data, timestamp):
+      if self._ofp:
+         with self._lock:
+            self._ofp.write('{},{},{}\n'.format(event, timestamp, event_data))
+      future = futures.Future()
+      future.set_result(None)
+      return future
+
+   def close(self):
+      if self._ofp:
+         self._ofp.close()
+
+class ReplayStats(object):
+   def __init__(self):
+      self.published = 0
+      self.failed = 0
+      self.max_lag_secs = 0
+      self.first_time = None
+      self.last_time = None
+      self.wall_secs = 0
+
+   def target_rate(self, speedFactor):
+      if not self.first_time or self.last_time == self.first_time:
+         return float('inf')
+      sim_secs = (self.last_time - self.first_time).total_seconds()
+      return self.published * speedFactor / sim_secs
+
+   def achieved_rate(self):
+      return self.published / self.wall_secs if self.wall_secs > 0 else float('inf')
+
+   def report(self, speedFactor):
+      logging.info('Published {} events ({} failed) at {:.1f} events/sec, target {:.1f} '
+                   'events/sec; max lag {:.2f} seconds'.format(
+                      self.published, self.failed, self.achieved_rate(),
+                      self.target_rate(speedFactor), self.max_lag_secs))
+
+class Replayer(object):
+   """Releases events to a sink at speedFactor times their event-time rate.
+
+   Release times are scheduled against a monotonic clock, so the replay does
+   not drift, and at most max_in_flight publishes are outstanding at once:
+   when the sink falls behind, the replay waits instead of buffering without
+   limit. Events due within the next second are released together; events
+   already due are released right away, and at most max_in_flight events are
+   held back.
+   """
+
+   def __init__(self, sink, speedFactor, max_in_flight=1000, report_secs=60):
+      self._sink = sink
+      self._speedFactor = speedFactor
+      self._in_flight = threading.BoundedSemaphore(max_in_flight)
+      self._max_in_flight = max_in_flight
+      self._report_secs = report_secs
+      self._lock = threading.Lock()
+      self.stats = ReplayStats()
+
+   def _done(self, future):
+      self._in_flight.release()
+      if future.exception() is not None:
+         with self._lock:
+            self.stats.failed += 1
+         logging.warning('Publish failed: {}'.format(future.exception()))
+
+   def publish(self, tonotify, notify_time):
+      timestamp = notify_time.strftime(RFC3339_TIME_FORMAT)
+      logging.debug('Publishing {} events till {}'.format(len(tonotify), timestamp))
+      for event, event_data in tonotify:
+         self._in_flight.acquire()  # backpressure
+         future = self._sink.publish(event, event_data, timestamp)
+         future.add_done_callback(self._done)
+      self.stats.published += len(tonotify)
+
+   def wait(self):
+      # wait for all outstanding publishes to complete
+      for _ in range(self._max_in_flight):
+         self._in_flight.acquire()
+      for _ in range(self._max_in_flight):
+         self._in_flight.release()
+
+   def replay(self, rows, simStartTime):
+      wall_start = time.monotonic()
+      next_report = wall_start + self._report_secs
+      tonotify = []
+      notify_time = simStartTime
+      for event, notify_time, event_data in rows:
+         if self.stats.first_time is None:
+            self.stats.first_time = notify_time
+         self.stats.last_time = notify_time
+
+         # when should this event be released?
+         due = wall_start + (notify_time - simStartTime).total_seconds() / self._speedFactor
+         now = time.monotonic()
+         if due - now > 1:
+            # notify the accumulated tonotify, then sleep till this event is due
+            self.publish(tonotify, notify_time)
+            tonotify = []
+            to_sleep_secs = due - time.monotonic()
+            if to_sleep_secs > 0:
+               time.sleep(to_sleep_secs)
+         elif now - due > self.stats.max_lag_secs:
+            self.stats.max_lag_secs = now - due
+         tonotify.append((event, event_data))
+
+         if due <= now or len(tonotify) >= self._max_in_flight:
+            # behind schedule: release now, the semaphore provides the backpressure
+            self.publish(tonotify, notify_time)
+            tonotify = []
+
+         if now > next_report:
+            self.stats.wall_secs = now - wall_start
+            self.stats.report(self._speedFactor)
+            next_report = now + self._report_secs
+
+      # left-over records; notify again
+      self.publish(tonotify, notify_time)
+      self.wait()
+      self.stats.wall_secs = time.monotonic() - wall_start
+      self.stats.report(self._speedFactor)
+      return self.stats
 
 def notify(publisher, topics, rows, simStartTime, programStart, speedFactor):
-   # sleep computation
-   def compute_sleep_secs(notify_time):
-        time_elapsed = (datetime.datetime.utcnow() - programStart).total_seconds()
-        sim_time_elapsed = (notify_time - simStartTime).total_seconds() / speedFactor
-        to_sleep_secs = sim_time_elapsed - time_elapsed
-        return to_sleep_secs
-
-   tonotify = {}
-   for key in topics:
-     tonotify[key] = list()
-
-   for row in rows:
-       event, notify_time, event_data = row
-
-       # how much time should we sleep?
-       if compute_sleep_secs(notify_time) > 1:
-          # notify the accumulated tonotify
-          publish(publisher, topics, tonotify, notify_time)
-          for key in topics:
-             tonotify[key] = list()
-
-          # recompute sleep, since notification takes a while
-          to_sleep_secs = compute_sleep_secs(notify_time)
-          if to_sleep_secs > 0:
-             logging.info('Sleeping {} seconds'.format(to_sleep_secs))
-             time.sleep(to_sleep_secs)
-       tonotify[event].append(event_data)
-
-   # left-over records; notify again
-   publish(publisher, topics, tonotify, notify_time)
+   # programStart is no longer needed: the replay keeps its own monotonic clock
+   replayer = Replayer(PubSubSink(publisher, topics), speedFactor)
+   return replayer.replay(rows, simStartTime)
+
+def create_topics(project):
+   from google.cloud import pubsub_v1 # Upgrading The Library
+   # create one Pub/Sub notification topic for each type of event
+   publisher = pubsub_v1.PublisherClient()
+   topics = {}
+   for event_type in EVENT_TYPES:
+       topics[event_type] = publisher.topic_path(project, event_type)
+       try:
+         publisher.get_topic(request={"topic": topics[event_type]})
+       except Exception:
+         #Creating New topics
+           publisher.create_topic(request={"name": topics[event_type]})
+   return publisher, topics
 
 
 if __name__ == '__main__':
    parser = argparse.ArgumentParser(description='Send simulated flight events to Cloud Pub/Sub')
    parser.add_argument('--startTime', help='Example: 2015-05-01 00:00:00 UTC', required=True)
    parser.add_argument('--endTime', help='Example: 2015-05-03 00:00:00 UTC', required=True)
-   parser.add_argument('--project', help='your project id, to create pubsub topic', required=True)
+   parser.add_argument('--project', help='your project id, to create pubsub topic; not needed with --input and --sink=local')
    parser.add_argument('--speedFactor', help='Example: 60 implies 1 hour of data sent to Cloud Pub/Sub in 1 minute', required=True, type=float)
    parser.add_argument('--jitter', help='type of jitter to add: None, uniform, exp  are the three options', default='None')
+   parser.add_argument('--input', help='CSV file of EVENT,NOTIFY_TIME,EVENT_DATA rows to replay instead of querying BigQuery')
+   parser.add_argument('--sink', help='pubsub, or local to write events to --output (or just count them)', default='pubsub', choices=['pubsub', 'local'])
+   parser.add_argument('--output', help='file written by the local sink')
+   parser.add_argument('--maxInFlight', help='maximum number of publishes awaiting acknowledgement', default=1000, type=int)
+   parser.add_argument('--pageSize', help='number of rows prefetched at a time', default=10000, type=int)
 
-   # set up BigQuery bqclient
    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
    args = parser.parse_args()
-   bqclient = bq.Client(args.project)
-   dataset =  bqclient.get_dataset( bqclient.dataset('flights') )  # throws exception on failure
-
-   # jitter?
-   if args.jitter == 'exp':
-      jitter = 'CAST (-LN(RAND()*0.99 + 0.01)*30 + 90.5 AS INT64)'
-   elif args.jitter == 'uniform':
-      jitter = 'CAST(90.5 + RAND()*30 AS INT64)'
+   if args.project is None and (args.input is None or args.sink == 'pubsub'):
+      parser.error('--project is required to read from BigQuery or publish to Pub/Sub')
+   simStartTime = parse_time(args.startTime)
+   simEndTime = parse_time(args.endTime)
+
+   if args.input:
+      rows = csv_rows(args.input, simStartTime, simEndTime)
    else:
-      jitter = '0'
+      # set up BigQuery bqclient
+      import google.cloud.bigquery as bq
+      bqclient = bq.Client(args.project)
+      dataset =  bqclient.get_dataset( bqclient.dataset('flights') )  # throws exception on failure
+
+      # jitter?
+      if args.jitter == 'exp':
+         jitter = 'CAST (-LN(RAND()*0.99 + 0.01)*30 + 90.5 AS INT64)'
+      elif args.jitter == 'uniform':
+         jitter = 'CAST(90.5 + RAND()*30 AS INT64)'
+      else:
+         jitter = '0'
 
 
-   # run the query to pull simulated events
-   querystr = """
+      # run the query to pull simulated events
+      querystr = """
 SELECT
   EVENT,
   TIMESTAMP_ADD(NOTIFY_TIME, INTERVAL {} SECOND) AS NOTIFY_TIME,
@@ -105,25 +289,18 @@ WHERE
 ORDER BY
   NOTIFY_TIME ASC
 """
-   rows = bqclient.query(querystr.format(jitter,
-                                         args.startTime,
-                                         args.endTime))
+      rows = bigquery_rows(bqclient,
+                           querystr.format(jitter, args.startTime, args.endTime),
+                           args.pageSize)
 
-   # create one Pub/Sub notification topic for each type of event
-   publisher = pubsub_v1.PublisherClient()
-   topics = {}
-   for event_type in ['wheelsoff', 'arrived', 'departed']:
-       topics[event_type] = publisher.topic_path(args.project, event_type)
-       try:
-         # Getting the new topics from PubSub
-          for topic in publisher.list_topics(request={"project": project_path}):
-                print(topic)
-       except:
-         #Creating New topics
-           publisher.create_topic(request={"name": topics[event_type]})
+   if args.sink == 'local':
+      sink = LocalSink(args.output)
+   else:
+      sink = PubSubSink(*create_topics(args.project))
 
    # notify about each row in the dataset
-   programStartTime = datetime.datetime.utcnow()
-   simStartTime = datetime.datetime.strptime(args.startTime, TIME_FORMAT).replace(tzinfo=pytz.UTC)
    print('Simulation start time is {}'.format(simStartTime))
-   notify(publisher, topics, rows, simStartTime, programStartTime, args.speedFactor)
+   replayer = Replayer(sink, args.speedFactor, max_in_flight=args.maxInFlight)
+   replayer.replay(RowPrefetcher(rows, page_size=args.pageSize), simStartTime)
+   if args.sink == 'local':
+      sink.close()
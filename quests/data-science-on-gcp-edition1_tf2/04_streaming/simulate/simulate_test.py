@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3 -m unittest simulate_test
+
+import datetime
+import threading
+import time
+import unittest
+from concurrent import futures
+
+from simulate import LocalSink, Replayer, UTC
+
+class SlowLocalSink(LocalSink):
+   """Completes each publish after delay_secs, like a sink that cannot keep up."""
+
+   def __init__(self, delay_secs, workers=4):
+      super().__init__()
+      self._delay_secs = delay_secs
+      self._executor = futures.ThreadPoolExecutor(workers)
+      self._count_lock = threading.Lock()
+      self.received = 0
+      self.outstanding = 0
+      self.max_outstanding = 0
+
+   def _complete(self):
+      time.sleep(self._delay_secs)
+      with self._count_lock:
+         self.outstanding -= 1
+
+   def publish(self, event, event_data, timestamp):
+      with self._count_lock:
+         self.received += 1
+         self.outstanding += 1
+         self.max_outstanding = max(self.max_outstanding, self.outstanding)
+      return self._executor.submit(self._complete)
+
+def simulated_rows(num_rows, start, spacing_secs, sink, held_back):
+   """Rows spacing_secs apart in event time; records how many rows the sink has not seen yet."""
+   for i in range(num_rows):
+      held_back.append(i - sink.received)
+      yield 'departed', start + datetime.timedelta(seconds=i * spacing_secs), 'row{}'.format(i)
+
+class ReplayerTest(unittest.TestCase):
+
+   def test_lagging_replay_streams_with_bounded_buffer(self):
+      start = datetime.datetime(2015, 5, 1, tzinfo=UTC)
+      # 2000 events in 2000 simulated seconds, replayed in 0.2 seconds: the
+      # sink takes at least 2000 * 1ms / 4 workers = 0.5 seconds, so the
+      # replay falls behind right away
+      sink = SlowLocalSink(delay_secs=0.001)
+      max_in_flight = 50
+      held_back = []
+      replayer = Replayer(sink, speedFactor=10000, max_in_flight=max_in_flight)
+      stats = replayer.replay(simulated_rows(2000, start, 1, sink, held_back), start)
+
+      self.assertEqual(stats.published, 2000)
+      self.assertEqual(sink.received, 2000)
+      self.assertEqual(stats.failed, 0)
+      self.assertGreater(stats.max_lag_secs, 0)
+      self.assertLessEqual(sink.max_outstanding, max_in_flight)
+      # events reach the sink while the input is still being read ...
+      self.assertGreater(2000 - held_back[-1], 1000)
+      # ... and the replay never holds more than max_in_flight events back
+      self.assertLessEqual(max(held_back), max_in_flight)
+
+   def test_on_schedule_replay_waits_for_event_time(self):
+      start = datetime.datetime(2015, 5, 1, tzinfo=UTC)
+      sink = SlowLocalSink(delay_secs=0)
+      # 3 events 1 simulated minute apart, at 30x: 4 seconds of replay
+      replayer = Replayer(sink, speedFactor=30)
+      wall_start = time.monotonic()
+      stats = replayer.replay(simulated_rows(3, start, 60, sink, []), start)
+      self.assertEqual(stats.published, 3)
+      self.assertGreaterEqual(time.monotonic() - wall_start, 3)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,90 @@
+# Measures DirectRunner throughput of CommonLog decoding, comparing the original per-message
+# json.loads/CommonLog(**row) DoFn with the batched, schema-aware ConvertToCommonLogFn, and
+# reports how many batches had messages falling back to the per-message decoding.
+# Generate the events first with the bulk generator, e.g.
+#
+#   python3 ../../bulk_event_generator.py --taxonomy ../../taxonomy.json --users_fp users.csv -e 200000 -o events
+#   python3 benchmark_common_log.py --input events.json --malformed 0.01
+
+import argparse
+import json
+import random
+import time
+
+import apache_beam as beam
+from apache_beam.metrics.metric import MetricsFilter
+from apache_beam.options.pipeline_options import PipelineOptions
+
+from streaming_minute_traffic_pipeline import CommonLog, ConvertToCommonLogFn, CountPerWindow
+
+
+class PerMessageConvertFn(beam.DoFn):
+    """The original decoder, kept as the baseline."""
+
+    def process(self, element):
+        try:
+            row = json.loads(element.decode('utf-8'))
+            yield beam.pvalue.TaggedOutput('parsed_row', CommonLog(**row))
+        except:
+            yield beam.pvalue.TaggedOutput('unparsed_row', element.decode('utf-8'))
+
+
+def read_messages(path, malformed, seed):
+    rng = random.Random(seed)
+    messages = []
+    with open(path, 'rb') as f:
+        for line in f:
+            message = line.rstrip(b'\n')
+            if rng.random() < malformed:
+                message = message[:rng.randrange(len(message))]
+            messages.append(message)
+    return messages
+
+
+def run_decoder(messages, decoder, pre_aggregate, direct_num_workers):
+    """
+    :return: the seconds taken, and the values of the decoder's counters
+    """
+    options = PipelineOptions(runner='DirectRunner', direct_num_workers=direct_num_workers)
+    start = time.time()
+    p = beam.Pipeline(options=options)
+    rows = (p
+            | 'Create' >> beam.Create(messages, reshuffle=False)
+            | 'Decode' >> beam.ParDo(decoder).with_outputs('parsed_row', 'unparsed_row'))
+    rows.parsed_row | 'CountParsed' >> CountPerWindow(pre_aggregate)
+    rows.unparsed_row | 'CountUnparsed' >> CountPerWindow(pre_aggregate)
+    result = p.run()
+    result.wait_until_finish()
+    secs = time.time() - start
+    counters = result.metrics().query(MetricsFilter().with_step('Decode'))['counters']
+    return secs, dict((counter.key.metric.name, counter.committed) for counter in counters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CommonLog decoding throughput')
+    parser.add_argument('--input', required=True, help='Newline-delimited JSON events')
+    parser.add_argument('--malformed', type=float, default=0.01,
+                        help='Fraction of messages to truncate into malformed JSON')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--direct_num_workers', type=int, default=1)
+    parser.add_argument('--batch_size', type=int, default=500)
+    args = parser.parse_args()
+
+    messages = read_messages(args.input, args.malformed, args.seed)
+    print('{} messages'.format(len(messages)))
+    for name, decoder, pre_aggregate in [
+            ('per-message', PerMessageConvertFn(), False),
+            ('batched', ConvertToCommonLogFn(args.batch_size), False),
+            ('batched+pre-aggregate', ConvertToCommonLogFn(args.batch_size), True)]:
+        secs, counters = run_decoder(messages, decoder, pre_aggregate, args.direct_num_workers)
+        line = '{:>24} {:8.2f}s {:10.0f} messages/s'.format(name, secs, len(messages) / secs)
+        if counters:
+            batches = counters.get('batches', 0)
+            fallback_batches = counters.get('fallback_batches', 0)
+            line += '  {} batches: {} in one pass, {} with {} messages decoded alone'.format(
+                batches, batches - fallback_batches, fallback_batches, counters.get('fallback_messages', 0))
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
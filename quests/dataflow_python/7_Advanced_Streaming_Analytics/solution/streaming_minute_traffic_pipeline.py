@@ -2,10 +2,13 @@ import argparse
 import time
 import logging
 import json
+import operator
 import typing
 from datetime import datetime
 import apache_beam as beam
 from apache_beam.io import fileio
+from apache_beam.metrics import Metrics
+from apache_beam.utils.windowed_value import WindowedValue
 from apache_beam.options.pipeline_options import GoogleCloudOptions
 from apache_beam.options.pipeline_options import PipelineOptions
 from apache_beam.options.pipeline_options import StandardOptions
@@ -29,13 +32,162 @@ class CommonLog(typing.NamedTuple):
 
 beam.coders.registry.register_coder(CommonLog, beam.coders.RowCoder)
 
-class ConvertToCommonLogFn(beam.DoFn):
-  def process(self, element):
+COMMON_LOG_FIELDS = CommonLog._fields
+COMMON_LOG_TYPES = tuple(CommonLog.__annotations__[f] for f in COMMON_LOG_FIELDS)
+get_common_log_values = operator.itemgetter(*COMMON_LOG_FIELDS)
+FLOAT_FIELD_INDEXES = [i for i, t in enumerate(COMMON_LOG_TYPES) if t is float]
+
+# reason codes of rows sent to the dead-letter output
+INVALID_UTF8 = 'INVALID_UTF8'
+INVALID_JSON = 'INVALID_JSON'
+NOT_AN_OBJECT = 'NOT_AN_OBJECT'
+WRONG_FIELDS = 'WRONG_FIELDS'
+WRONG_TYPE = 'WRONG_TYPE'
+
+_json_decoder = json.JSONDecoder()
+
+
+def to_common_log(row):
+    """Validates a decoded JSON value against the CommonLog fields.
+
+    Returns a (CommonLog, None) pair, or (None, reason code) if the row is malformed.
+    """
+    if not isinstance(row, dict):
+        return None, NOT_AN_OBJECT
+    if len(row) != len(COMMON_LOG_FIELDS):
+        return None, WRONG_FIELDS
     try:
-        row = json.loads(element.decode('utf-8'))
-        yield beam.pvalue.TaggedOutput('parsed_row', CommonLog(**row))
-    except:
-        yield beam.pvalue.TaggedOutput('unparsed_row', element.decode('utf-8'))
+        values = get_common_log_values(row)
+    except KeyError:
+        return None, WRONG_FIELDS
+    if tuple(map(type, values)) != COMMON_LOG_TYPES:
+        # JSON numbers without a fraction decode to int, which is fine for float fields
+        values = list(values)
+        for i in FLOAT_FIELD_INDEXES:
+            if type(values[i]) is int:
+                values[i] = float(values[i])
+        if tuple(map(type, values)) != COMMON_LOG_TYPES:
+            return None, WRONG_TYPE
+    return CommonLog._make(values), None
+
+
+def dead_letter(message, reason):
+    return json.dumps({'reason': reason, 'message': message})
+
+
+class ConvertToCommonLogFn(beam.DoFn):
+    """Decodes Pub/Sub messages into CommonLog rows, a batch of messages at a time.
+
+    The messages of an ASCII batch are joined into one string once, and each one is decoded
+    in place, and only accepted if its JSON value spans exactly the bytes of the message.
+    Messages that are not decoded this way, or batches that are not ASCII, fall back to
+    decoding one message at a time. Malformed messages go to the 'unparsed_row' output with
+    a reason code. The 'batches', 'fallback_batches' and 'fallback_messages' counters tell
+    how often the fallback was taken.
+    """
+
+    def __init__(self, max_batch_size=500):
+        self._max_batch_size = max_batch_size
+        self._batches = Metrics.counter(self.__class__, 'batches')
+        self._fallback_batches = Metrics.counter(self.__class__, 'fallback_batches')
+        self._fallback_messages = Metrics.counter(self.__class__, 'fallback_messages')
+
+    def start_bundle(self):
+        self._batch = []
+
+    def process(self, element, timestamp=beam.DoFn.TimestampParam, window=beam.DoFn.WindowParam):
+        self._batch.append((element, timestamp, window))
+        if len(self._batch) >= self._max_batch_size:
+            for output in self._flush():
+                yield output
+
+    def finish_bundle(self):
+        for output in self._flush():
+            yield output
+
+    def _flush(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        joined = b','.join([element for element, _, _ in batch])
+        # for ASCII, byte offsets of the messages are also string offsets
+        text = joined.decode('ascii') if joined.isascii() else None
+
+        fallbacks = 0
+        start = 0
+        for element, timestamp, window in batch:
+            end = start + len(element)
+            row_end = None
+            if text is not None:
+                try:
+                    row, row_end = _json_decoder.raw_decode(text, start)
+                except ValueError:
+                    pass
+            if row_end == end:
+                parsed, reason = to_common_log(row)
+            else:
+                # malformed, or several values, or surrounded by whitespace
+                fallbacks += 1
+                parsed, reason = self._decode(element)
+            start = end + 1
+
+            if parsed is not None:
+                yield beam.pvalue.TaggedOutput('parsed_row', WindowedValue(parsed, timestamp, [window]))
+            else:
+                message = element.decode('utf-8', errors='replace')
+                yield beam.pvalue.TaggedOutput('unparsed_row',
+                                               WindowedValue(dead_letter(message, reason), timestamp, [window]))
+
+        self._batches.inc()
+        if fallbacks:
+            self._fallback_batches.inc()
+            self._fallback_messages.inc(fallbacks)
+
+    @staticmethod
+    def _decode(element):
+        try:
+            text = element.decode('utf-8')
+        except UnicodeDecodeError:
+            return None, INVALID_UTF8
+        try:
+            row = json.loads(text)
+        except ValueError:
+            return None, INVALID_JSON
+        return to_common_log(row)
+
+
+class PartialCountFn(beam.DoFn):
+    """Counts rows per window within a bundle, emitting one partial count per window.
+
+    This lifts the counting ahead of the shuffle by hand, so that only the partial counts
+    need to be summed by a single global combine, which keeps late firings correct.
+    """
+
+    def start_bundle(self):
+        self._counts = {}
+
+    def process(self, element, window=beam.DoFn.WindowParam):
+        self._counts[window] = self._counts.get(window, 0) + 1
+
+    def finish_bundle(self):
+        counts, self._counts = self._counts, {}
+        for window, count in counts.items():
+            yield WindowedValue(count, window.max_timestamp(), [window])
+
+
+class CountPerWindow(beam.PTransform):
+    """Counts rows per window, optionally pre-aggregating the counts of each bundle."""
+
+    def __init__(self, pre_aggregate=False):
+        super().__init__()
+        self._pre_aggregate = pre_aggregate
+
+    def expand(self, rows):
+        if not self._pre_aggregate:
+            return rows | 'Count' >> beam.CombineGlobally(CountCombineFn()).without_defaults()
+        return (rows
+                | 'PartialCount' >> beam.ParDo(PartialCountFn())
+                | 'SumPartialCounts' >> beam.CombineGlobally(sum).without_defaults())
 
 
 class GetTimestampFn(beam.DoFn):
@@ -63,6 +215,8 @@ def run():
     parser.add_argument('--input_topic', required=True, help='Input Pub/Sub topic')
     parser.add_argument('--allowed_lateness', required=True, help='Allowed lateness')
     parser.add_argument('--dead_letter_bucket', required=True, help='GCS Bucket for unparsable Pub/Sub messages')
+    parser.add_argument('--pre_aggregate', action='store_true',
+                        help='Count rows per bundle before the per-minute count')
 
     opts, pipeline_opts = parser.parse_known_args()
 
@@ -121,7 +275,7 @@ def run():
                                               trigger=AfterWatermark(late=AfterCount(1)),
                                               allowed_lateness=int(allowed_lateness),
                                               accumulation_mode=AccumulationMode.ACCUMULATING)
-        | "CountPerMinute" >> beam.CombineGlobally(CountCombineFn()).without_defaults()
+        | "CountPerMinute" >> CountPerWindow(opts.pre_aggregate)
         | "AddWindowTimestamp" >> beam.ParDo(GetTimestampFn())
         | 'WriteAggToBQ' >> beam.io.WriteToBigQuery(
             table_name,
@@ -0,0 +1,171 @@
+# Generates millions of CommonLog events at once, as reproducible fixtures for load testing the
+# batch and streaming traffic pipelines. Users walk the taxonomy exactly as in the other event
+# generators, but all users take each step together as NumPy array operations.
+
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+
+from event_simulator import Taxonomy, read_users, min_file_size_bytes, max_file_size_bytes, \
+    responses, log_fields
+
+parser = argparse.ArgumentParser(__file__, description="bulk_event_generator")
+parser.add_argument("--taxonomy", "-x", dest="taxonomy_fp",
+                    help="A .json file representing a taxonomy of web resources",
+                    default="taxonomy.json")
+parser.add_argument("--users_fp", "-u", dest="users_fp",
+                    help="A .csv file of users",
+                    default="users.csv")
+parser.add_argument("--num_e", "-e", dest="num_events", type=int,
+                    help="The number of events to generate", default=1000000)
+parser.add_argument("--seed", dest="seed", type=int,
+                    help="Seed for the random number generator", default=0)
+parser.add_argument("--start_time", dest="start_time",
+                    help="Timestamp of the start of the simulation",
+                    default="2021-01-01T00:00:00")
+parser.add_argument("--format", dest="output_format", choices=["json", "parquet"],
+                    help="Write newline-delimited JSON or Parquet shards (Parquet needs pyarrow)", default="json")
+parser.add_argument("--out", "-o", dest="out_prefix",
+                    help="Prefix of the output shards", default="events")
+parser.add_argument("--num_shards", dest="num_shards", type=int,
+                    help="The number of output shards", default=1)
+
+page_read_secs = 5
+
+
+def next_page_table(taxonomy):
+    """
+    Pads the taxonomy's next pages into a matrix so that a step can be taken for all users at once
+    :return: matrix of next pages, one row per page, and the number of valid entries in each row
+    """
+    num_next_pages = np.array([len(pages) for pages in taxonomy.next_pages])
+    table = np.zeros((len(taxonomy.next_pages), num_next_pages.max()), dtype=np.int32)
+    for page, pages in enumerate(taxonomy.next_pages):
+        table[page, :len(pages)] = pages
+    return table, num_next_pages
+
+
+def generate_events(users, taxonomy, num_events, seed=0, start_time="2021-01-01T00:00:00",
+                    mean_secs_between_events=page_read_secs):
+    """
+    Generates @num_events events from @users, in timestamp order. Events are cut at a time every
+    user is still browsing, so that the last events come from all users and not only the slowest
+    :return: a dictionary of equal length arrays, one per CommonLog field
+    """
+    rng = np.random.default_rng(seed)
+    num_users = len(users)
+    table, num_next_pages = next_page_table(taxonomy)
+
+    # every user starts on the home page and takes one step per event
+    page = np.zeros(num_users, dtype=np.int32)
+    elapsed = np.zeros(num_users)
+    page_chunks, time_chunks = [], []
+    num_steps = -(-num_events // num_users)
+    while True:
+        pages = np.empty((num_steps, num_users), dtype=np.int32)
+        for step in range(num_steps):
+            choice = (rng.random(num_users) * num_next_pages[page]).astype(np.int32)
+            page = table[page, choice]
+            pages[step] = page
+        page_chunks.append(pages)
+
+        # time spent reading each page, in seconds since the start
+        gaps = rng.uniform(0, mean_secs_between_events * 2, size=(num_steps, num_users))
+        times = elapsed + np.cumsum(gaps, axis=0)
+        elapsed = times[-1]
+        time_chunks.append(times)
+
+        # take more steps until num_events events happen before the slowest user's last one
+        horizon = elapsed.min()
+        if sum(np.count_nonzero(chunk <= horizon) for chunk in time_chunks) >= num_events:
+            break
+        num_steps = max(num_steps // 10, 1)
+
+    pages = np.concatenate(page_chunks)
+    # in microseconds since the start
+    offsets = (np.concatenate(time_chunks) * 1e6).astype(np.int64).ravel()
+
+    # keep the earliest num_events events, all before the horizon
+    order = np.argsort(offsets, kind="stable")[:num_events]
+    user_idx = order % num_users
+    timestamps = np.datetime64(start_time, "us") + offsets[order].astype("timedelta64[us]")
+
+    def user_column(name, convert=str):
+        return np.array([convert(user[name]) for user in users], dtype=object)[user_idx]
+
+    return {
+        "ip": user_column("ip"),
+        "user_id": user_column("id"),
+        "lat": user_column("lat", float).astype(np.float64),
+        "lng": user_column("lng", float).astype(np.float64),
+        "timestamp": np.char.add(np.datetime_as_string(timestamps, unit="us"), "Z"),
+        "http_request": np.array(taxonomy.http_requests, dtype=object)[pages.ravel()[order]],
+        "http_response": rng.choice(responses, size=len(order)),
+        "num_bytes": rng.integers(min_file_size_bytes, max_file_size_bytes, size=len(order)),
+        "user_agent": user_column("user_agent"),
+    }
+
+
+def write_json(events, filename):
+    # json.dumps only for the few distinct strings, then join the lines
+    quoted = {}
+
+    def quote(s):
+        if s not in quoted:
+            quoted[s] = json.dumps(s)
+        return quoted[s]
+
+    with open(filename, "w") as fp:
+        fp.writelines(
+            '{{"ip": {}, "user_id": {}, "lat": {!r}, "lng": {!r}, "timestamp": "{}", "http_request": {}, '
+            '"http_response": {}, "num_bytes": {}, "user_agent": {}}}\n'.format(
+                quote(ip), quote(user_id), lat, lng, timestamp, quote(http_request),
+                http_response, num_bytes, quote(user_agent))
+            for ip, user_id, lat, lng, timestamp, http_request, http_response, num_bytes, user_agent
+            in zip(*[events[field].tolist() for field in log_fields]))
+
+
+def write_parquet(events, filename):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.table({field: events[field].astype(str) if events[field].dtype.kind in "OU"
+                      else events[field] for field in log_fields})
+    pq.write_table(table, filename)
+
+
+def write_shards(events, out_prefix, num_shards, output_format):
+    """
+    Splits the events into @num_shards contiguous shards
+    :return: list of filenames written
+    """
+    writer, extension = (write_json, "json") if output_format == "json" else (write_parquet, "parquet")
+    num_events = len(events["timestamp"])
+    bounds = np.linspace(0, num_events, num_shards + 1).astype(int)
+    filenames = []
+    for shard in range(num_shards):
+        filename = "{}-{:05d}-of-{:05d}.{}".format(out_prefix, shard, num_shards, extension)
+        if num_shards == 1:
+            filename = "{}.{}".format(out_prefix, extension)
+        writer({field: column[bounds[shard]:bounds[shard + 1]] for field, column in events.items()},
+               filename)
+        filenames.append(filename)
+    return filenames
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    users = read_users(args.users_fp)
+    taxonomy = Taxonomy.from_file(args.taxonomy_fp)
+
+    start = time.monotonic()
+    events = generate_events(users, taxonomy, args.num_events, args.seed, args.start_time)
+    generated = time.monotonic()
+    filenames = write_shards(events, args.out_prefix, args.num_shards, args.output_format)
+    written = time.monotonic()
+    logging.info("Generated %d events in %.1f seconds (%.0f events/sec), wrote %s in %.1f seconds",
+                 args.num_events, generated - start, args.num_events / (generated - start),
+                 ", ".join(filenames), written - generated)
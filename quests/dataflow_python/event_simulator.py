@@ -0,0 +1,250 @@
+# Simulates many website users in a single process. Each user is a small piece of state in a
+# priority queue keyed by the time of their next event, so 100k+ users need no OS processes.
+
+import heapq
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+min_file_size_bytes = 100
+max_file_size_bytes = 500
+verbs = ["GET"]
+responses = [200]
+
+log_fields = ["ip", "user_id", "lat", "lng", "timestamp", "http_request",
+              "http_response", "num_bytes", "user_agent"]
+
+timestamp_format = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+class Taxonomy(object):
+    """
+    Read-only taxonomy of web resources shared by all users. Pages are numbered, and for each page
+    the pages a user can go to next (itself, its children and its parent) are precomputed.
+    """
+
+    def __init__(self, json_data):
+        self.uris = []
+        self.next_pages = []
+        parents = []
+        children = []
+        stack = [(json_data, None)]
+        while stack:
+            node, parent = stack.pop()
+            page = len(self.uris)
+            self.uris.append(str(node["name"]))
+            parents.append(parent)
+            children.append([])
+            if parent is not None:
+                children[parent].append(page)
+            for child in reversed(node.get("children", [])):
+                stack.append((child, page))
+        for page in range(len(self.uris)):
+            next_pages = [page] + children[page]
+            if parents[page] is not None:
+                next_pages.append(parents[page])
+            self.next_pages.append(tuple(next_pages))
+        self.http_requests = tuple("\"{} {} HTTP/1.0\"".format(verb, uri)
+                                   for uri in self.uris for verb in verbs)
+
+    @classmethod
+    def from_file(cls, taxonomy_filepath):
+        """
+        Reads a .json representing a taxonomy
+        :param taxonomy_filepath: a string representing a path to a .json file
+        :return: Taxonomy whose page 0 is the root of the taxonomic tree
+        """
+        with open(taxonomy_filepath, 'r') as fp:
+            return cls(json.load(fp))
+
+    def get_next_page(self, page, rng):
+        """
+        Determines the next page that a user on @page visits
+        """
+        return rng.choice(self.next_pages[page])
+
+    def http_request(self, page, rng):
+        return self.http_requests[page * len(verbs) + rng.randrange(len(verbs))]
+
+
+def read_users(users_fp):
+    """
+    Reads a .csv from @user_fp representing users into a list of dictionaries,
+    each elt of which represents a user
+    :param user_fp: a .csv file where each line represents a user
+    :return: a list of dictionaries
+    """
+    users = []
+    with open(users_fp, 'r') as fp:
+        fields = fp.readline().rstrip().split(",")
+        for line in fp:
+            user = dict(zip(fields, line.rstrip().split(",")))
+            users.append(user)
+    return users
+
+
+class UserState(object):
+    __slots__ = ["ip", "id", "lat", "lng", "user_agent", "page", "is_online", "offline_events"]
+
+    def __init__(self, user):
+        self.ip = user['ip']
+        self.id = user['id']
+        self.lat = float(user['lat'])
+        self.lng = float(user['lng'])
+        self.user_agent = user['user_agent']
+        self.page = 0
+        self.is_online = True
+        self.offline_events = []
+
+
+class JsonLinesWriter(object):
+    """
+    Writes events as lines of JSON through a single buffered file
+    """
+
+    def __init__(self, filename, buffer_size=1 << 20):
+        self.fp = open(filename, 'w', buffering=buffer_size)
+
+    def write_burst(self, burst):
+        self.fp.write(''.join(json.dumps(event_dict) + '\n' for event_dict in burst))
+
+    def close(self):
+        self.fp.close()
+
+
+class PubSubWriter(object):
+    """
+    Publishes events through one batching PubSub publisher, with a bounded number of
+    messages awaiting acknowledgement
+    """
+
+    def __init__(self, project_id, topic_name, max_in_flight=10000):
+        from google.cloud import pubsub_v1
+        self.publisher = pubsub_v1.PublisherClient(
+            batch_settings=pubsub_v1.types.BatchSettings(max_messages=1000, max_latency=0.05),
+            publisher_options=pubsub_v1.types.PublisherOptions(
+                flow_control=pubsub_v1.types.PublishFlowControl(
+                    message_limit=max_in_flight,
+                    limit_exceeded_behavior=pubsub_v1.types.LimitExceededBehavior.BLOCK)))
+        self.topic_path = self.publisher.topic_path(project_id, topic_name)
+
+    def write_burst(self, burst):
+        for event_dict in burst:
+            data = json.dumps(event_dict).encode('utf-8')
+            self.publisher.publish(self.topic_path, data=data, timestamp=event_dict['timestamp'])
+
+    def close(self):
+        self.publisher.stop()
+
+
+class UserSimulator(object):
+    """
+    Simulates users browsing the taxonomy, going offline and online, and writing their events.
+
+    In realtime mode users wait in wall-clock time between events, events are timestamped with the
+    current time and each burst is written after a random lag of up to @max_lag_secs. Otherwise the
+    clock is simulated, so events are generated as fast as possible with timestamps spaced as if
+    users were reading pages.
+    """
+
+    def __init__(self, users, taxonomy, writer, online_to_offline_probability,
+                 offline_to_online_probability, mean_secs_between_events=5,
+                 max_lag_secs=0, realtime=True, seed=None, report_secs=10):
+        self.users = [UserState(user) for user in users]
+        self.taxonomy = taxonomy
+        self.writer = writer
+        self.online_to_offline_probability = online_to_offline_probability
+        self.offline_to_online_probability = offline_to_online_probability
+        self.mean_secs_between_events = mean_secs_between_events
+        self.max_lag_secs = max_lag_secs
+        self.realtime = realtime
+        self.report_secs = report_secs
+        self.rng = random.Random(seed)
+        self.num_events = 0
+        self._queue = []
+        self._seq = 0
+
+    def _schedule(self, when, user_idx, burst=None):
+        # the sequence number breaks ties without comparing users or bursts
+        self._seq += 1
+        heapq.heappush(self._queue, (when, self._seq, user_idx, burst))
+
+    def _emit(self, burst, now):
+        if self.max_lag_secs > 0:
+            self._schedule(now + self.rng.uniform(0, self.max_lag_secs), -1, burst)
+        else:
+            self.writer.write_burst(burst)
+            self.num_events += len(burst)
+
+    def generate_event(self, user, event_time):
+        """
+        Returns a dictionary representing an event
+        """
+        rng = self.rng
+        user.page = self.taxonomy.get_next_page(user.page, rng)
+        return dict(zip(log_fields, [
+            user.ip, user.id, user.lat, user.lng, event_time.strftime(timestamp_format),
+            self.taxonomy.http_request(user.page, rng), rng.choice(responses),
+            rng.randrange(min_file_size_bytes, max_file_size_bytes), user.user_agent]))
+
+    def step(self, user_idx, now, event_time):
+        user = self.users[user_idx]
+        prob = self.rng.random()
+        event = self.generate_event(user, event_time)
+        if user.is_online:
+            if prob < self.online_to_offline_probability:
+                user.is_online = False
+                user.offline_events = [event]
+            else:
+                self._emit([event], now)
+        else:
+            user.offline_events.append(event)
+            if prob < self.offline_to_online_probability:
+                user.is_online = True
+                self._emit(user.offline_events, now)
+                user.offline_events = []
+
+    def run(self, max_num_events=None):
+        """
+        Runs until more than @max_num_events events have been written, or forever if None
+        :return: the number of events written
+        """
+        max_secs = self.mean_secs_between_events * 2
+        start_clock = time.monotonic()
+        start_time = datetime.now()
+        next_report = start_clock + self.report_secs
+        for user_idx in range(len(self.users)):
+            self._schedule(self.rng.uniform(0, max_secs), user_idx)
+
+        while self._queue and (max_num_events is None or self.num_events <= max_num_events):
+            when, _, user_idx, burst = heapq.heappop(self._queue)
+            if self.realtime:
+                wait_secs = start_clock + when - time.monotonic()
+                if wait_secs > 0:
+                    time.sleep(wait_secs)
+            if user_idx < 0:
+                self.writer.write_burst(burst)
+                self.num_events += len(burst)
+                continue
+
+            if self.realtime:
+                event_time = datetime.now(tz=timezone.utc)
+            else:
+                event_time = start_time + timedelta(seconds=when)
+            self.step(user_idx, when, event_time)
+            self._schedule(when + self.rng.uniform(0, max_secs), user_idx)
+
+            now = time.monotonic()
+            if now > next_report:
+                self.report(now - start_clock)
+                next_report = now + self.report_secs
+
+        self.report(time.monotonic() - start_clock)
+        return self.num_events
+
+    def report(self, elapsed_secs):
+        logging.info("%d events from %d users in %.1f seconds: %.0f events/sec",
+                     self.num_events, len(self.users), elapsed_secs,
+                     self.num_events / elapsed_secs if elapsed_secs > 0 else 0)
@@ -3,3 +3,4 @@ pip3 install -q anytree
 pip3 install -q --upgrade google-cloud-pubsub
 pip3 install -q faker
 pip3 install -q --upgrade geocoder
+pip3 install -q numpy